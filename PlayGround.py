@@ -1,25 +1,31 @@
 # gui.py
-import os
-import re
-import threading
 import logging
 import streamlit as st
 from pathlib import Path
-import json
 from datetime import datetime
 
 # Make sure all source files are in a directory named 'src'
-from src.database import init_mysql_database, save_interaction
-from src.models import initialize_models_and_index
-from src.indexing import initial_scan_and_index, force_reindex
+from src.database import save_interaction, DEFAULT_SQLITE_PATH
+from src.models import DEFAULT_LLM_PARAMS
+from src.tuning import load_llm_profile
+from src.rerank import DEFAULT_RERANK_MODEL
+from src.embedding_service import batcher as embedding_batcher
+from src.shards import ShardedFAISS, ROOT_SHARD
+from src.knowledge_collections import manager as collection_manager, DEFAULT_COLLECTION
+from src.indexing import initial_scan_and_index, force_reindex, rebuild_shard
 from src.ragForGui import answer_query
-from src.file_watcher import start_file_watcher_background
+from src.startup import STAGES
+from src import hot_reload
+from src import chat_sessions
+from src.metrics_sampler import sampler as metrics_sampler
+from src import tracing
 
 # ---------------------------------------
 # --- App Configuration & Initialization ---
 # ---------------------------------------
 
 SESSIONS_DIR = "chat_sessions"
+SESSIONS_PER_PAGE = 20
 
 # Set default values in session_state. This makes them accessible across all pages.
 if 'KNOWLEDGE_DIR' not in st.session_state:
@@ -42,6 +48,69 @@ if 'CHUNK_SIZE' not in st.session_state:
     st.session_state.CHUNK_SIZE = 1000
 if 'CHUNK_OVERLAP' not in st.session_state:
     st.session_state.CHUNK_OVERLAP = 150
+if 'RETRIEVAL_K' not in st.session_state:
+    st.session_state.RETRIEVAL_K = 4
+if 'MAX_NEW_TOKENS' not in st.session_state:
+    st.session_state.MAX_NEW_TOKENS = 512
+if 'COMPRESS_CONTEXT' not in st.session_state:
+    st.session_state.COMPRESS_CONTEXT = False
+if 'COMPRESSION_RATIO' not in st.session_state:
+    st.session_state.COMPRESSION_RATIO = 0.5
+if 'USE_RERANK' not in st.session_state:
+    st.session_state.USE_RERANK = False
+if 'RERANK_MODEL' not in st.session_state:
+    st.session_state.RERANK_MODEL = DEFAULT_RERANK_MODEL
+if 'RERANK_CANDIDATES' not in st.session_state:
+    st.session_state.RERANK_CANDIDATES = 50
+if 'RERANK_BUDGET_MS' not in st.session_state:
+    st.session_state.RERANK_BUDGET_MS = 300
+if 'USE_CONFIDENCE_GATE' not in st.session_state:
+    st.session_state.USE_CONFIDENCE_GATE = True
+if 'GATE_THRESHOLD' not in st.session_state:
+    st.session_state.GATE_THRESHOLD = 0.0
+if 'HYBRID_SEARCH' not in st.session_state:
+    st.session_state.HYBRID_SEARCH = True
+if 'LOAD_LLM' not in st.session_state:
+    st.session_state.LOAD_LLM = True
+if 'EXTRACTIVE_MODE' not in st.session_state:
+    st.session_state.EXTRACTIVE_MODE = False
+if 'EMBED_BATCH_SIZE' not in st.session_state:
+    st.session_state.EMBED_BATCH_SIZE = 32
+if 'EMBED_BATCH_WAIT_MS' not in st.session_state:
+    st.session_state.EMBED_BATCH_WAIT_MS = 5
+if 'USE_ANSWER_CACHE' not in st.session_state:
+    st.session_state.USE_ANSWER_CACHE = True
+if 'ANSWER_CACHE_THRESHOLD' not in st.session_state:
+    st.session_state.ANSWER_CACHE_THRESHOLD = 0.92
+if 'SHARD_BY_FOLDER' not in st.session_state:
+    st.session_state.SHARD_BY_FOLDER = False
+if 'COLLECTION' not in st.session_state:
+    st.session_state.COLLECTION = DEFAULT_COLLECTION
+if 'COLLECTION_MEMORY_MB' not in st.session_state:
+    st.session_state.COLLECTION_MEMORY_MB = 2048
+if 'SEARCH_FILTERS' not in st.session_state:
+    st.session_state.SEARCH_FILTERS = {}
+
+# llama.cpp runtime parameters; a calibrated profile for this host overrides thread/batch defaults.
+_llm_profile = load_llm_profile() or {}
+if 'N_CTX' not in st.session_state:
+    st.session_state.N_CTX = DEFAULT_LLM_PARAMS["n_ctx"]
+if 'N_BATCH' not in st.session_state:
+    st.session_state.N_BATCH = _llm_profile.get("n_batch", DEFAULT_LLM_PARAMS["n_batch"])
+if 'N_THREADS' not in st.session_state:
+    st.session_state.N_THREADS = _llm_profile.get("n_threads", DEFAULT_LLM_PARAMS["n_threads"])
+if 'N_GPU_LAYERS' not in st.session_state:
+    st.session_state.N_GPU_LAYERS = DEFAULT_LLM_PARAMS["n_gpu_layers"]
+if 'USE_MMAP' not in st.session_state:
+    st.session_state.USE_MMAP = DEFAULT_LLM_PARAMS["use_mmap"]
+if 'USE_MLOCK' not in st.session_state:
+    st.session_state.USE_MLOCK = DEFAULT_LLM_PARAMS["use_mlock"]
+if 'KV_CACHE_TYPE' not in st.session_state:
+    st.session_state.KV_CACHE_TYPE = DEFAULT_LLM_PARAMS["kv_cache_type"]
+if 'STORAGE_BACKEND' not in st.session_state:
+    st.session_state.STORAGE_BACKEND = "mysql"
+if 'SQLITE_PATH' not in st.session_state:
+    st.session_state.SQLITE_PATH = DEFAULT_SQLITE_PATH
 if 'MYSQL_HOST' not in st.session_state:
     st.session_state.MYSQL_HOST = "localhost"
 if 'MYSQL_USER' not in st.session_state:
@@ -55,63 +124,63 @@ if 'MYSQL_PORT' not in st.session_state:
 
 
 # --- SESSION MANAGEMENT FUNCTIONS ---
-def get_sorted_sessions():
-    """Gets a list of session files sorted by modification time (newest first)."""
-    Path(SESSIONS_DIR).mkdir(exist_ok=True)
-    files = Path(SESSIONS_DIR).glob("*.json")
-    return sorted(files, key=os.path.getmtime, reverse=True)
-
-def load_chat_history(session_path):
-    """Loads chat history from a session file."""
-    if session_path.exists():
-        with open(session_path, 'r') as f:
-            return json.load(f)
-    return []
-
-def save_chat_history(session_path, messages):
-    """Saves chat history to a session file."""
-    Path(SESSIONS_DIR).mkdir(exist_ok=True)
-    with open(session_path, 'w') as f:
-        json.dump(messages, f, indent=4)
+def get_session_page(page, search=None):
+    """Gets one page of the session catalog (most recently updated first) and the number of matching sessions."""
+    return chat_sessions.list_sessions(SESSIONS_DIR, page * SESSIONS_PER_PAGE, SESSIONS_PER_PAGE, search)
+
+def load_chat_history(session_path, last=chat_sessions.RECENT_MESSAGES):
+    """Loads the most recent messages of a session and remembers how many there are in total."""
+    messages, total = chat_sessions.load_messages(session_path, last)
+    st.session_state.message_total = total
+    return messages
+
+def save_chat_history(session_path, message):
+    """Appends a message to a session log."""
+    chat_sessions.append_message(session_path, message)
+    st.session_state.message_total = st.session_state.get("message_total", 0) + 1
 
 def create_new_session():
     """Creates a new chat session and switches to it."""
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    new_session_path = Path(SESSIONS_DIR) / f"session_{timestamp}.json"
+    new_session_path = Path(SESSIONS_DIR) / f"session_{timestamp}{chat_sessions.SESSION_SUFFIX}"
     st.session_state.messages = []
-    save_chat_history(new_session_path, [])
+    st.session_state.message_total = 0
+    chat_sessions.create_session(new_session_path)
     st.session_state.current_session = new_session_path
     st.session_state.renaming_session = None
     st.rerun()
 
-def switch_session(session_path):
-    """Switches to a different chat session."""
+def switch_session(session_path, from_message=None):
+    """Switches to a different chat session, loading at least everything from message number from_message on."""
+    last = chat_sessions.RECENT_MESSAGES
+    if from_message is not None:
+        last = max(last, chat_sessions.message_count(session_path) - from_message)
     st.session_state.current_session = session_path
-    st.session_state.messages = load_chat_history(session_path)
+    st.session_state.messages = load_chat_history(session_path, last)
     st.session_state.renaming_session = None
 
 def rename_session(old_path, new_name):
-    """Renames a session file."""
-    if not new_name.endswith('.json'):
-        new_name += '.json'
+    """Renames a session log."""
+    if not new_name.endswith(chat_sessions.SESSION_SUFFIX):
+        new_name += chat_sessions.SESSION_SUFFIX
     new_path = old_path.parent / new_name
     if new_path.exists():
         st.error("A session with this name already exists.")
         return
-    os.rename(old_path, new_path)
+    chat_sessions.rename_session(old_path, new_path)
     st.session_state.current_session = new_path
     st.session_state.renaming_session = None
     st.rerun()
 
 def delete_session(session_path):
-    """Deletes a session file."""
-    os.remove(session_path)
+    """Deletes a session log."""
+    chat_sessions.delete_session(session_path)
     st.session_state.renaming_session = None
-    sessions = get_sorted_sessions()
-    if not sessions:
+    latest = chat_sessions.latest_session(SESSIONS_DIR)
+    if latest is None:
         create_new_session()
     else:
-        switch_session(sessions[0])
+        switch_session(latest)
     st.rerun()
 
 
@@ -119,64 +188,30 @@ def delete_session(session_path):
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 @st.cache_resource
-def load_resources(knowledge_dir, index_path, llm_model_path, embedding_model_name, chunk_size, chunk_overlap, mysql_host, mysql_user, mysql_password, mysql_database, mysql_port):
-    """Loads all expensive resources once and caches them."""
-    logging.info(f"--- Initializing all resources for KNOWLEDGE_DIR: {knowledge_dir} ---")
-    Path(knowledge_dir).mkdir(parents=True, exist_ok=True)
-    
-    mysql_config = {
-        "host": mysql_host,
-        "user": mysql_user,
-        "password": mysql_password,
-        "database": mysql_database,
-        "port": mysql_port
-    }
-
-    try:
-        init_mysql_database(mysql_config)
-    except Exception as e:
-        logging.warning(f"MySQL init failed: {e}. Continuing without database logging.")
-    
-    models_initialized = initialize_models_and_index(
-        llm_model_path=llm_model_path, 
-        embedding_model_name=embedding_model_name, 
-        index_path=index_path,
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
-    )
-    
-    if not models_initialized:
-        st.error("Failed to initialize models. The application cannot continue.")
-        st.stop()
-    
-    initial_scan_and_index(knowledge_dir, index_path)
-    start_file_watcher_background(knowledge_dir, index_path)
-    logging.info("--- All resources initialized ---")
-    return True
-
-# Load all resources once at the start of the app
-load_resources(
-    st.session_state.KNOWLEDGE_DIR,
-    st.session_state.INDEX_PATH,
-    st.session_state.LLM_MODEL_PATH,
-    st.session_state.EMBEDDING_MODEL_NAME,
-    st.session_state.CHUNK_SIZE,
-    st.session_state.CHUNK_OVERLAP,
-    st.session_state.MYSQL_HOST,
-    st.session_state.MYSQL_USER,
-    st.session_state.MYSQL_PASSWORD,
-    st.session_state.MYSQL_DATABASE,
-    st.session_state.MYSQL_PORT
-)
+def load_resources(_settings):
+    """
+    Starts loading all expensive resources in the background once and caches the readiness state.
+    Later settings changes are applied in place by hot_reload.apply_settings, so the settings are not part of the cache key.
+    """
+    # Tracing is process-wide; afterwards only the Settings page changes it.
+    tracing.configure_from_env()
+    return hot_reload.start(_settings)
+
+# Start loading all resources once; the UI renders immediately and reports readiness
+startup_state = load_resources(hot_reload.runtime_settings(st.session_state))
+metrics_sampler.start()
+
+embedding_batcher.configure(st.session_state.EMBED_BATCH_SIZE, st.session_state.EMBED_BATCH_WAIT_MS)
+collection_manager.configure(st.session_state.COLLECTION_MEMORY_MB)
 
 # Initialize session state for chat
-if 'sessions' not in st.session_state:
-    st.session_state.sessions = get_sorted_sessions()
+if 'session_page' not in st.session_state:
+    st.session_state.session_page = 0
 
 if 'current_session' not in st.session_state or not st.session_state.current_session.exists():
-    sessions = get_sorted_sessions()
-    if sessions:
-        st.session_state.current_session = sessions[0]
+    latest = chat_sessions.latest_session(SESSIONS_DIR)
+    if latest is not None:
+        st.session_state.current_session = latest
     else:
         if 'creating_new' not in st.session_state:
             st.session_state.creating_new = True
@@ -197,16 +232,26 @@ with st.sidebar:
     if st.button("➕ New Chat"):
         create_new_session()
 
-    st.session_state.sessions = get_sorted_sessions() # Refresh session list
-    
-    for session in st.session_state.sessions:
+    session_search = st.text_input("Find session", key="session_search", placeholder="Name or first question")
+    if session_search != st.session_state.get("last_session_search"):
+        st.session_state.last_session_search = session_search
+        st.session_state.session_page = 0
+    sessions, session_total = get_session_page(st.session_state.session_page, session_search.strip() or None)
+    page_count = max(1, -(-session_total // SESSIONS_PER_PAGE))
+    if st.session_state.session_page > page_count - 1:
+        # Deletions or a narrower search left fewer pages than the one being shown.
+        st.session_state.session_page = page_count - 1
+        sessions, session_total = get_session_page(st.session_state.session_page, session_search.strip() or None)
+
+    for entry in sessions:
+        session = entry["path"]
         col1, col2, col3 = st.columns([0.6, 0.2, 0.2])
         session_name = session.stem
         with col1:
             if session == st.session_state.current_session:
                 st.markdown(f"**> {session_name}**")
             else:
-                if st.button(session_name, key=f"switch_{session.name}"):
+                if st.button(session_name, key=f"switch_{session.name}", help=entry["title"] or None):
                     switch_session(session)
                     st.rerun()
         with col2:
@@ -217,6 +262,31 @@ with st.sidebar:
             if st.button("🗑️", key=f"delete_{session.name}"):
                 delete_session(session)
 
+    if page_count > 1:
+        col1, col2, col3 = st.columns([0.3, 0.4, 0.3])
+        with col1:
+            if st.button("◀", key="sessions_prev", disabled=st.session_state.session_page == 0):
+                st.session_state.session_page -= 1
+                st.rerun()
+        with col2:
+            st.caption(f"Page {st.session_state.session_page + 1} of {page_count}")
+        with col3:
+            if st.button("▶", key="sessions_next", disabled=st.session_state.session_page >= page_count - 1):
+                st.session_state.session_page += 1
+                st.rerun()
+
+    message_search = st.text_input("Search all chats", key="message_search", placeholder="Words from a question or answer")
+    if message_search.strip():
+        hits = chat_sessions.search_messages(SESSIONS_DIR, message_search)
+        if not hits:
+            st.caption("No matching messages.")
+        for i, hit in enumerate(hits):
+            speaker = "You" if hit["role"] == "user" else "Assistant"
+            if st.button(f"{hit['session']} · {speaker}", key=f"search_hit_{i}", help=hit["snippet"]):
+                switch_session(hit["path"], from_message=hit["seq"])
+                st.rerun()
+            st.caption(hit["snippet"])
+
     if st.session_state.renaming_session:
         st.header("Rename Session")
         new_name = st.text_input("New name", value=st.session_state.renaming_session.stem)
@@ -229,6 +299,56 @@ with st.sidebar:
                 st.session_state.renaming_session = None
                 st.rerun()
 
+    st.divider()
+    st.header("Answer Options")
+    st.session_state.EXTRACTIVE_MODE = st.toggle(
+        "Extractive answers (no LLM)",
+        value=st.session_state.EXTRACTIVE_MODE or not st.session_state.LOAD_LLM,
+        disabled=not st.session_state.LOAD_LLM,
+        help="Returns the most relevant passages with the best-matching sentences highlighted, in well under a second."
+    )
+    st.session_state.USE_ANSWER_CACHE = st.toggle(
+        "Reuse answers to similar questions",
+        value=st.session_state.USE_ANSWER_CACHE,
+        help="Skips the LLM when an equivalent question was already answered from the same, unchanged documents."
+    )
+
+    st.divider()
+    st.header("Search Filters")
+    collection_names = collection_manager.names()
+    if len(collection_names) > 1:
+        st.session_state.COLLECTION = st.selectbox(
+            "Collection",
+            collection_names,
+            index=collection_names.index(st.session_state.COLLECTION) if st.session_state.COLLECTION in collection_names else 0,
+            help="The knowledge collection to answer from. Collections are loaded on first use."
+        )
+    metadata_index = collection_manager.metadata_index(st.session_state.COLLECTION)
+    folder_options = [""] + metadata_index.folders()
+    current_folder = st.session_state.SEARCH_FILTERS.get("folder", "")
+    folder = st.selectbox(
+        "Folder",
+        folder_options,
+        index=folder_options.index(current_folder) if current_folder in folder_options else 0,
+        format_func=lambda f: f or "All folders",
+        help="Only search documents in this folder and its subfolders."
+    )
+    extension_options = metadata_index.extensions()
+    extensions = st.multiselect(
+        "File types",
+        extension_options,
+        default=[e for e in st.session_state.SEARCH_FILTERS.get("extensions", []) if e in extension_options]
+    )
+    filter_by_date = st.checkbox("Only files modified between", value="modified_from" in st.session_state.SEARCH_FILTERS)
+    filters = {"folder": folder, "extensions": extensions}
+    if filter_by_date:
+        today = datetime.now().date()
+        date_range = st.date_input("Modified", value=(today.replace(year=today.year - 1), today), label_visibility="collapsed")
+        if isinstance(date_range, tuple) and len(date_range) == 2:
+            filters["modified_from"] = datetime.combine(date_range[0], datetime.min.time()).timestamp()
+            filters["modified_to"] = datetime.combine(date_range[1], datetime.max.time()).timestamp()
+    st.session_state.SEARCH_FILTERS = {key: value for key, value in filters.items() if value}
+
     st.divider()
     st.header("Admin Controls")
     if st.button("Forcefully Re-index Knowledge Base"):
@@ -236,12 +356,58 @@ with st.sidebar:
             force_reindex(st.session_state.INDEX_PATH)
             initial_scan_and_index(st.session_state.KNOWLEDGE_DIR, st.session_state.INDEX_PATH)
         st.success("Re-indexing complete!")
+    default_db = (collection_manager.state(DEFAULT_COLLECTION) or {}).get("db")
+    if isinstance(default_db, ShardedFAISS):
+        shard = st.selectbox("Index shard", sorted(default_db.shards), format_func=lambda n: "(root files)" if n == ROOT_SHARD else n)
+        if shard and st.button("Re-index This Folder Only"):
+            with st.spinner(f"Re-indexing '{shard}'..."):
+                rebuild_shard(shard, st.session_state.KNOWLEDGE_DIR, st.session_state.INDEX_PATH)
+            st.success(f"Shard '{shard}' re-indexed.")
 
 # --- MAIN CHAT INTERFACE ---
 st.title("🧠 SynthCerebrum")
 st.caption("Your offline AI assistant, powered by local documents.")
 
-# Display chat messages
+STAGE_LABELS = {
+    "database": "Database",
+    "index": "Index",
+    "retrieval": "Retrieval",
+    "llm": "LLM",
+    "scan": "Knowledge scan",
+}
+
+@st.fragment(run_every=2)
+def render_startup_status():
+    """Shows which resources are usable while background initialization is running."""
+    snapshot = startup_state.snapshot()
+    if startup_state.all_settled() and not snapshot["errors"]:
+        return
+    cols = st.columns(len(STAGES))
+    for col, stage in zip(cols, STAGES):
+        if snapshot["ready"][stage]:
+            col.success(f"{STAGE_LABELS[stage]} ready ({snapshot['timings'][stage]:.0f}s)")
+        elif stage in snapshot["disabled"]:
+            col.info(f"{STAGE_LABELS[stage]} disabled")
+        elif stage in snapshot["errors"]:
+            col.error(f"{STAGE_LABELS[stage]} unavailable")
+        else:
+            col.info(f"{STAGE_LABELS[stage]} loading...")
+    for stage, error in snapshot["errors"].items():
+        st.caption(f"{STAGE_LABELS[stage]}: {error}")
+    if not snapshot["ready"]["llm"] and "llm" not in snapshot["disabled"] and snapshot["ready"]["retrieval"]:
+        st.caption("The LLM is still loading; questions are answered with the most relevant passages for now.")
+
+render_startup_status()
+
+# Display chat messages; older ones are loaded only on request.
+earlier = st.session_state.get("message_total", 0) - len(st.session_state.messages)
+if earlier > 0:
+    if st.button(f"Show earlier messages ({earlier} more)"):
+        st.session_state.messages = load_chat_history(
+            st.session_state.current_session, len(st.session_state.messages) + chat_sessions.RECENT_MESSAGES
+        )
+        st.rerun()
+
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
@@ -252,15 +418,40 @@ for message in st.session_state.messages:
 
 # Main chat input
 if user_question := st.chat_input("Ask a question about your documents..."):
-    st.session_state.messages.append({"role": "user", "content": user_question})
-    save_chat_history(st.session_state.current_session, st.session_state.messages)
+    user_message = {"role": "user", "content": user_question}
+    st.session_state.messages.append(user_message)
+    save_chat_history(st.session_state.current_session, user_message)
     with st.chat_message("user"):
         st.markdown(user_question)
 
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
         with st.spinner("Thinking..."):
-            answer, sources = answer_query(user_question.strip(), st.session_state.SYSTEM_PROMPT, k=4)
+            interaction_stats = {}
+            if not startup_state.is_ready("retrieval"):
+                answer, sources = "The knowledge base is still loading. Please try again in a moment.", []
+            else:
+                answer, sources = answer_query(
+                    user_question.strip(),
+                    st.session_state.SYSTEM_PROMPT,
+                    k=st.session_state.RETRIEVAL_K,
+                    use_cache=st.session_state.USE_ANSWER_CACHE,
+                    cache_threshold=st.session_state.ANSWER_CACHE_THRESHOLD,
+                    hybrid=st.session_state.HYBRID_SEARCH,
+                    max_new_tokens=st.session_state.MAX_NEW_TOKENS,
+                    compress=st.session_state.COMPRESS_CONTEXT,
+                    compression_ratio=st.session_state.COMPRESSION_RATIO,
+                    use_rerank=st.session_state.USE_RERANK,
+                    rerank_candidates=st.session_state.RERANK_CANDIDATES,
+                    rerank_model=st.session_state.RERANK_MODEL,
+                    rerank_budget_ms=st.session_state.RERANK_BUDGET_MS,
+                    use_gate=st.session_state.USE_CONFIDENCE_GATE,
+                    gate_threshold=st.session_state.GATE_THRESHOLD or None,
+                    extractive=st.session_state.EXTRACTIVE_MODE,
+                    filters=st.session_state.SEARCH_FILTERS,
+                    collection=st.session_state.COLLECTION,
+                    stats=interaction_stats
+                )
             
             message_placeholder.markdown(answer)
             if sources:
@@ -269,8 +460,8 @@ if user_question := st.chat_input("Ask a question about your documents..."):
                         st.info(source)
 
             st.session_state.current_response = {"question": user_question, "answer": answer, "sources": sources}
-            threading.Thread(target=save_interaction, args=(user_question.strip(), answer, sources), daemon=True).start()
+            save_interaction(user_question.strip(), answer, sources, metrics=interaction_stats)
             
             assistant_message = {"role": "assistant", "content": answer, "sources": sources}
             st.session_state.messages.append(assistant_message)
-            save_chat_history(st.session_state.current_session, st.session_state.messages)
+            save_chat_history(st.session_state.current_session, assistant_message)
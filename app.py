@@ -1,6 +1,5 @@
 import os
 import logging
-import threading
 from src.database import init_mysql_database, save_interaction
 from src.models import initialize_models
 from src.indexing import initial_scan_and_index, save_index, force_reindex
@@ -82,11 +81,8 @@ def interactive_loop():
         else:
             print("No sources found in index.")
 
-        # save interaction asynchronously
-        try:
-            threading.Thread(target=save_interaction, args=(q, answer, sources), daemon=True).start()
-        except Exception:
-            logging.exception("Failed to spawn thread to save interaction.")
+        # queued for the background database writer
+        save_interaction(q, answer, sources)
 
         # Ask whether the answer is correct / should be learned
         try:
@@ -123,7 +119,7 @@ def interactive_loop():
                 print("\n--- New Answer ---")
                 print(ans2)
                 print("--------------")
-                threading.Thread(target=save_interaction, args=(q + " (corrected)", ans2, src2), daemon=True).start()
+                save_interaction(q + " (corrected)", ans2, src2)
 
 
 def main():
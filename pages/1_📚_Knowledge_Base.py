@@ -1,8 +1,12 @@
 # pages/1_📚_Knowledge_Base.py
 import streamlit as st
 import os
+from datetime import datetime
 from pathlib import Path
-from src.indexing import force_reindex, initial_scan_and_index, update_vector_store
+from src.indexing import remove_files_from_index
+from src.knowledge_catalog import catalog_for, read_preview
+from src.knowledge_collections import manager as collection_manager, DEFAULT_COLLECTION
+from src.upload_jobs import uploads, safe_relative_path, QUEUED, WRITING, WAITING, INDEXING, DONE, FAILED
 
 st.set_page_config(page_title="Knowledge Base Management", page_icon="📚", layout="wide")
 st.title("📚 Knowledge Base Management")
@@ -14,90 +18,179 @@ if 'KNOWLEDGE_DIR' not in st.session_state or 'INDEX_PATH' not in st.session_sta
 
 KNOWLEDGE_DIR = st.session_state.KNOWLEDGE_DIR
 INDEX_PATH = st.session_state.INDEX_PATH
+FILES_PER_PAGE = 25
+
+Path(KNOWLEDGE_DIR).mkdir(parents=True, exist_ok=True)
+catalog = catalog_for(KNOWLEDGE_DIR)
 
 # --- Utility Functions ---
-def get_knowledge_files():
-    """Recursively finds all files in the knowledge directory."""
-    knowledge_path = Path(KNOWLEDGE_DIR)
-    if not knowledge_path.exists():
-        knowledge_path.mkdir(parents=True)
-    return sorted([p for p in knowledge_path.rglob("*") if p.is_file()], key=os.path.getmtime, reverse=True)
+@st.cache_data(max_entries=64)
+def get_preview(file_path, mtime):
+    """Reads the start of a file; cached until the file changes."""
+    return read_preview(file_path)
 
 def handle_file_delete(file_path):
-    """Deletes a file and forces a full re-index."""
+    """Deletes a file and removes its chunks from the index."""
     try:
         os.remove(file_path)
-        st.success(f"Deleted {os.path.basename(file_path)}. Re-indexing...")
+        catalog.file_removed(file_path)
+        st.success(f"Deleted {os.path.basename(file_path)}. Updating index...")
         with st.spinner("Updating knowledge base... This may take a moment."):
-            force_reindex(INDEX_PATH)
-            initial_scan_and_index(KNOWLEDGE_DIR, INDEX_PATH)
-        st.success("Re-indexing complete!")
+            remove_files_from_index([str(file_path)], INDEX_PATH)
+        st.success("Index updated!")
         st.rerun()
     except Exception as e:
         st.error(f"Error deleting file: {e}")
 
 # --- UI Layout ---
 st.header("Upload New Documents")
+subfolder = st.text_input(
+    "Destination subfolder (optional)",
+    key="upload_subfolder",
+    placeholder="e.g. projects/alpha",
+    help="Relative to the knowledge folder; created if it does not exist."
+)
+# A new key after each submission clears the uploader, so files are not submitted twice.
+uploader_key = st.session_state.get("uploader_key", 0)
 uploaded_files = st.file_uploader(
-    "Add new files to your knowledge base. Subdirectories are supported.",
-    accept_multiple_files=True
+    "Add new files to your knowledge base. They are saved and indexed in the background.",
+    accept_multiple_files=True,
+    key=f"uploader_{uploader_key}"
 )
 
 if uploaded_files:
-    new_file_paths = []
-    # To preserve subdirectories, we can't use the uploader easily.
-    # For now, all uploaded files will be placed in the root of the knowledge directory.
-    for uploaded_file in uploaded_files:
-        file_path = os.path.join(KNOWLEDGE_DIR, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        new_file_paths.append(file_path)
-    
-    st.success(f"Successfully uploaded {len(uploaded_files)} file(s).")
-    with st.spinner("Indexing new documents..."):
-        update_vector_store(new_file_paths, INDEX_PATH)
-    st.success("Indexing complete!")
-    st.rerun()
+    try:
+        batch = [(f, safe_relative_path(f.name, subfolder), f.size) for f in uploaded_files]
+    except ValueError as e:
+        st.error(str(e))
+    else:
+        uploads.submit(batch, KNOWLEDGE_DIR, INDEX_PATH,
+                       context=lambda: collection_manager.activate(DEFAULT_COLLECTION))
+        st.session_state.uploader_key = uploader_key + 1
+        st.rerun()
+
+UPLOAD_STATE_LABELS = {
+    QUEUED: "Queued",
+    WRITING: "Saving",
+    WAITING: "Waiting to index",
+    INDEXING: "Indexing",
+    DONE: "Indexed",
+    FAILED: "Failed",
+}
+
+@st.fragment(run_every=1)
+def render_upload_progress():
+    """Live per-file progress of the background upload queue; the rest of the page stays interactive."""
+    jobs = uploads.snapshot()
+    if not jobs:
+        return
+    active = [job for job in jobs if job["state"] not in (DONE, FAILED)]
+    st.subheader(f"Uploads ({len(active)} in progress)" if active else "Uploads")
+    for job in jobs[:20]:
+        col1, col2 = st.columns([3, 2])
+        col1.write(job["rel_path"])
+        label = UPLOAD_STATE_LABELS[job["state"]]
+        if job["state"] == WRITING:
+            col2.progress(job["written"] / job["size"] if job["size"] else 0.0,
+                          text=f"{label} {job['written'] / 1e6:.1f}/{job['size'] / 1e6:.1f} MB")
+        elif job["state"] == DONE:
+            col2.caption(f"{label} · {job['chunks']} chunks" + (f" · {job['error']}" if job["error"] else ""))
+        elif job["state"] == FAILED:
+            col2.error(f"{label}: {job['error']}")
+        else:
+            col2.caption(label)
+    if len(jobs) > 20:
+        st.caption(f"... and {len(jobs) - 20} more")
+    if not active and st.button("Clear finished uploads"):
+        uploads.clear_finished()
+        st.rerun(scope="fragment")
+
+render_upload_progress()
 
 st.divider()
 
 st.header("Manage Existing Documents")
 st.markdown(f"Displaying all files from: `{KNOWLEDGE_DIR}`")
 
-files = get_knowledge_files()
+col1, col2, col3 = st.columns([3, 2, 1])
+with col1:
+    file_search = st.text_input("Filter by path", key="kb_search")
+with col2:
+    file_types = st.multiselect("File types", catalog.extensions(), key="kb_extensions")
+with col3:
+    st.write("")
+    if st.button("🔄 Refresh", help="Re-read the folder, e.g. after changes made while the file watcher was not running."):
+        catalog.invalidate()
+        st.rerun()
 
-if not files:
-    st.info("Your knowledge base is empty. Upload some documents to get started!")
+filter_key = (file_search, tuple(file_types))
+if st.session_state.get("kb_filter_key") != filter_key:
+    st.session_state.kb_filter_key = filter_key
+    st.session_state.kb_page = 0
+page = st.session_state.get("kb_page", 0)
+files, total = catalog.page(page * FILES_PER_PAGE, FILES_PER_PAGE, file_search.strip() or None, file_types)
+page_count = max(1, -(-total // FILES_PER_PAGE))
+if page > page_count - 1:
+    # Deletions left fewer pages than the one being shown.
+    page = st.session_state.kb_page = page_count - 1
+    files, total = catalog.page(page * FILES_PER_PAGE, FILES_PER_PAGE, file_search.strip() or None, file_types)
+
+if not total:
+    if file_search or file_types:
+        st.info("No files match the filter.")
+    else:
+        st.info("Your knowledge base is empty. Upload some documents to get started!")
 else:
-    col1, col2, col3 = st.columns([3, 1, 1])
+    col1, col2, col3, col4 = st.columns([3, 1, 1.5, 1])
     col1.subheader("File Path (relative)")
     col2.subheader("Size (KB)")
-    col3.subheader("Actions")
-    
+    col3.subheader("Index")
+    col4.subheader("Actions")
+
     st.divider()
 
-    for file_path in files:
-        try:
-            # Display path relative to the knowledge directory
-            relative_path = file_path.relative_to(KNOWLEDGE_DIR)
-            file_size = round(file_path.stat().st_size / 1024, 2)
-
-            col1, col2, col3 = st.columns([3, 1, 1])
-            
-            with col1:
-                # Use an expander to show file content without taking too much space
-                with st.expander(str(relative_path)):
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            st.text(f.read(1000) + ("..." if len(f.read()) > 1000 else ""))
-                    except Exception:
-                        st.warning("Cannot display preview for this file type (e.g., PDF, DOCX).")
-
-            with col2:
-                st.write(f"{file_size} KB")
-
-            with col3:
-                if st.button("🗑️ Delete", key=f"delete_{relative_path}"):
-                    handle_file_delete(file_path)
-        except Exception as e:
-            st.error(f"Error processing file {file_path.name}: {e}")
+    metadata_index = collection_manager.metadata_index(DEFAULT_COLLECTION)
+    for entry in files:
+        relative_path = entry["rel_path"]
+        file_path = catalog.path_of(relative_path)
+        col1, col2, col3, col4 = st.columns([3, 1, 1.5, 1])
+
+        with col1:
+            previewing = st.session_state.get("kb_preview") == relative_path
+            if st.button(("▾ " if previewing else "▸ ") + relative_path, key=f"preview_{relative_path}"):
+                st.session_state.kb_preview = None if previewing else relative_path
+                st.rerun()
+            if previewing:
+                # Only the selected file is read, and only its first characters.
+                preview = get_preview(file_path, entry["mtime"])
+                if preview is None:
+                    st.warning("Cannot display preview for this file type (e.g., PDF, DOCX).")
+                else:
+                    st.text(preview)
+
+        with col2:
+            st.write(f"{round(entry['size'] / 1024, 2)} KB")
+
+        with col3:
+            chunks, indexed_at = metadata_index.file_status(relative_path)
+            if indexed_at is None:
+                st.caption("Not indexed")
+            else:
+                st.caption(f"{chunks} chunks · {datetime.fromtimestamp(indexed_at):%Y-%m-%d %H:%M}")
+
+        with col4:
+            if st.button("🗑️ Delete", key=f"delete_{relative_path}"):
+                handle_file_delete(file_path)
+
+    if page_count > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("◀ Previous", disabled=page == 0):
+                st.session_state.kb_page = page - 1
+                st.rerun()
+        with col2:
+            st.caption(f"Page {page + 1} of {page_count} ({total} files)")
+        with col3:
+            if st.button("Next ▶", disabled=page >= page_count - 1):
+                st.session_state.kb_page = page + 1
+                st.rerun()
@@ -4,7 +4,15 @@ import streamlit as st
 import psutil
 import time
 import platform
-import torch
+from datetime import datetime
+from src import models
+from src.metrics_sampler import sampler as metrics_sampler, SAMPLE_INTERVAL_S
+from src.retrieval import cache_stats
+from src import compression, rerank, gate
+from src.embedding_service import batcher
+from src.knowledge_collections import manager as collection_manager
+from src import database, tracing
+from src.database import writer as db_writer
 
 st.set_page_config(page_title="System Performance", page_icon="⚙️", layout="wide")
 st.title("⚙️ System Performance Monitor")
@@ -31,35 +39,203 @@ col1.info(f"**LLM Model:** `{os.path.basename(config['LLM_MODEL_PATH'])}`")
 col2.info(f"**Embedding Model:** `{config['EMBEDDING_MODEL_NAME']}`")
 
 
+# --- Retrieval Caches ---
+st.header("Retrieval Caches")
+stats = cache_stats()
+col1, col2 = st.columns(2)
+for col, (label, cache) in zip((col1, col2), (("Query Embeddings", stats["query_embeddings"]), ("Retrieval Results", stats["retrievals"]))):
+    col.metric(f"{label} Hit Rate", f"{cache['hit_rate']:.0%}", help=f"{cache['hits']} hits, {cache['misses']} misses")
+    col.caption(f"{cache['size']} / {cache['maxsize']} entries, {cache['evictions']} evicted")
+st.caption(f"{stats['retrievals']['stale']} cached results were invalidated by index updates.")
+answers = stats["answers"]
+st.metric("Answer Cache Hit Rate", f"{answers['hit_rate']:.0%}", help=f"{answers['hits']} hits, {answers['misses']} misses")
+st.caption(f"{answers['size']} / {answers['maxsize']} answers cached, {answers['invalidations']} invalidated by changed chunks, {answers['evictions']} evicted")
+
+
+# --- Query Embedding Batching ---
+batch_stats = batcher.stats()
+if batch_stats["requests"]:
+    st.header("Query Embedding Batching")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Queries Embedded", batch_stats["requests"])
+    col2.metric("Average Batch Size", f"{batch_stats['avg_batch_size']:.2f}", help=f"Largest batch: {batch_stats['largest_batch']}")
+    col3.metric("Average Queue Wait", f"{batch_stats['avg_queue_wait_ms']:.1f} ms")
+    col4.metric("Throughput", f"{batch_stats['throughput_per_s']:.0f} queries/s", help=f"{batch_stats['avg_batch_ms']:.1f} ms per batch")
+
+
+# --- Context Compression ---
+totals = dict(compression.totals)
+if totals["queries"]:
+    saved = totals["tokens_before"] - totals["tokens_after"]
+    st.header("Context Compression")
+    col1, col2 = st.columns(2)
+    col1.metric("Prompt Tokens Saved", f"{saved}", help=f"Across {totals['queries']} compressed queries")
+    col2.metric("Average Reduction", f"{saved / max(totals['tokens_before'], 1):.0%}")
+
+
+# --- Reranking ---
+rerank_stats = dict(rerank.stats)
+if any(rerank_stats.values()):
+    st.header("Reranking")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Queries Reranked", rerank_stats["reranked"])
+    col2.metric("Skipped (busy / over budget)", f"{rerank_stats['skipped_busy']} / {rerank_stats['skipped_budget']}")
+    col3.metric("Failures", rerank_stats["failed"])
+
+
+# --- Confidence Gate ---
+gate_stats = dict(gate.stats)
+if gate_stats["checked"]:
+    st.header("Confidence Gate")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Questions Checked", gate_stats["checked"])
+    col2.metric("Generation Skipped", gate_stats["fired"], help=f"{gate_stats['fired'] / gate_stats['checked']:.0%} of checked questions")
+    col3.metric("Estimated LLM Time Saved", f"{gate_stats['saved_seconds']:.1f} s")
+
+
+# --- Knowledge Collections ---
+collection_stats = collection_manager.stats()
+if len(collection_stats) > 1:
+    st.header("Knowledge Collections")
+    loaded_mb = sum(c["memory_mb"] for c in collection_stats if c["loaded"])
+    st.caption(f"{loaded_mb:.0f} MB of {collection_manager.memory_budget_mb:.0f} MB budget in use.")
+    st.dataframe(
+        [
+            {
+                "Collection": c["name"],
+                "Loaded": c["loaded"],
+                "Memory (MB)": round(c["memory_mb"], 1),
+                "Last Used": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(c["last_used"])) if c["last_used"] else "never",
+                "Folder": c["knowledge_dir"],
+            }
+            for c in collection_stats
+        ],
+        use_container_width=True,
+    )
+
+
+# --- Interaction Logging ---
+writer_stats = dict(db_writer.stats)
+if writer_stats["batches"] or writer_stats["dropped"] or writer_stats["retries"]:
+    st.header("Interaction Logging")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Rows Written", writer_stats["written"], help=f"In {writer_stats['batches']} batched commits")
+    col2.metric("Write Retries", writer_stats["retries"])
+    col3.metric("Rows Dropped", writer_stats["dropped"] + writer_stats["rejected"],
+                help=f"{writer_stats['dropped']} because the write queue was full, "
+                     f"{writer_stats['rejected']} refused by the database (e.g. too long for their column).")
+
+# --- Query Latency ---
+if database.storage is not None:
+    st.header("Query Latency")
+    windows = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400}
+    window = st.selectbox("Window", list(windows), key="latency_window")
+    try:
+        summary = database.latency_summary(windows[window])
+    except Exception as e:
+        summary = []
+        st.warning(f"Could not read interaction metrics: {e}")
+    if summary and summary[0]["count"]:
+        overall = summary[0]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Interactions", overall["count"])
+        col2.metric("Answer Cache Hits", f"{overall['answer_cache_hit_rate']:.0%}")
+        col3.metric("Retrieval Cache Hits", f"{overall['retrieval_cache_hit_rate']:.0%}")
+        st.table({
+            metric: {name: f"{value:.1f}" for name, value in overall[metric].items()}
+            for metric in database.SUMMARY_METRICS if metric in overall
+        })
+    elif summary:
+        st.info("No interactions logged in this window.")
+
+# --- Pipeline Stages ---
+st.header("Pipeline Stages")
+spans = tracing.span_summary()
+if not tracing.enabled and not spans:
+    st.info("Stage tracing is off. Turn it on in the settings to time each stage of every query.")
+elif not spans:
+    st.info("No traced stages yet.")
+else:
+    st.table({
+        row["span"]: {"Count": row["count"], "Mean (ms)": f"{row['mean_ms']:.1f}", "Total (s)": f"{row['total_s']:.2f}"}
+        for row in spans
+    })
+    metrics_text = tracing.prometheus_text()
+    with st.expander("Prometheus metrics"):
+        st.code(metrics_text, language="text")
+    st.download_button("Download Prometheus metrics", metrics_text, file_name="metrics.prom", mime="text/plain")
+
+
 # --- Live Performance Metrics ---
 st.header("Live Metrics")
-placeholder = st.empty()
+metrics_sampler.start()
+
+def llm_supports_gpu_offload() -> bool:
+    """Whether the installed llama.cpp build can offload layers at all; a CPU-only build ignores N_GPU_LAYERS."""
+    try:
+        import llama_cpp
+        return bool(llama_cpp.llama_supports_gpu_offload())
+    except Exception:
+        return False
 
-# Function to check for CUDA availability and get device name
-def get_torch_device():
-    if torch.cuda.is_available():
-        return f"GPU ({torch.cuda.get_device_name(0)})"
-    return "CPU"
+def get_inference_devices():
+    """Where embeddings and the LLM run, without importing torch in this script."""
+    client = getattr(models.embedder, "_client", None)
+    embedding_device = str(getattr(client, "device", "not loaded"))
+    gpu_layers = config.get("N_GPU_LAYERS", 0)
+    if models.llm is None:
+        llm_device = "not loaded"
+    elif gpu_layers and llm_supports_gpu_offload():
+        llm_device = "GPU offload"
+    else:
+        llm_device = "CPU"
+    return embedding_device, llm_device, gpu_layers
 
-# Loop to update metrics
-while True:
-    cpu_percent = psutil.cpu_percent(interval=1)
+@st.fragment(run_every=SAMPLE_INTERVAL_S)
+def render_live_metrics():
+    """Draws the shared sampler's history; nothing is measured here."""
+    samples = metrics_sampler.samples()
+    if not samples:
+        st.info("Collecting metrics...")
+        return
+    latest = samples[-1]
     ram = psutil.virtual_memory()
-    ram_percent = ram.percent
     disk = psutil.disk_usage('/')
-    disk_percent = disk.percent
-    
-    with placeholder.container():
-        st.subheader("CPU Usage")
-        st.progress(int(cpu_percent), text=f"{cpu_percent}%")
-
-        st.subheader("Memory (RAM) Usage")
-        st.progress(int(ram_percent), text=f"{ram_percent}% ({ram.used/1e9:.2f} GB / {ram.total/1e9:.2f} GB)")
-
-        st.subheader("Disk Usage (Root)")
-        st.progress(int(disk_percent), text=f"{disk_percent}% ({disk.used/1e9:.2f} GB / {disk.total/1e9:.2f} GB)")
-        
-        st.subheader("PyTorch Device")
-        st.success(f"Embeddings and model inference are running on: **{get_torch_device()}**")
-        
-        time.sleep(1)
\ No newline at end of file
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("App Memory (RSS)", f"{latest['rss_mb']:.0f} MB")
+    col2.metric("App Threads", latest["threads"])
+    col3.metric("System RAM", f"{ram.percent}%", help=f"{ram.used/1e9:.2f} GB / {ram.total/1e9:.2f} GB")
+    col4.metric("Index", f"{latest['index_vectors']:,} vectors", help=f"{latest['index_mb']:.1f} MB of vectors in memory")
+    st.caption(f"Disk (root): {disk.percent}% used ({disk.used/1e9:.2f} GB / {disk.total/1e9:.2f} GB)")
+
+    times = [datetime.fromtimestamp(s["time"]) for s in samples]
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("App Memory (MB)")
+        st.line_chart({"time": times, "RSS": [s["rss_mb"] for s in samples]}, x="time")
+        st.subheader("CPU per Core (%)")
+        cores = len(latest["cpu_per_core"])
+        st.line_chart(
+            {"time": times, **{f"core {i}": [s["cpu_per_core"][i] if i < len(s["cpu_per_core"]) else None for s in samples]
+                               for i in range(cores)}},
+            x="time",
+        )
+    with col2:
+        st.subheader("Disk I/O (MB/s)")
+        st.line_chart(
+            {"time": times, "read": [s["disk_read_mb_s"] for s in samples], "write": [s["disk_write_mb_s"] for s in samples]},
+            x="time",
+        )
+        st.subheader("App CPU (%) and Threads")
+        st.line_chart(
+            {"time": times, "CPU": [s["process_cpu_percent"] for s in samples], "threads": [s["threads"] for s in samples]},
+            x="time",
+        )
+    st.subheader("Index Size (vectors)")
+    st.line_chart({"time": times, "vectors": [s["index_vectors"] for s in samples]}, x="time")
+
+render_live_metrics()
+
+embedding_device, llm_device, gpu_layers = get_inference_devices()
+st.caption(f"Embeddings run on **{embedding_device}**; the LLM runs on **{llm_device}**"
+           + (f" ({'all' if gpu_layers < 0 else gpu_layers} GPU layers requested)." if llm_device == "GPU offload" else "."))
@@ -1,30 +1,69 @@
 # pages/3_⚙️_Settings.py
 import streamlit as st
+from src.models import KV_CACHE_TYPES
+from src.tuning import calibrate_llm_params, save_llm_profile, load_llm_profile
+from src import gate, hot_reload
+from src.database import STORAGE_BACKENDS, DEFAULT_SQLITE_PATH
+from src import tracing
+from src.knowledge_collections import manager as collection_manager, load_collections, DEFAULT_COLLECTION
 
 st.set_page_config(page_title="Settings", page_icon="⚙️", layout="wide")
 
 st.title("⚙️ Application Settings")
 
-st.warning("⚠️ Changing settings will cause the application to relaunch and re-initialize all models and resources.")
+st.info("Only the components affected by a change are reloaded, in the background. Prompt and retrieval settings apply to the next question.")
 
-if st.button("Save and Relaunch Application"):
+if 'settings_applied' in st.session_state:
+    reloaded = st.session_state.pop('settings_applied')
+    st.success(f"Settings saved. Reloading: {', '.join(reloaded)}." if reloaded else "Settings saved. No reload needed.")
+
+if st.button("Save and Apply Settings"):
     # Update session state from the input widgets
     # The keys for widgets are used to retrieve their values
     st.session_state.KNOWLEDGE_DIR = st.session_state.knowledge_dir_input
     st.session_state.INDEX_PATH = st.session_state.index_path_input
     st.session_state.LLM_MODEL_PATH = st.session_state.llm_model_path_input
     st.session_state.EMBEDDING_MODEL_NAME = st.session_state.embedding_model_name_input
+    st.session_state.LOAD_LLM = st.session_state.load_llm_input
     st.session_state.SYSTEM_PROMPT = st.session_state.system_prompt_input
     st.session_state.CHUNK_SIZE = st.session_state.chunk_size_input
     st.session_state.CHUNK_OVERLAP = st.session_state.chunk_overlap_input
+    st.session_state.SHARD_BY_FOLDER = st.session_state.shard_by_folder_input
+    st.session_state.COLLECTION_MEMORY_MB = st.session_state.collection_memory_mb_input
+    st.session_state.RETRIEVAL_K = st.session_state.retrieval_k_input
+    st.session_state.MAX_NEW_TOKENS = st.session_state.max_new_tokens_input
+    st.session_state.HYBRID_SEARCH = st.session_state.hybrid_search_input
+    st.session_state.EMBED_BATCH_SIZE = st.session_state.embed_batch_size_input
+    st.session_state.EMBED_BATCH_WAIT_MS = st.session_state.embed_batch_wait_ms_input
+    st.session_state.USE_CONFIDENCE_GATE = st.session_state.use_confidence_gate_input
+    st.session_state.GATE_THRESHOLD = st.session_state.gate_threshold_input
+    st.session_state.USE_RERANK = st.session_state.use_rerank_input
+    st.session_state.RERANK_MODEL = st.session_state.rerank_model_input
+    st.session_state.RERANK_CANDIDATES = st.session_state.rerank_candidates_input
+    st.session_state.RERANK_BUDGET_MS = st.session_state.rerank_budget_ms_input
+    st.session_state.COMPRESS_CONTEXT = st.session_state.compress_context_input
+    st.session_state.COMPRESSION_RATIO = st.session_state.compression_ratio_input
+    st.session_state.ANSWER_CACHE_THRESHOLD = st.session_state.answer_cache_threshold_input
+    st.session_state.N_CTX = st.session_state.n_ctx_input
+    st.session_state.N_BATCH = st.session_state.n_batch_input
+    st.session_state.N_THREADS = st.session_state.n_threads_input
+    st.session_state.N_GPU_LAYERS = st.session_state.n_gpu_layers_input
+    st.session_state.USE_MMAP = st.session_state.use_mmap_input
+    st.session_state.USE_MLOCK = st.session_state.use_mlock_input
+    st.session_state.KV_CACHE_TYPE = st.session_state.kv_cache_type_input
+    st.session_state.STORAGE_BACKEND = st.session_state.storage_backend_input
+    st.session_state.SQLITE_PATH = st.session_state.sqlite_path_input
     st.session_state.MYSQL_HOST = st.session_state.mysql_host_input
     st.session_state.MYSQL_USER = st.session_state.mysql_user_input
     st.session_state.MYSQL_PASSWORD = st.session_state.mysql_password_input
     st.session_state.MYSQL_DATABASE = st.session_state.mysql_database_input
     st.session_state.MYSQL_PORT = st.session_state.mysql_port_input
+    # Tracing is shared by every session, so it is applied here rather than kept in session state.
+    tracing.configure(st.session_state.tracing_enabled_input, st.session_state.trace_path_input)
+    tracing.serve_metrics(st.session_state.metrics_port_input)
     
-    # Clear cached resources to force re-initialization
-    st.cache_resource.clear()
+    # Reload only what the changed settings affect; everything else stays loaded
+    st.session_state.settings_applied = hot_reload.apply_settings(hot_reload.runtime_settings(st.session_state))
     st.rerun()
 
 st.divider()
@@ -44,6 +83,44 @@ st.text_input(
     help="The directory where the FAISS index will be stored."
 )
 
+# --- Knowledge Collections ---
+st.header("Knowledge Collections")
+st.caption(
+    f"The paths above form the '{DEFAULT_COLLECTION}' collection. Additional collections have their own folder and "
+    "index, share the embedding model and LLM, and are loaded the first time they are queried."
+)
+st.number_input(
+    "Collection Memory Budget (MB)",
+    min_value=0,
+    max_value=262144,
+    value=st.session_state.get('COLLECTION_MEMORY_MB', 2048),
+    step=256,
+    key="collection_memory_mb_input",
+    help="When the loaded collections need more memory than this, the least recently used ones are unloaded. "
+         f"The '{DEFAULT_COLLECTION}' collection always stays loaded."
+)
+collections = load_collections()
+for name, config in sorted(collections.items()):
+    col1, col2 = st.columns([0.85, 0.15])
+    col1.markdown(f"**{name}** — `{config['knowledge_dir']}` → `{config['index_path']}`")
+    if col2.button("Remove", key=f"remove_collection_{name}"):
+        collection_manager.remove(name)
+        st.rerun()
+with st.form("add_collection", clear_on_submit=True):
+    col1, col2, col3 = st.columns(3)
+    new_name = col1.text_input("Name")
+    new_knowledge_dir = col2.text_input("Knowledge Folder")
+    new_index_path = col3.text_input("Index Path", help="Defaults to collections/<name>/index.")
+    if st.form_submit_button("Add Collection"):
+        new_name = new_name.strip()
+        if not new_name or not new_knowledge_dir.strip():
+            st.error("A collection needs a name and a knowledge folder.")
+        elif new_name == DEFAULT_COLLECTION or new_name in collections:
+            st.error(f"A collection named '{new_name}' already exists.")
+        else:
+            collection_manager.add(new_name, new_knowledge_dir.strip(), new_index_path.strip() or f"collections/{new_name}/index")
+            st.rerun()
+
 # --- Model Configuration ---
 st.header("Model Configuration")
 st.text_input(
@@ -52,6 +129,12 @@ st.text_input(
     key="llm_model_path_input",
     help="Path to the GGUF model file."
 )
+st.checkbox(
+    "Load LLM",
+    value=st.session_state.get('LOAD_LLM', True),
+    key="load_llm_input",
+    help="Turn off on hosts that cannot keep the GGUF model in memory. Answers are then extractive (passages with highlighted sentences)."
+)
 st.text_input(
     "Embedding Model Name", 
     value=st.session_state.get('EMBEDDING_MODEL_NAME', ''), 
@@ -59,6 +142,229 @@ st.text_input(
     help="Name of the sentence-transformers model for embeddings."
 )
 
+# --- LLM Runtime Configuration ---
+st.header("LLM Runtime Configuration")
+# Calibration runs before the inputs are drawn so it can update their values.
+st.subheader("Calibration")
+profile = load_llm_profile()
+if profile:
+    st.caption(
+        f"Current profile ({profile['calibrated_at']}): n_threads={profile['n_threads']}, n_batch={profile['n_batch']}, "
+        f"prompt {profile['prompt_tps']:.1f} tok/s, generation {profile['gen_tps']:.1f} tok/s"
+    )
+if st.button("Calibrate Threads and Batch Size"):
+    with st.spinner("Benchmarking prompt evaluation and generation throughput... This may take several minutes."):
+        try:
+            profile = calibrate_llm_params(
+                st.session_state.get('LLM_MODEL_PATH', ''),
+                llm_params={
+                    "n_ctx": st.session_state.get('n_ctx_input', st.session_state.get('N_CTX', 2048)),
+                    "n_gpu_layers": st.session_state.get('n_gpu_layers_input', st.session_state.get('N_GPU_LAYERS', -1)),
+                    "use_mmap": st.session_state.get('use_mmap_input', st.session_state.get('USE_MMAP', True)),
+                    "use_mlock": st.session_state.get('use_mlock_input', st.session_state.get('USE_MLOCK', False)),
+                    "kv_cache_type": st.session_state.get('kv_cache_type_input', st.session_state.get('KV_CACHE_TYPE', 'f16')),
+                },
+            )
+            save_llm_profile(profile)
+            st.session_state.N_THREADS = profile["n_threads"]
+            st.session_state.N_BATCH = profile["n_batch"]
+            # Drop the widget values so the inputs below pick up the calibrated numbers.
+            st.session_state.pop("n_threads_input", None)
+            st.session_state.pop("n_batch_input", None)
+            st.success(f"Best profile: n_threads={profile['n_threads']}, n_batch={profile['n_batch']}. Save and apply to reload the LLM with it.")
+            st.dataframe(profile["results"])
+        except Exception as e:
+            st.error(f"Calibration failed: {e}")
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.number_input(
+        "Context Window (n_ctx)",
+        min_value=512,
+        max_value=32768,
+        value=st.session_state.get('N_CTX', 2048),
+        step=512,
+        key="n_ctx_input",
+        help="Maximum tokens for prompt plus answer. Larger windows allow more retrieved chunks but use more RAM."
+    )
+    st.number_input(
+        "Batch Size (n_batch)",
+        min_value=8,
+        max_value=4096,
+        value=st.session_state.get('N_BATCH', 512),
+        step=8,
+        key="n_batch_input",
+        help="Number of prompt tokens evaluated per forward pass."
+    )
+with col2:
+    st.number_input(
+        "Threads (0 = auto)",
+        min_value=0,
+        max_value=256,
+        value=st.session_state.get('N_THREADS', 0),
+        key="n_threads_input",
+        help="CPU threads used for prompt evaluation and generation."
+    )
+    st.number_input(
+        "GPU Layers (-1 = all)",
+        min_value=-1,
+        max_value=1000,
+        value=st.session_state.get('N_GPU_LAYERS', -1),
+        key="n_gpu_layers_input",
+        help="Layers offloaded to the GPU. Set to 0 on CPU-only hosts."
+    )
+with col3:
+    kv_types = list(KV_CACHE_TYPES)
+    st.selectbox(
+        "KV Cache Type",
+        kv_types,
+        index=kv_types.index(st.session_state.get('KV_CACHE_TYPE', 'f16')),
+        key="kv_cache_type_input",
+        help="Quantized KV caches use less memory at a small quality cost."
+    )
+    st.checkbox("Memory-map model (mmap)", value=st.session_state.get('USE_MMAP', True), key="use_mmap_input")
+    st.checkbox("Lock model in RAM (mlock)", value=st.session_state.get('USE_MLOCK', False), key="use_mlock_input")
+
+# --- Retrieval Configuration ---
+st.header("Retrieval Configuration")
+st.number_input(
+    "Retrieved Chunks (k)",
+    min_value=1,
+    max_value=50,
+    value=st.session_state.get('RETRIEVAL_K', 4),
+    key="retrieval_k_input",
+    help="Number of chunks retrieved as candidate context. Chunks that do not fit into n_ctx are merged, trimmed or dropped."
+)
+st.number_input(
+    "Tokens Reserved for the Answer",
+    min_value=64,
+    max_value=8192,
+    value=st.session_state.get('MAX_NEW_TOKENS', 512),
+    step=64,
+    key="max_new_tokens_input",
+    help="Maximum answer length. The rest of n_ctx is filled with retrieved context."
+)
+
+st.checkbox(
+    "Hybrid Search (vector + keyword)",
+    value=st.session_state.get('HYBRID_SEARCH', True),
+    key="hybrid_search_input",
+    help="Fuses vector search with a BM25 keyword index so exact identifiers, error codes and function names are found."
+)
+col1, col2 = st.columns(2)
+with col1:
+    st.number_input(
+        "Query Embedding Batch Size",
+        min_value=1,
+        max_value=256,
+        value=st.session_state.get('EMBED_BATCH_SIZE', 32),
+        key="embed_batch_size_input",
+        help="Maximum number of concurrent queries embedded in one forward pass."
+    )
+with col2:
+    st.number_input(
+        "Query Embedding Batch Wait (ms)",
+        min_value=0,
+        max_value=100,
+        value=st.session_state.get('EMBED_BATCH_WAIT_MS', 5),
+        key="embed_batch_wait_ms_input",
+        help="How long to wait for other queries to join a batch. 0 embeds each query as soon as it arrives."
+    )
+
+st.subheader("Confidence Gate")
+calibrated = gate.get_threshold(st.session_state.get('EMBEDDING_MODEL_NAME'))
+st.caption(
+    f"Calibrated threshold for this embedder: {calibrated:.3f}" if calibrated is not None
+    else "No calibrated threshold for this embedder yet; the gate stays open until you calibrate or set one."
+)
+col1, col2 = st.columns(2)
+with col1:
+    st.checkbox(
+        "Skip generation when nothing relevant is found",
+        value=st.session_state.get('USE_CONFIDENCE_GATE', True),
+        key="use_confidence_gate_input",
+        help="Returns the refusal immediately when even the nearest chunk is farther than the threshold."
+    )
+    if st.button("Calibrate Gate Threshold"):
+        with st.spinner("Measuring distances for relevant and off-topic queries..."):
+            try:
+                result = gate.calibrate_threshold()
+                st.success(f"Threshold set to {result['threshold']:.3f} from {result['samples']} samples.")
+            except Exception as e:
+                st.error(f"Calibration failed: {e}")
+with col2:
+    st.number_input(
+        "Distance Threshold Override (0 = calibrated)",
+        min_value=0.0,
+        max_value=100.0,
+        value=float(st.session_state.get('GATE_THRESHOLD', 0.0)),
+        step=0.05,
+        key="gate_threshold_input",
+        help="L2 distance above which a question is considered unrelated to the knowledge base."
+    )
+
+st.subheader("Reranking")
+st.checkbox(
+    "Rerank with Cross-Encoder",
+    value=st.session_state.get('USE_RERANK', False),
+    key="use_rerank_input",
+    help="Fetches more candidates and lets a small CPU cross-encoder pick the best k, so fewer chunks reach the LLM."
+)
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.text_input(
+        "Reranker Model",
+        value=st.session_state.get('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2'),
+        key="rerank_model_input"
+    )
+with col2:
+    st.number_input(
+        "Rerank Candidates",
+        min_value=5,
+        max_value=200,
+        value=st.session_state.get('RERANK_CANDIDATES', 50),
+        step=5,
+        key="rerank_candidates_input"
+    )
+with col3:
+    st.number_input(
+        "Rerank Latency Budget (ms)",
+        min_value=10,
+        max_value=5000,
+        value=st.session_state.get('RERANK_BUDGET_MS', 300),
+        step=10,
+        key="rerank_budget_ms_input",
+        help="Reranking is skipped when it is expected to take longer than this, e.g. under heavy load."
+    )
+
+col1, col2 = st.columns(2)
+with col1:
+    st.checkbox(
+        "Compress Context",
+        value=st.session_state.get('COMPRESS_CONTEXT', False),
+        key="compress_context_input",
+        help="Keeps only the sentences of the retrieved chunks that are most similar to the question, cutting prompt evaluation time."
+    )
+with col2:
+    st.slider(
+        "Sentences Kept",
+        min_value=0.1,
+        max_value=1.0,
+        value=st.session_state.get('COMPRESSION_RATIO', 0.5),
+        step=0.05,
+        key="compression_ratio_input",
+        help="Fraction of sentences kept when compressing (neighbouring sentences are added for coherence)."
+    )
+st.number_input(
+    "Answer Cache Similarity Threshold",
+    min_value=0.80,
+    max_value=1.00,
+    value=st.session_state.get('ANSWER_CACHE_THRESHOLD', 0.92),
+    step=0.01,
+    key="answer_cache_threshold_input",
+    help="Minimum cosine similarity between two questions for a cached answer to be reused."
+)
+
 # --- Prompt Configuration ---
 st.header("Prompt Configuration")
 st.text_area(
@@ -92,9 +398,31 @@ with col2:
         key="chunk_overlap_input",
         help="The number of characters to overlap between chunks to maintain context."
     )
+st.checkbox(
+    "One index shard per top-level folder",
+    value=st.session_state.get('SHARD_BY_FOLDER', False),
+    key="shard_by_folder_input",
+    help="Keeps a separate index for each top-level folder of the knowledge directory. Shards are searched in parallel "
+         "and a change to one folder only saves and reloads that folder's shard. Switching this on re-embeds all files once."
+)
 
 # --- Database Configuration ---
 st.header("Database Configuration")
+st.radio(
+    "Storage Backend",
+    STORAGE_BACKENDS,
+    index=STORAGE_BACKENDS.index(st.session_state.get('STORAGE_BACKEND', 'mysql')),
+    format_func=lambda b: {"mysql": "MySQL server", "sqlite": "Embedded SQLite (no server needed)"}[b],
+    key="storage_backend_input",
+    horizontal=True,
+    help="Where interactions are logged. SQLite keeps everything in one local file and needs no network or external service."
+)
+st.text_input(
+    "SQLite Database File",
+    value=st.session_state.get('SQLITE_PATH', DEFAULT_SQLITE_PATH),
+    key="sqlite_path_input",
+    help="Used when the storage backend is SQLite."
+)
 col1, col2, col3 = st.columns(3)
 with col1:
     st.text_input("MySQL Host", value=st.session_state.get('MYSQL_HOST', 'localhost'), key="mysql_host_input")
@@ -104,3 +432,32 @@ with col2:
     st.text_input("MySQL Database", value=st.session_state.get('MYSQL_DATABASE', 'synthcerebrum'), key="mysql_database_input")
 with col3:
     st.number_input("MySQL Port", min_value=1, max_value=65535, value=st.session_state.get('MYSQL_PORT', 3306), key="mysql_port_input")
+
+# --- Tracing Configuration ---
+st.header("Tracing Configuration")
+st.caption("Tracing applies to the whole app, for every open session.")
+trace_settings = tracing.settings()
+st.checkbox(
+    "Trace pipeline stages",
+    value=trace_settings["enabled"],
+    key="tracing_enabled_input",
+    help="Records the duration of every query and indexing stage (embedding, search, reranking, prompt building, "
+         "LLM prompt evaluation and generation, index lock waits) as spans. Costs next to nothing while off."
+)
+col1, col2 = st.columns(2)
+with col1:
+    st.text_input(
+        "Trace File",
+        value=trace_settings["trace_path"],
+        key="trace_path_input",
+        help="Spans are appended as JSON lines; the file rotates at 10 MB, keeping three old files."
+    )
+with col2:
+    st.number_input(
+        "Prometheus Metrics Port",
+        min_value=0,
+        max_value=65535,
+        value=trace_settings["metrics_port"],
+        key="metrics_port_input",
+        help="Serves span duration histograms at http://127.0.0.1:<port>/metrics. 0 turns the endpoint off."
+    )
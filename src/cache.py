@@ -0,0 +1,151 @@
+# src/cache.py
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, FrozenSet, Hashable, Iterable, List, Optional
+
+import numpy as np
+
+
+class LRUCache:
+    """A small thread-safe LRU cache with hit/miss counters."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SemanticAnswerCache:
+    """
+    Caches generated answers keyed on the query embedding.
+    A lookup hits when a stored query in the same scope has cosine similarity of at
+    least `threshold`. Each entry remembers the chunk IDs its answer was built from;
+    `is_valid` is asked on every hit so answers based on changed chunks are dropped.
+    """
+
+    def __init__(self, maxsize: int = 512, threshold: float = 0.92):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector) -> "np.ndarray":
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def lookup(self, vector, scope: Hashable, is_valid: Callable[[FrozenSet[str]], bool],
+               threshold: Optional[float] = None) -> Optional[dict]:
+        """Return the best matching live entry (answer, sources, chunk_ids) or None."""
+        threshold = self.threshold if threshold is None else threshold
+        query = self._normalize(vector)
+        with self._lock:
+            candidates = [(entry_id, e) for entry_id, e in self._entries.items() if e["scope"] == scope]
+            if candidates:
+                matrix = np.stack([e["vector"] for _, e in candidates])
+                sims = matrix @ query
+                # Walk matches from most to least similar, dropping invalidated entries on the way.
+                for idx in np.argsort(-sims):
+                    if sims[idx] < threshold:
+                        break
+                    entry_id, entry = candidates[idx]
+                    if not is_valid(entry["chunk_ids"]):
+                        del self._entries[entry_id]
+                        self.invalidations += 1
+                        continue
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return {"answer": entry["answer"], "sources": list(entry["sources"]),
+                            "chunk_ids": entry["chunk_ids"], "similarity": float(sims[idx])}
+            self.misses += 1
+            return None
+
+    def store(self, vector, scope: Hashable, answer: str, sources: List[str], chunk_ids: Iterable[str]):
+        with self._lock:
+            self._entries[self._next_id] = {
+                "vector": self._normalize(vector),
+                "scope": scope,
+                "answer": answer,
+                "sources": list(sources),
+                "chunk_ids": frozenset(chunk_ids),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_chunks(self, chunk_ids: Iterable[str]):
+        """Eagerly drop every entry that used any of the given chunks."""
+        changed = set(chunk_ids)
+        with self._lock:
+            stale = [entry_id for entry_id, e in self._entries.items() if e["chunk_ids"] & changed]
+            for entry_id in stale:
+                del self._entries[entry_id]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
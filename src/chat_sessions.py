@@ -0,0 +1,362 @@
+# src/chat_sessions.py
+import os
+import json
+import time
+import atexit
+import struct
+import logging
+import threading
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+from src import session_catalog
+
+# A session is an append-only log, <name>.jsonl: a header line followed by one JSON line per
+# message. Next to it, <name>.idx holds the byte offset of every message as a little-endian
+# uint64, so the last N messages are read with one seek instead of parsing the whole log.
+SESSION_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+# Sessions written by earlier versions as one JSON array; converted on first access.
+LEGACY_SUFFIX = ".json"
+LOG_VERSION = 1
+
+# Messages loaded when a session is opened; earlier ones are loaded on request.
+RECENT_MESSAGES = 50
+
+# Appends reach the OS immediately but are fsynced at most this often, in the background.
+FSYNC_INTERVAL_S = 1.0
+
+# Bytes read at a time while looking back for the end of the last complete line.
+TAIL_SCAN_BYTES = 64 * 1024
+
+_OFFSET = struct.Struct("<Q")
+_lock = threading.RLock()
+
+
+def index_path(path: Path) -> Path:
+    return path.with_suffix(INDEX_SUFFIX)
+
+
+def _header_line(created_at: float) -> bytes:
+    return (json.dumps({"header": {"version": LOG_VERSION, "created_at": created_at}}) + "\n").encode("utf-8")
+
+
+def _read_header(path: Path) -> dict:
+    with open(path, "rb") as log:
+        try:
+            return json.loads(log.readline()).get("header", {})
+        except ValueError:
+            return {}
+
+
+def _message_line(message: dict) -> bytes:
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class _Syncer:
+    """Background thread that fsyncs the logs written since its last pass."""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self._dirty: Set[Path] = set()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def mark(self, path: Path):
+        with self._cond:
+            self._dirty.add(path)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="session-fsync")
+                self._thread.start()
+
+    def sync(self):
+        with self._cond:
+            dirty, self._dirty = self._dirty, set()
+        for path in dirty:
+            for file_path in (path, index_path(path)):
+                try:
+                    with open(file_path, "ab") as f:
+                        os.fsync(f.fileno())
+                except FileNotFoundError:
+                    pass  # renamed or deleted since it was written
+                except OSError as e:
+                    logging.warning(f"Could not fsync {file_path}: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_s)
+            self.sync()
+
+
+_syncer = _Syncer(FSYNC_INTERVAL_S)
+atexit.register(_syncer.sync)
+
+
+def _write_session(path: Path, messages: List[dict], created_at: float, updated_at: Optional[float] = None):
+    """Write a complete session (log and index) via temporary files, replacing any existing one."""
+    log_tmp, idx_tmp = path.with_suffix(".jsonl.tmp"), path.with_suffix(".idx.tmp")
+    offsets = []
+    with open(log_tmp, "wb") as log:
+        log.write(_header_line(created_at))
+        for message in messages:
+            offsets.append(log.tell())
+            log.write(_message_line(message))
+        log.flush()
+        os.fsync(log.fileno())
+    with open(idx_tmp, "wb") as idx:
+        idx.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+        idx.flush()
+        os.fsync(idx.fileno())
+    # The index first: a log without an up-to-date index is repaired on read, not the reverse.
+    os.replace(idx_tmp, index_path(path))
+    os.replace(log_tmp, path)
+    title = next((t for t in map(session_catalog.title_of, messages) if t), "")
+    updated_at = updated_at or created_at
+    os.utime(path, (updated_at, updated_at))
+    session_catalog.upsert(path.parent, path.stem, created_at, updated_at, len(messages), title)
+    session_catalog.index_messages(path.parent, path.stem, messages)
+
+
+def migrate_legacy(legacy_path: Path) -> Path:
+    """Convert a JSON-array session file to a session log. Returns the log's path."""
+    path = legacy_path.with_suffix(SESSION_SUFFIX)
+    with _lock:
+        if not legacy_path.exists():
+            return path
+        try:
+            messages = json.loads(legacy_path.read_text(encoding="utf-8") or "[]")
+        except ValueError as e:
+            logging.error(f"Cannot convert unreadable session {legacy_path}: {e}")
+            return path
+        if not path.exists():
+            mtime = legacy_path.stat().st_mtime
+            _write_session(path, messages, created_at=mtime, updated_at=mtime)
+        legacy_path.unlink()
+    logging.info(f"Converted chat session {legacy_path.name} ({len(messages)} messages) to {path.name}")
+    return path
+
+
+def _read_offsets(path: Path) -> List[int]:
+    try:
+        data = index_path(path).read_bytes()
+    except FileNotFoundError:
+        return []
+    usable = len(data) - len(data) % _OFFSET.size
+    return [offset for (offset,) in _OFFSET.iter_unpack(data[:usable])]
+
+
+def _rebuild_index(path: Path) -> List[int]:
+    """Recreate the index by scanning the log, e.g. after a crash between the two appends."""
+    offsets = []
+    with open(path, "rb") as log:
+        log.readline()  # header
+        while True:
+            offset = log.tell()
+            line = log.readline()
+            if not line:
+                break
+            if line.endswith(b"\n"):
+                offsets.append(offset)
+    with open(index_path(path), "wb") as idx:
+        idx.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+    logging.info(f"Rebuilt message index of {path.name} ({len(offsets)} messages)")
+    return offsets
+
+
+def _truncate_torn_tail(path: Path) -> bool:
+    """
+    Cut off a partial last line left by a crash in the middle of an append, so the next
+    message starts on a line of its own. Returns whether anything was cut.
+    """
+    with open(path, "rb+") as log:
+        size = log.seek(0, os.SEEK_END)
+        if size == 0:
+            return False
+        log.seek(size - 1)
+        if log.read(1) == b"\n":
+            return False
+        end = cut = size
+        while end > 0:
+            start = max(end - TAIL_SCAN_BYTES, 0)
+            log.seek(start)
+            newline = log.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                cut = start + newline + 1
+                break
+            end = start
+        else:
+            cut = 0
+        log.truncate(cut)
+    logging.warning(f"Removed {size - cut} bytes of an incomplete message at the end of {path.name}")
+    return True
+
+
+def _offsets(path: Path) -> List[int]:
+    """Message offsets, checked against the end of the log: only its tail is read."""
+    _truncate_torn_tail(path)
+    offsets = _read_offsets(path)
+    size = path.stat().st_size
+    with open(path, "rb") as log:
+        if offsets:
+            if offsets[-1] >= size:
+                return _rebuild_index(path)
+            log.seek(offsets[-1])
+            log.readline()
+        else:
+            log.readline()  # header
+        # Anything after the last indexed message means the index is behind.
+        if log.readline():
+            return _rebuild_index(path)
+    return offsets
+
+
+def create_session(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        _write_session(path, [], created_at=time.time())
+
+
+def append_message(path: Path, message: dict):
+    """Append one message to a session; no earlier message is rewritten."""
+    if not path.exists():
+        legacy = path.with_suffix(LEGACY_SUFFIX)
+        if legacy.exists():
+            migrate_legacy(legacy)
+        else:
+            create_session(path)
+    line = _message_line(message)
+    with _lock:
+        if _truncate_torn_tail(path):
+            _offsets(path)  # drops index entries of the cut message
+        with open(path, "ab") as log:
+            offset = log.tell()
+            log.write(line)
+        with open(index_path(path), "ab") as idx:
+            seq = idx.tell() // _OFFSET.size
+            idx.write(_OFFSET.pack(offset))
+        session_catalog.record_message(path.parent, path.stem, seq, message, time.time())
+    _syncer.mark(path)
+
+
+def message_count(path: Path) -> int:
+    if not path.exists():
+        return 0
+    with _lock:
+        return len(_offsets(path))
+
+
+def load_messages(path: Path, last: Optional[int] = RECENT_MESSAGES) -> Tuple[List[dict], int]:
+    """
+    The last `last` messages of a session (all of them with None), oldest first,
+    and the session's total message count.
+    """
+    if not path.exists():
+        legacy = path.with_suffix(LEGACY_SUFFIX)
+        if not legacy.exists():
+            return [], 0
+        migrate_legacy(legacy)
+    with _lock:
+        offsets = _offsets(path)
+        start = 0 if last is None else max(len(offsets) - last, 0)
+        if start >= len(offsets):
+            return [], len(offsets)
+        with open(path, "rb") as log:
+            log.seek(offsets[start])
+            lines = log.read().splitlines()
+    messages = []
+    for line in lines:
+        try:
+            messages.append(json.loads(line))
+        except ValueError:
+            logging.warning(f"Skipping unreadable message in {path.name}")
+    return messages, len(offsets)
+
+
+def rename_session(path: Path, new_path: Path):
+    with _lock:
+        if index_path(path).exists():
+            os.rename(index_path(path), index_path(new_path))
+        os.rename(path, new_path)
+        session_catalog.rename(path.parent, path.stem, new_path.stem)
+
+
+def delete_session(path: Path):
+    with _lock:
+        for file_path in (path, index_path(path), path.with_suffix(LEGACY_SUFFIX)):
+            if file_path.exists():
+                os.remove(file_path)
+        session_catalog.delete(path.parent, [path.stem])
+
+
+_synced: Set[Path] = set()
+
+
+def sync_catalog(sessions_dir: str, force: bool = False):
+    """
+    Bring the session catalog in line with the session files on disk: convert legacy
+    sessions, add sessions the catalog does not know, index the text of sessions that
+    are not searchable yet and drop those that are gone. Runs once per process (or
+    when forced); afterwards every write keeps it current.
+    """
+    root = Path(sessions_dir)
+    if root in _synced and not force:
+        return
+    root.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        for legacy in root.glob(f"*{LEGACY_SUFFIX}"):
+            migrate_legacy(legacy)
+        on_disk = {path.stem: path for path in root.glob(f"*{SESSION_SUFFIX}")}
+        known = session_catalog.names(root)
+        for name in on_disk.keys() - known:
+            path = on_disk[name]
+            offsets = _offsets(path)
+            first = _read_message(path, offsets[0]) if offsets else {}
+            mtime = path.stat().st_mtime
+            created_at = _read_header(path).get("created_at", mtime)
+            session_catalog.upsert(root, name, created_at, mtime, len(offsets), session_catalog.title_of(first))
+        if known - on_disk.keys():
+            session_catalog.delete(root, sorted(known - on_disk.keys()))
+        searchable = session_catalog.text_indexed_names(root)
+        for name, path in on_disk.items():
+            if name not in searchable and message_count(path):
+                session_catalog.index_messages(root, name, load_messages(path, None)[0])
+        _synced.add(root)
+    if on_disk.keys() - known:
+        logging.info(f"Added {len(on_disk.keys() - known)} chat sessions to the session catalog.")
+
+
+def _read_message(path: Path, offset: int) -> dict:
+    with open(path, "rb") as log:
+        log.seek(offset)
+        try:
+            return json.loads(log.readline())
+        except ValueError:
+            return {}
+
+
+def list_sessions(sessions_dir: str, offset: int = 0, limit: int = 20, search: Optional[str] = None
+                  ) -> Tuple[List[dict], int]:
+    """A page of the session catalog (see session_catalog.page); each entry also carries its "path"."""
+    sync_catalog(sessions_dir)
+    root = Path(sessions_dir)
+    entries, total = session_catalog.page(root, offset, limit, search)
+    for entry in entries:
+        entry["path"] = root / f"{entry['name']}{SESSION_SUFFIX}"
+    return entries, total
+
+
+def latest_session(sessions_dir: str) -> Optional[Path]:
+    """The most recently updated session, or None if there are none."""
+    sync_catalog(sessions_dir)
+    name = session_catalog.latest(Path(sessions_dir))
+    return Path(sessions_dir) / f"{name}{SESSION_SUFFIX}" if name else None
+
+
+def search_messages(sessions_dir: str, query: str, limit: int = 20) -> List[dict]:
+    """Messages matching query across every session (see session_catalog.search), each with its session's "path"."""
+    sync_catalog(sessions_dir)
+    root = Path(sessions_dir)
+    hits = session_catalog.search(root, query, limit)
+    for hit in hits:
+        hit["path"] = root / f"{hit['session']}{SESSION_SUFFIX}"
+    return hits
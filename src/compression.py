@@ -0,0 +1,88 @@
+# src/compression.py
+import math
+import re
+import logging
+import threading
+from typing import List, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src import models
+from src.context import count_tokens
+
+# Sentence ends (., !, ?) followed by whitespace, or line breaks (code, lists, tables).
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Running totals across queries, shown on the System Performance page.
+_stats_lock = threading.Lock()
+totals = {"queries": 0, "tokens_before": 0, "tokens_after": 0}
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s and s.strip()]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def score_sentences(sentences: List[str], query_vector: List[float]) -> np.ndarray:
+    """Cosine similarity of every sentence to the query, embedding all sentences in one batch."""
+    sentence_vectors = np.asarray(models.embedder.embed_documents(sentences), dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    return _normalize_rows(sentence_vectors) @ query
+
+
+def compress_passages(passages: List[Document], query_vector: List[float], ratio: float = 0.5,
+                      neighbours: int = 1) -> Tuple[List[Document], dict]:
+    """
+    Keep only the sentences most similar to the query (plus `neighbours` sentences on
+    each side for coherence), up to `ratio` of all sentences. All sentences are embedded
+    in a single batch. Passages keep their order; skipped runs are marked with "...".
+    Returns (compressed passages, stats with token counts before/after).
+    """
+    tokens_before = sum(count_tokens(p.page_content) for p in passages)
+    split = [split_sentences(p.page_content) for p in passages]
+    flat = [(pi, si) for pi, sentences in enumerate(split) for si in range(len(sentences))]
+    if not flat or ratio >= 1.0:
+        return passages, {"tokens_before": tokens_before, "tokens_after": tokens_before, "saved": 0}
+
+    scores = score_sentences([split[pi][si] for pi, si in flat], query_vector)
+
+    n_keep = max(1, math.ceil(len(flat) * ratio))
+    keep = set()
+    for idx in np.argsort(-scores)[:n_keep]:
+        pi, si = flat[idx]
+        for neighbour in range(si - neighbours, si + neighbours + 1):
+            if 0 <= neighbour < len(split[pi]):
+                keep.add((pi, neighbour))
+
+    compressed = []
+    for pi, passage in enumerate(passages):
+        kept_idx = [si for si in range(len(split[pi])) if (pi, si) in keep]
+        if not kept_idx:
+            continue
+        pieces, previous = [], None
+        for si in kept_idx:
+            if previous is not None and si != previous + 1:
+                pieces.append("...")
+            pieces.append(split[pi][si])
+            previous = si
+        text = " ".join(pieces)
+        compressed.append(Document(page_content=text, metadata=dict(passage.metadata)))
+
+    tokens_after = sum(count_tokens(p.page_content) for p in compressed)
+    stats = {"tokens_before": tokens_before, "tokens_after": tokens_after, "saved": tokens_before - tokens_after}
+    with _stats_lock:
+        totals["queries"] += 1
+        totals["tokens_before"] += tokens_before
+        totals["tokens_after"] += tokens_after
+    logging.info(
+        f"Compressed context from {tokens_before} to {tokens_after} tokens "
+        f"({stats['saved']} saved, {len(keep)}/{len(flat)} sentences kept)"
+    )
+    return compressed, stats
@@ -0,0 +1,128 @@
+# src/context.py
+import logging
+from typing import Callable, Dict, List, Tuple
+
+from langchain.docstore.document import Document
+
+from src import models
+
+# Tokens kept free between the prompt and n_ctx to absorb tokenizer/template differences.
+SAFETY_MARGIN = 16
+# Passages that would be cut below this many tokens are dropped instead of truncated.
+MIN_PASSAGE_TOKENS = 48
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the loaded model's tokenizer, or estimate (~4 chars/token) without one."""
+    if models.llm is not None:
+        try:
+            return len(models.llm.client.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+        except Exception as e:
+            logging.debug(f"Tokenizer unavailable, estimating token count: {e}")
+    return len(text) // 4 + 1
+
+
+def merge_chunks(docs: List[Document]) -> List[Document]:
+    """
+    Merge overlapping or adjacent chunks of the same loaded document into single passages
+    and drop duplicate text. Passages keep the rank of their best chunk, so the result is
+    still ordered by relevance.
+    """
+    # start_index counts from the start of the loaded document (a PDF page, a CSV row),
+    # so only chunks of the same page or row of a file can be merged.
+    groups: Dict[tuple, List[Tuple[int, Document]]] = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("file_path") or doc.metadata.get("source", ""),
+               doc.metadata.get("page"), doc.metadata.get("row"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    passages: List[Tuple[int, Document]] = []
+    for group in groups.values():
+        positioned = sorted((item for item in group if "start_index" in item[1].metadata),
+                            key=lambda item: item[1].metadata["start_index"])
+        unpositioned = [item for item in group if "start_index" not in item[1].metadata]
+
+        current = None
+        for rank, doc in positioned:
+            start = doc.metadata["start_index"]
+            if current is not None and start <= current["end"]:
+                overlap = current["end"] - start
+                current["text"] += doc.page_content[overlap:]
+                current["end"] = max(current["end"], start + len(doc.page_content))
+                current["rank"] = min(current["rank"], rank)
+                current["chunk_ids"].append(doc.metadata.get("chunk_id"))
+                continue
+            if current is not None:
+                passages.append(_to_passage(current))
+            current = {"doc": doc, "text": doc.page_content, "end": start + len(doc.page_content),
+                       "rank": rank, "chunk_ids": [doc.metadata.get("chunk_id")]}
+        if current is not None:
+            passages.append(_to_passage(current))
+        passages.extend(unpositioned)
+
+    passages.sort(key=lambda item: item[0])
+    unique: List[Document] = []
+    for _, passage in passages:
+        text = passage.page_content.strip()
+        if any(text in kept.page_content for kept in unique):
+            continue
+        unique.append(passage)
+    return unique
+
+
+def _to_passage(merged: dict) -> Tuple[int, Document]:
+    metadata = {**merged["doc"].metadata, "merged_chunk_ids": [c for c in merged["chunk_ids"] if c]}
+    return merged["rank"], Document(page_content=merged["text"], metadata=metadata)
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens, on a whitespace boundary where possible."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > low // 2 else cut) + " ..."
+
+
+def pack_context(passages: List[Document], build_prompt: Callable[[str], str], n_ctx: int,
+                 max_new_tokens: int) -> Tuple[str, List[Document], dict]:
+    """
+    Assemble as many passages (see merge_chunks) as fit into n_ctx while keeping
+    max_new_tokens free for generation. build_prompt renders the full prompt for a
+    given context string. Returns (context, passages used, stats).
+    """
+    overhead = count_tokens(build_prompt(""))
+    budget = n_ctx - max_new_tokens - overhead - SAFETY_MARGIN
+    stats = {"budget": max(budget, 0), "passages": len(passages), "used": 0, "dropped": 0,
+             "truncated": 0, "prompt_tokens": overhead}
+
+    parts: List[str] = []
+    used: List[Document] = []
+    remaining = budget
+    separator_tokens = count_tokens("\n\n")
+    for passage in passages:
+        cost = count_tokens(passage.page_content) + (separator_tokens if parts else 0)
+        if cost <= remaining:
+            parts.append(passage.page_content)
+            used.append(passage)
+            remaining -= cost
+        elif remaining - separator_tokens >= MIN_PASSAGE_TOKENS:
+            parts.append(_truncate_to_tokens(passage.page_content, remaining - separator_tokens))
+            used.append(passage)
+            stats["truncated"] += 1
+            remaining = 0
+        else:
+            stats["dropped"] += 1
+
+    context = "\n\n".join(parts)
+    stats["used"] = budget - remaining if budget > 0 else 0
+    stats["prompt_tokens"] = overhead + stats["used"]
+    logging.info(f"Packed {len(used)}/{len(passages)} passages into {stats['used']}/{stats['budget']} context tokens")
+    return context, used, stats
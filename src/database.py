@@ -1,104 +1,453 @@
+import os
+import atexit
 import logging
 import json
-from getpass import getpass
-from typing import List, Optional
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-from typing import Optional
-import mysql.connector
+# Storage backends selectable in Settings.
+STORAGE_BACKENDS = ("mysql", "sqlite")
+DEFAULT_SQLITE_PATH = "synthcerebrum.db"
 
-mysql_conn: Optional[mysql.connector.connection.MySQLConnection] = None
+# Per-interaction metrics filled in by answer_query(stats=...), stored as columns of interactions.
+# Tables created before these existed get the missing columns added when storage is opened.
+INTERACTION_METRICS = {
+    "total_ms": "DOUBLE",
+    "embed_ms": "DOUBLE",
+    "search_ms": "DOUBLE",
+    "prompt_build_ms": "DOUBLE",
+    "prompt_eval_ms": "DOUBLE",
+    "generation_ms": "DOUBLE",
+    "prompt_tokens": "INTEGER",
+    "completion_tokens": "INTEGER",
+    "compression_tokens_before": "INTEGER",
+    "compression_tokens_saved": "INTEGER",
+    "tokens_per_s": "DOUBLE",
+    "k": "INTEGER",
+    "index_generation": "BIGINT",
+    "answer_cache_hit": "SMALLINT",
+    "retrieval_cache_hit": "SMALLINT",
+    "outcome": "VARCHAR(16)",
+}
+# Indexes on interactions, by name; time-window summaries scan by created_at.
+INTERACTION_INDEXES = {
+    "idx_interactions_created_at": "created_at",
+    "idx_interactions_total_ms": "total_ms",
+    "idx_interactions_outcome": "outcome",
+}
+# Metrics summarized as percentiles by latency_summary.
+SUMMARY_METRICS = ("total_ms", "embed_ms", "search_ms", "prompt_build_ms", "prompt_eval_ms", "generation_ms",
+                   "tokens_per_s")
+PERCENTILES = (50, 95, 99)
 
+# Columns written per table; backends build their INSERT statements from these.
+TABLE_COLUMNS = {
+    "interactions": ("user_query", "answer", "context_snippet", "sources_json") + tuple(INTERACTION_METRICS),
+    "knowledge_files": ("file_path",),
+}
 
-def init_mysql_database(cfg: dict):
+# MySQL connections shared by every thread; each borrower gets its own connection.
+POOL_SIZE = 4
+
+
+class MySQLStorage:
+    """Interaction storage on a MySQL server, written through a connection pool."""
+
+    name = "mysql"
+    placeholder = "%s"
+    epoch_sql = "UNIX_TIMESTAMP(created_at)"
+
+    def __init__(self, cfg: dict):
+        """
+        Connects to MySQL, creates database + tables if not exist.
+        Tables:
+          - interactions(id, user_query, answer, context_snippet, sources_json, created_at, <INTERACTION_METRICS>)
+          - knowledge_files(id, file_path, added_at)
+        """
+        import mysql.connector
+        from mysql.connector import pooling
+
+        cfg_copy = cfg.copy()
+        # Never prompt: this runs in a background thread. MYSQL_PASSWORD is used when no password is configured.
+        cfg_copy["password"] = cfg.get("password") or os.environ.get("MYSQL_PASSWORD", "")
+
+        # First connect without database to create it if needed
+        tmp_cfg = cfg_copy.copy()
+        dbname = tmp_cfg.pop("database", None)
+        try:
+            conn = mysql.connector.connect(**tmp_cfg)
+            cursor = conn.cursor()
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{dbname}` DEFAULT CHARACTER SET 'utf8mb4'")
+            conn.close()
+        except mysql.connector.Error as err:
+            logging.error(f"MySQL error while creating database: {err}")
+            raise
+
+        # Now connect to the database
+        try:
+            conn = mysql.connector.connect(**cfg_copy)
+            cursor = conn.cursor()
+            # interactions table
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS interactions (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    user_query TEXT NOT NULL,
+                    answer LONGTEXT,
+                    context_snippet LONGTEXT,
+                    sources_json LONGTEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB;
+                """
+            )
+            # knowledge_files table (record of files added/learned)
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS knowledge_files (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    file_path VARCHAR(1024) NOT NULL,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB;
+                """
+            )
+            cursor.execute("SHOW COLUMNS FROM interactions")
+            columns = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SHOW INDEX FROM interactions")
+            indexes = {row[2] for row in cursor.fetchall()}
+            _migrate_interactions(cursor, columns, indexes)
+            conn.commit()
+            conn.close()
+            # The pool reconnects stale connections on checkout, so a restarted server is picked up again.
+            self.pool = pooling.MySQLConnectionPool(pool_name="synthcerebrum", pool_size=POOL_SIZE,
+                                                    pool_reset_session=True, **cfg_copy)
+            logging.info("MySQL initialized and tables are ready.")
+        except mysql.connector.Error as err:
+            logging.error(f"MySQL connection error: {err}")
+            raise
+
+    def connect(self):
+        """A pooled connection; close() returns it to the pool."""
+        return self.pool.get_connection()
+
+    @staticmethod
+    def is_permanent(error: Exception) -> bool:
+        """True for errors caused by the rows themselves (e.g. too long for a TEXT column); retrying cannot help."""
+        import mysql.connector
+        return isinstance(error, (mysql.connector.DataError, mysql.connector.ProgrammingError,
+                                  mysql.connector.IntegrityError))
+
+    def since(self, seconds: float) -> Tuple[str, tuple]:
+        """WHERE clause and parameters selecting interactions of the last `seconds`."""
+        return "created_at >= NOW() - INTERVAL %s SECOND", (int(seconds),)
+
+
+class SQLiteStorage:
+    """
+    Embedded interaction storage in a local SQLite file, in WAL mode so the writer
+    never blocks readers. Same tables as MySQL, plus indexes on the timestamps.
+    """
+
+    name = "sqlite"
+    placeholder = "?"
+    epoch_sql = "CAST(strftime('%s', created_at) AS INTEGER)"
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self.connect()
+        try:
+            # WAL persists in the database file; later connections inherit it.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS interactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_query TEXT NOT NULL,
+                    answer TEXT,
+                    context_snippet TEXT,
+                    sources_json TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS knowledge_files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_path TEXT NOT NULL,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS idx_knowledge_files_added_at ON knowledge_files (added_at);
+                """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(interactions)")}
+            indexes = {row[1] for row in conn.execute("PRAGMA index_list(interactions)")}
+            _migrate_interactions(conn.cursor(), columns, indexes)
+            conn.commit()
+        finally:
+            conn.close()
+        logging.info(f"SQLite storage initialized at {path} (WAL mode).")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        # With WAL, NORMAL only risks the last commits on power loss, never corruption.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def is_permanent(error: Exception) -> bool:
+        """True for errors caused by the rows themselves; retrying cannot help."""
+        return isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.ProgrammingError,
+                                  sqlite3.InterfaceError))
+
+    def since(self, seconds: float) -> Tuple[str, tuple]:
+        """WHERE clause and parameters selecting interactions of the last `seconds`."""
+        # CURRENT_TIMESTAMP is UTC, as is datetime('now').
+        return "created_at >= datetime('now', ?)", (f"-{int(seconds)} seconds",)
+
+
+def _migrate_interactions(cursor, columns: set, indexes: set):
+    """Add the metric columns and indexes an existing interactions table is missing."""
+    for column, sql_type in INTERACTION_METRICS.items():
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE interactions ADD COLUMN {column} {sql_type}")
+            logging.info(f"Added column interactions.{column}")
+    for index, column in INTERACTION_INDEXES.items():
+        if index not in indexes:
+            cursor.execute(f"CREATE INDEX {index} ON interactions ({column})")
+
+
+# The active backend; None until init_storage succeeds.
+storage = None
+
+
+def _insert_statement(backend, table: str) -> str:
+    columns = TABLE_COLUMNS[table]
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({','.join([backend.placeholder] * len(columns))})"
+
+
+class BatchWriter:
     """
-    Connects to MySQL, creates database + tables if not exist.
-    Tables:
-      - interactions(id, user_query, answer, context_snippet, sources_json, created_at)
-      - knowledge_files(id, file_path, added_at)
+    Single background thread that drains a bounded queue of (table, row) pairs and
+    writes them with one executemany per table and one commit per batch. Failed
+    batches are retried with exponential backoff on a fresh connection; when the queue
+    is full, new rows are dropped rather than blocking the caller. Rows the database
+    refuses outright (see is_permanent on the backends) are written one by one and
+    the refused ones are discarded, so they cannot hold up the queue.
     """
-    global mysql_conn
-    pwd = cfg.get("password") or ""
-    if not pwd:
-        # ask interactively if not set (safer)
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 200, max_wait_s: float = 1.0,
+                 max_backoff_s: float = 30.0):
+        self.batch_size = batch_size
+        self.max_wait_s = max_wait_s
+        self.max_backoff_s = max_backoff_s
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self.stats = {"written": 0, "batches": 0, "dropped": 0, "retries": 0, "rejected": 0}
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True, name="db-writer")
+                self._worker.start()
+
+    def submit(self, table: str, row: tuple):
+        self._ensure_worker()
         try:
-            pwd = getpass(prompt="MySQL password (press Enter for none): ")
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            logging.warning("Database write queue is full; dropping a row.")
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until everything queued so far is written (or given up on). Returns False on timeout."""
+        if self._worker is None or not self._worker.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _collect_batch(self) -> Tuple[List[Tuple[str, tuple]], List[threading.Event]]:
+        rows, markers = [], []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.max_wait_s
+        while True:
+            table, payload = item
+            if table is None:
+                markers.append(payload)
+                break  # write what we have now so flush() returns promptly
+            rows.append(item)
+            remaining = deadline - time.monotonic()
+            if len(rows) >= self.batch_size or remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return rows, markers
+
+    @staticmethod
+    def _write(backend, rows: List[Tuple[str, tuple]]):
+        grouped: Dict[str, List[tuple]] = {}
+        for table, row in rows:
+            grouped.setdefault(table, []).append(row)
+        conn = backend.connect()
+        try:
+            cursor = conn.cursor()
+            for table, params in grouped.items():
+                cursor.executemany(_insert_statement(backend, table), params)
+            conn.commit()
         except Exception:
-            pwd = ""
-    cfg_copy = cfg.copy()
-    cfg_copy["password"] = pwd
+            # A half-written batch would otherwise keep its write lock until the connection is collected.
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
-    # First connect without database to create it if needed
-    tmp_cfg = cfg_copy.copy()
-    dbname = tmp_cfg.pop("database", None)
-    try:
-        conn = mysql.connector.connect(**tmp_cfg)
-        cursor = conn.cursor()
-        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{dbname}` DEFAULT CHARACTER SET 'utf8mb4'")
-        conn.close()
-    except mysql.connector.Error as err:
-        logging.error(f"MySQL error while creating database: {err}")
-        raise
+    def _write_separately(self, backend, rows: List[Tuple[str, tuple]], error: Exception) -> List[Tuple[str, tuple]]:
+        """
+        Write a refused batch row by row, discarding the rows that are refused again.
+        Returns the rows left unwritten by any other error, to be retried as usual.
+        """
+        logging.warning(f"{backend.name} refused a batch of {len(rows)} rows ({error}); writing them one by one.")
+        for i, row in enumerate(rows):
+            try:
+                self._write(backend, [row])
+            except Exception as e:
+                if not backend.is_permanent(e):
+                    return rows[i:]
+                self.stats["rejected"] += 1
+                logging.error(f"Discarding a row {backend.name} cannot store in {row[0]}: {e}")
+            else:
+                self.stats["written"] += 1
+                self.stats["batches"] += 1
+        return []
 
-    # Now connect to the database
-    try:
-        conn = mysql.connector.connect(**cfg_copy)
-        mysql_conn = conn
-        cursor = conn.cursor()
-        # interactions table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS interactions (
-                id BIGINT AUTO_INCREMENT PRIMARY KEY,
-                user_query TEXT NOT NULL,
-                answer LONGTEXT,
-                context_snippet LONGTEXT,
-                sources_json LONGTEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            ) ENGINE=InnoDB;
-            """
-        )
-        # knowledge_files table (record of files added/learned)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS knowledge_files (
-                id BIGINT AUTO_INCREMENT PRIMARY KEY,
-                file_path VARCHAR(1024) NOT NULL,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            ) ENGINE=InnoDB;
-            """
-        )
-        conn.commit()
-        logging.info("MySQL initialized and tables are ready.")
-    except mysql.connector.Error as err:
-        logging.error(f"MySQL connection error: {err}")
-        raise
-
-
-def save_interaction(user_query: str, answer: str, sources: List[str]):
-    """Save a Q/A interaction to MySQL (non-blocking best-effort)."""
-    global mysql_conn
-    try:
-        if mysql_conn is None:
-            logging.debug("MySQL connection not set; skipping save_interaction.")
-            return
-        cursor = mysql_conn.cursor()
-        sources_json = json.dumps(sources, ensure_ascii=False)
-        cursor.execute(
-            "INSERT INTO interactions (user_query, answer, context_snippet, sources_json) VALUES (%s,%s,%s,%s)",
-            (user_query, answer, "" if not sources else "\n".join(sources[:5]), sources_json),
-        )
-        mysql_conn.commit()
-    except Exception as e:
-        logging.exception(f"Failed to save interaction to MySQL: {e}")
+    def _run(self):
+        while True:
+            rows, markers = self._collect_batch()
+            backoff = 1.0
+            while rows:
+                backend = storage
+                if backend is None:
+                    logging.debug(f"Storage not initialized; discarding {len(rows)} queued rows.")
+                    break
+                try:
+                    self._write(backend, rows)
+                    self.stats["written"] += len(rows)
+                    self.stats["batches"] += 1
+                    break
+                except Exception as e:
+                    if backend.is_permanent(e):
+                        rows = self._write_separately(backend, rows, e)
+                        continue
+                    if markers:
+                        # Shutting down: don't hold the process hostage to an unreachable server.
+                        logging.error(f"Failed to write {len(rows)} rows to {backend.name} during flush: {e}")
+                        break
+                    self.stats["retries"] += 1
+                    logging.warning(f"{backend.name} write failed ({e}); retrying in {backoff:.0f}s.")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff_s)
+            for marker in markers:
+                marker.set()
+
+
+writer = BatchWriter()
+atexit.register(writer.flush)
+
+
+def init_storage(backend: str, mysql_config: Optional[dict] = None, sqlite_path: str = DEFAULT_SQLITE_PATH):
+    """Open the selected storage backend ("mysql" or "sqlite") and make it the one rows are written to."""
+    global storage
+    if backend == "sqlite":
+        storage = SQLiteStorage(sqlite_path)
+    elif backend == "mysql":
+        storage = MySQLStorage(mysql_config or {})
+    else:
+        raise ValueError(f"Unknown storage backend '{backend}'; expected one of {STORAGE_BACKENDS}")
+
+
+def init_mysql_database(cfg: dict):
+    """Use MySQL for storage, creating the database and tables if needed."""
+    init_storage("mysql", mysql_config=cfg)
+
+
+def save_interaction(user_query: str, answer: str, sources: List[str], metrics: Optional[dict] = None):
+    """
+    Queue a Q/A interaction for the background storage writer. Returns immediately.
+    Metrics are the stats filled in by answer_query; missing ones are stored as NULL.
+    """
+    sources_json = json.dumps(sources, ensure_ascii=False)
+    metrics = metrics or {}
+    # Booleans (cache hits) are stored as 0/1.
+    metric_values = tuple(
+        int(value) if isinstance(value, bool) else value
+        for value in (metrics.get(column) for column in INTERACTION_METRICS)
+    )
+    writer.submit(
+        "interactions",
+        (user_query, answer, "" if not sources else "\n".join(sources[:5]), sources_json) + metric_values,
+    )
 
 
 def save_knowledge_file_record(file_path: str):
-    global mysql_conn
+    writer.submit("knowledge_files", (file_path,))
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of an ascending, non-empty list."""
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _summarize(rows: List[tuple]) -> dict:
+    summary = {"count": len(rows)}
+    if rows:
+        summary["answer_cache_hit_rate"] = sum(1 for row in rows if row[-2]) / len(rows)
+        summary["retrieval_cache_hit_rate"] = sum(1 for row in rows if row[-1]) / len(rows)
+    for i, metric in enumerate(SUMMARY_METRICS, start=1):
+        values = sorted(row[i] for row in rows if row[i] is not None)
+        if values:
+            summary[metric] = {f"p{p}": _percentile(values, p) for p in PERCENTILES}
+    return summary
+
+
+def latency_summary(window_s: float = 3600, bucket_s: Optional[float] = None) -> List[dict]:
+    """
+    p50/p95/p99 of each of SUMMARY_METRICS, plus interaction count and cache hit rates,
+    over the interactions logged in the last window_s seconds. With bucket_s, the window
+    is split into consecutive buckets of that length, oldest first, each with its start
+    time (epoch seconds) under "start"; otherwise a single summary is returned. Interactions
+    still queued for the writer are not included.
+    """
+    backend = storage
+    if backend is None:
+        return []
+    where, params = backend.since(window_s)
+    query = (
+        f"SELECT {backend.epoch_sql}, {', '.join(SUMMARY_METRICS)}, answer_cache_hit, retrieval_cache_hit "
+        f"FROM interactions WHERE {where}"
+    )
+    conn = backend.connect()
     try:
-        if mysql_conn is None:
-            return
-        cursor = mysql_conn.cursor()
-        cursor.execute("INSERT INTO knowledge_files (file_path) VALUES (%s)", (file_path,))
-        mysql_conn.commit()
-    except Exception:
-        logging.exception("Failed to save knowledge file record.")
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    now = time.time()
+    if not bucket_s:
+        return [dict(_summarize(rows), start=now - window_s)]
+    n_buckets = int(-(-window_s // bucket_s))
+    first = now - window_s
+    buckets: Dict[int, List[tuple]] = {}
+    for row in rows:
+        i = min(max(int((float(row[0]) - first) // bucket_s), 0), n_buckets - 1)
+        buckets.setdefault(i, []).append(row)
+    return [dict(_summarize(buckets.get(i, [])), start=first + i * bucket_s) for i in range(n_buckets)]
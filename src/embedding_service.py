@@ -0,0 +1,97 @@
+# src/embedding_service.py
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from src import models
+
+
+class EmbeddingBatcher:
+    """
+    Collects query embedding requests from concurrent callers for up to max_wait_ms and
+    runs them through the embedder as one batch, handing each caller its own vector.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "embed_seconds": 0.0, "wait_seconds": 0.0, "largest_batch": 0}
+
+    def configure(self, max_batch_size: int, max_wait_ms: float):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True, name="embedding-batcher")
+                self._worker.start()
+
+    def embed(self, text: str) -> List[float]:
+        """Embed one query; blocks until the batch containing it has been processed."""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            # Identical queries in one batch are embedded once.
+            unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = dict(zip(unique_texts, models.embedder.embed_documents(unique_texts)))
+            except Exception as e:
+                logging.error(f"Batched query embedding failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for text, future, _ in batch:
+                future.set_result(vectors[text])
+            finished = time.perf_counter()
+            with self._stats_lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["embed_seconds"] += finished - started
+                self._stats["wait_seconds"] += sum(started - enqueued for _, _, enqueued in batch)
+                self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+        batches = s["batches"] or 1
+        requests = s["requests"] or 1
+        return {
+            "requests": s["requests"],
+            "batches": s["batches"],
+            "avg_batch_size": s["requests"] / batches,
+            "largest_batch": s["largest_batch"],
+            "avg_queue_wait_ms": s["wait_seconds"] / requests * 1000,
+            "avg_batch_ms": s["embed_seconds"] / batches * 1000,
+            "throughput_per_s": s["requests"] / s["embed_seconds"] if s["embed_seconds"] else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+        }
+
+
+# Shared instance used by the retrieval path.
+batcher = EmbeddingBatcher()
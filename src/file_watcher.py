@@ -1,39 +1,69 @@
 import logging
 import time
 import threading
+from contextlib import nullcontext
+from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from src.indexing import update_vector_store, force_reindex, initial_scan_and_index
+from src.indexing import update_vector_store, refresh_files_in_index, remove_files_from_index
+from src.knowledge_catalog import catalog_for
+from src.upload_jobs import uploads, PARTIAL_SUFFIX
+
+
+def _handled_elsewhere(path) -> bool:
+    """Uploads still being written, and uploads indexed by the upload queue itself."""
+    return str(path).endswith(PARTIAL_SUFFIX) or uploads.owns(path)
+
 
 class KnowledgeFolderHandler(FileSystemEventHandler):
-    def __init__(self, knowledge_dir, index_path):
+    def __init__(self, knowledge_dir, index_path, context=None):
         self.index_path = index_path
         self.knowledge_dir = knowledge_dir
+        # Returns a context manager entered around every index update, e.g. to activate a collection.
+        self.context = context or nullcontext
+        # The file listing is updated before indexing, which can take much longer.
+        self.catalog = catalog_for(knowledge_dir)
 
     def on_created(self, event):
-        if not event.is_directory:
+        if not event.is_directory and not _handled_elsewhere(event.src_path):
             logging.info(f"Detected new file: {event.src_path}")
-            update_vector_store([event.src_path], self.index_path)
+            self.catalog.file_changed(event.src_path)
+            with self.context():
+                update_vector_store([event.src_path], self.index_path, knowledge_dir=self.knowledge_dir)
 
     def on_modified(self, event):
-        if not event.is_directory:
+        if not event.is_directory and not _handled_elsewhere(event.src_path):
             logging.info(f"Detected modified file: {event.src_path}")
-            # For simplicity, re-indexing on modification.
-            # A more advanced approach would be to remove old vectors and add new ones.
-            force_reindex(self.index_path)
-            initial_scan_and_index(self.knowledge_dir, self.index_path)
+            self.catalog.file_changed(event.src_path)
+            # Only the chunks of this file that actually changed are removed and re-embedded.
+            with self.context():
+                refresh_files_in_index([event.src_path], self.index_path, knowledge_dir=self.knowledge_dir)
             
     def on_deleted(self, event):
-        if not event.is_directory:
-            logging.info(f"Detected deleted file: {event.src_path}")
-            # Rebuild the entire index from scratch
-            force_reindex(self.index_path)
-            initial_scan_and_index(self.knowledge_dir, self.index_path)
+        # Directory deletions remove every chunk that came from files below it.
+        logging.info(f"Detected deleted {'directory' if event.is_directory else 'file'}: {event.src_path}")
+        self.catalog.file_removed(event.src_path)
+        with self.context():
+            remove_files_from_index([event.src_path], self.index_path)
+
+    def on_moved(self, event):
+        if _handled_elsewhere(event.src_path) or _handled_elsewhere(event.dest_path):
+            return
+        logging.info(f"Detected moved path: {event.src_path} -> {event.dest_path}")
+        self.catalog.file_removed(event.src_path)
+        self.catalog.file_changed(event.dest_path)
+        with self.context():
+            remove_files_from_index([event.src_path], self.index_path)
+            if event.is_directory:
+                update_vector_store([str(p) for p in Path(event.dest_path).rglob("*") if p.is_file()], self.index_path,
+                                    knowledge_dir=self.knowledge_dir)
+            else:
+                update_vector_store([event.dest_path], self.index_path, knowledge_dir=self.knowledge_dir)
 
 
-def start_file_watcher_background(knowledge_dir, index_path):
-    handler = KnowledgeFolderHandler(knowledge_dir, index_path)
+def start_file_watcher_background(knowledge_dir, index_path, context=None):
+    handler = KnowledgeFolderHandler(knowledge_dir, index_path, context)
     observer = Observer()
     observer.schedule(handler, knowledge_dir, recursive=True) # Recursive to watch subdirectories
     observer.start()
@@ -41,7 +71,7 @@ def start_file_watcher_background(knowledge_dir, index_path):
     # run in its own daemon thread so it exits with program
     def _observe_loop():
         try:
-            while True:
+            while observer.is_alive():
                 time.sleep(1)
         except KeyboardInterrupt:
             observer.stop()
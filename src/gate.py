@@ -0,0 +1,131 @@
+# src/gate.py
+import json
+import random
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from src import models
+from src.indexing import db_lock
+from src.compression import split_sentences
+from src.lexical import identifier_terms
+from src.retrieval import dense_search, normalize_filters
+
+# Calibrated maximum L2 distances, one per embedding model.
+THRESHOLDS_PATH = "gate_thresholds.json"
+
+REFUSAL = "I cannot answer this question based on the provided information."
+
+# Generic questions that a personal knowledge base is not expected to answer.
+_OFF_TOPIC_QUERIES = [
+    "What is the capital of Mongolia?",
+    "How do I bake sourdough bread at home?",
+    "Who won the football world cup in 1974?",
+    "What is the boiling point of mercury?",
+    "Recommend a good science fiction movie.",
+    "How many moons does Neptune have?",
+    "What is the best way to train a puppy?",
+    "Translate good morning into Japanese.",
+    "How tall is Mount Kilimanjaro?",
+    "What are the rules of cricket?",
+    "Write a poem about the ocean.",
+    "Which planet has the longest day?",
+]
+
+_stats_lock = threading.Lock()
+stats = {"checked": 0, "fired": 0, "saved_seconds": 0.0}
+_llm_seconds: Optional[float] = None  # moving average of LLM call latency
+
+
+def load_thresholds() -> dict:
+    path = Path(THRESHOLDS_PATH)
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable gate thresholds {THRESHOLDS_PATH}: {e}")
+        return {}
+
+
+def get_threshold(embedding_model_name: Optional[str] = None) -> Optional[float]:
+    """Calibrated distance threshold for the given (default: current) embedder, if any."""
+    name = embedding_model_name or getattr(models.embedder, "model_name", None)
+    entry = load_thresholds().get(name)
+    return entry["threshold"] if entry else None
+
+
+def calibrate_threshold(sample_size: int = 200, seed: int = 0) -> dict:
+    """
+    Derive a distance threshold for the current embedder and index. Sentences taken
+    from indexed chunks act as relevant queries, generic off-topic questions as
+    irrelevant ones; the threshold sits between the 95th percentile of relevant and
+    the 10th percentile of irrelevant nearest-chunk distances, erring towards answering.
+    """
+    with db_lock:
+        chunks = [doc.page_content for _, doc in models.iter_indexed_chunks()]
+    if not chunks:
+        raise RuntimeError("The index is empty; add documents before calibrating.")
+
+    rng = random.Random(seed)
+    positives = []
+    for text in rng.sample(chunks, min(sample_size, len(chunks))):
+        sentences = [s for s in split_sentences(text) if len(s.split()) >= 4] or [text[:200]]
+        positives.append(rng.choice(sentences))
+
+    def nearest_distances(queries):
+        vectors = models.embedder.embed_documents(queries)
+        with db_lock:
+            return [models.db.similarity_search_with_score_by_vector(v, k=1)[0][1] for v in vectors]
+
+    pos = np.asarray(nearest_distances(positives), dtype=np.float32)
+    neg = np.asarray(nearest_distances(_OFF_TOPIC_QUERIES), dtype=np.float32)
+    pos_p95 = float(np.percentile(pos, 95))
+    neg_p10 = float(np.percentile(neg, 10))
+    threshold = max(pos_p95, (pos_p95 + neg_p10) / 2)
+
+    name = getattr(models.embedder, "model_name", None)
+    result = {"threshold": threshold, "relevant_p95": pos_p95, "irrelevant_p10": neg_p10, "samples": len(positives)}
+    thresholds = load_thresholds()
+    thresholds[name] = result
+    Path(THRESHOLDS_PATH).write_text(json.dumps(thresholds, indent=4), encoding="utf-8")
+    logging.info(f"Calibrated confidence gate for {name}: {result}")
+    return result
+
+
+def should_refuse(query: str, vector, threshold: float, lexical: bool = False,
+                  filters: Optional[dict] = None) -> bool:
+    """
+    True when even the nearest chunk is farther than threshold. With lexical, an
+    identifier or code from the query (e.g. `getUserName`, `E1234`) that occurs in the
+    index keeps the gate open, so exact identifiers the embedder ranks poorly are still
+    answered. Ordinary words do not: nearly every question shares some with the index.
+    With filters, only the chunks retrieval would search are considered.
+    """
+    with db_lock:
+        if models.db is None:
+            return False
+        allowed = models.metadata_index.resolve(filters) if normalize_filters(filters) else None
+        nearest = dense_search(vector, 1, allowed)
+        has_lexical_hit = lexical and any(
+            models.bm25.document_frequency(t, allowed) for t in identifier_terms(query)
+        )
+    fired = bool(nearest) and nearest[0][1] > threshold and not has_lexical_hit
+    with _stats_lock:
+        stats["checked"] += 1
+        if fired:
+            stats["fired"] += 1
+            stats["saved_seconds"] += _llm_seconds or 0.0
+    if fired:
+        logging.info(f"Confidence gate fired: nearest distance {nearest[0][1]:.3f} > {threshold:.3f}")
+    return fired
+
+
+def record_llm_latency(seconds: float):
+    """Feed the latency estimate used to report how much time the gate saved."""
+    global _llm_seconds
+    with _stats_lock:
+        _llm_seconds = seconds if _llm_seconds is None else 0.8 * _llm_seconds + 0.2 * seconds
@@ -0,0 +1,202 @@
+# src/hot_reload.py
+import os
+import logging
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from src import models
+from src.startup import StartupState, start_background_initialization, _init_database, _init_llm, _settle_index
+from src.indexing import force_reindex, initial_scan_and_index, refresh_files_in_index
+from src.file_watcher import start_file_watcher_background
+from src.knowledge_collections import manager as collection_manager, DEFAULT_COLLECTION
+from src.retrieval import answer_cache
+
+# Session settings grouped by the component that has to be reloaded when they change.
+# Settings not listed here (prompt, k, reranking, ...) are read on every query and need no reload.
+COMPONENT_SETTINGS = {
+    "database": ("STORAGE_BACKEND", "SQLITE_PATH", "MYSQL_HOST", "MYSQL_USER", "MYSQL_PASSWORD", "MYSQL_DATABASE",
+                 "MYSQL_PORT"),
+    "embedder": ("EMBEDDING_MODEL_NAME",),
+    "index": ("KNOWLEDGE_DIR", "INDEX_PATH", "SHARD_BY_FOLDER"),
+    "chunking": ("CHUNK_SIZE", "CHUNK_OVERLAP"),
+    "llm": ("LLM_MODEL_PATH", "LOAD_LLM", "N_CTX", "N_BATCH", "N_THREADS", "N_GPU_LAYERS", "USE_MMAP", "USE_MLOCK",
+            "KV_CACHE_TYPE"),
+}
+RELOAD_KEYS = tuple(key for keys in COMPONENT_SETTINGS.values() for key in keys)
+
+# Files re-chunked per index update when only the chunking changed.
+RECHUNK_BATCH_FILES = 32
+
+# The state of the resources loaded by start(); None until then.
+current: Optional[StartupState] = None
+_reload_lock = threading.Lock()
+
+
+def runtime_settings(session_state) -> dict:
+    """The settings that determine which resources are loaded."""
+    return {key: session_state[key] for key in RELOAD_KEYS}
+
+
+def mysql_config(settings: dict) -> dict:
+    return {
+        "host": settings["MYSQL_HOST"],
+        "user": settings["MYSQL_USER"],
+        "password": settings["MYSQL_PASSWORD"],
+        "database": settings["MYSQL_DATABASE"],
+        "port": settings["MYSQL_PORT"],
+    }
+
+
+def llm_params(settings: dict) -> dict:
+    return {
+        "n_ctx": settings["N_CTX"],
+        "n_batch": settings["N_BATCH"],
+        "n_threads": settings["N_THREADS"],
+        "n_gpu_layers": settings["N_GPU_LAYERS"],
+        "use_mmap": settings["USE_MMAP"],
+        "use_mlock": settings["USE_MLOCK"],
+        "kv_cache_type": settings["KV_CACHE_TYPE"],
+    }
+
+
+def start(settings: dict) -> StartupState:
+    """Load every resource in the background for the given settings; see start_background_initialization."""
+    global current
+    state = start_background_initialization(
+        knowledge_dir=settings["KNOWLEDGE_DIR"],
+        index_path=settings["INDEX_PATH"],
+        llm_model_path=settings["LLM_MODEL_PATH"],
+        embedding_model_name=settings["EMBEDDING_MODEL_NAME"],
+        chunk_size=settings["CHUNK_SIZE"],
+        chunk_overlap=settings["CHUNK_OVERLAP"],
+        mysql_config=mysql_config(settings),
+        llm_params=llm_params(settings),
+        with_llm=settings["LOAD_LLM"],
+        shard_by_folder=settings["SHARD_BY_FOLDER"],
+        storage_backend=settings["STORAGE_BACKEND"],
+        sqlite_path=settings["SQLITE_PATH"],
+    )
+    state.settings = dict(settings)
+    current = state
+    return state
+
+
+def changed_components(running: dict, settings: dict) -> List[str]:
+    """Components whose settings differ between the running configuration and the new one."""
+    return [
+        component
+        for component, keys in COMPONENT_SETTINGS.items()
+        if any(running.get(key) != settings.get(key) for key in keys)
+    ]
+
+
+def _knowledge_files(knowledge_dir: str) -> List[str]:
+    return [str(p) for p in Path(knowledge_dir).rglob("*") if p.is_file()]
+
+
+def _rechunk(knowledge_dir: str, index_path: str):
+    """
+    Re-split every file with the current text splitter, a batch of files at a time.
+    Chunks whose text is unchanged keep their embedding; the index stays searchable throughout.
+    """
+    files = _knowledge_files(knowledge_dir)
+    logging.info(f"Re-chunking {len(files)} files in the background...")
+    for start_at in range(0, len(files), RECHUNK_BATCH_FILES):
+        refresh_files_in_index(files[start_at:start_at + RECHUNK_BATCH_FILES], index_path, knowledge_dir=knowledge_dir)
+    logging.info("Re-chunking complete.")
+
+
+def _restart_watcher(state: StartupState, knowledge_dir: str, index_path: str):
+    if state.observer is not None:
+        state.observer.stop()
+    state.observer = start_file_watcher_background(
+        knowledge_dir, index_path, context=lambda: collection_manager.activate(DEFAULT_COLLECTION)
+    )
+
+
+def _reload_pipeline(state: StartupState, settings: dict, components: List[str]):
+    knowledge_dir, index_path = settings["KNOWLEDGE_DIR"], settings["INDEX_PATH"]
+    stages = ("index", "retrieval", "scan") if {"embedder", "index"} & set(components) else ("scan",)
+    for stage in stages:
+        state.mark_loading(stage)
+    try:
+        if "embedder" in components:
+            if not models.load_embedder(settings["EMBEDDING_MODEL_NAME"], settings["CHUNK_SIZE"], settings["CHUNK_OVERLAP"]):
+                raise RuntimeError(f"Could not load the embedding model {settings['EMBEDDING_MODEL_NAME']}.")
+            # Vectors from another embedding model cannot be searched; every collection is re-embedded.
+            collection_manager.discard_indexes()
+        elif "chunking" in components:
+            models.load_text_splitter(settings["CHUNK_SIZE"], settings["CHUNK_OVERLAP"])
+
+        if "embedder" in components or "index" in components:
+            Path(knowledge_dir).mkdir(parents=True, exist_ok=True)
+            # The default collection's globals are replaced while it is active, so a query on
+            # another collection cannot swap the old ones back in afterwards.
+            with collection_manager.activate(DEFAULT_COLLECTION):
+                models.knowledge_dir = os.path.abspath(knowledge_dir)
+                models.shard_by_folder = settings["SHARD_BY_FOLDER"]
+                collection_manager.set_default(knowledge_dir, index_path)
+                if "embedder" in components:
+                    force_reindex(index_path)
+                elif models.load_index(index_path):
+                    state.mark_ready("index")
+                    state.mark_ready("retrieval")
+            _restart_watcher(state, knowledge_dir, index_path)
+
+        if "chunking" in components and "embedder" not in components:
+            _rechunk(knowledge_dir, index_path)
+        else:
+            initial_scan_and_index(knowledge_dir, index_path)
+        state.mark_ready("scan")
+        _settle_index(state)
+    except Exception as e:
+        for stage in stages:
+            if not state.is_ready(stage):
+                state.mark_failed(stage, str(e))
+
+
+def _reload_llm(state: StartupState, settings: dict):
+    state.mark_loading("llm")
+    # The old model is released first; two multi-GB models rarely fit in memory together.
+    models.llm = None
+    answer_cache.clear()
+    _init_llm(state, settings["LLM_MODEL_PATH"], llm_params(settings), settings["LOAD_LLM"])
+
+
+def _reload(state: StartupState, settings: dict, components: List[str]):
+    with _reload_lock:
+        threads = []
+        if "llm" in components:
+            threads.append(threading.Thread(target=_reload_llm, args=(state, settings), daemon=True, name="reload-llm"))
+        if "database" in components:
+            state.mark_loading("database")
+            threads.append(threading.Thread(
+                target=_init_database,
+                args=(state, mysql_config(settings), settings["STORAGE_BACKEND"], settings["SQLITE_PATH"]),
+                daemon=True,
+                name="reload-db",
+            ))
+        for thread in threads:
+            thread.start()
+        if {"embedder", "index", "chunking"} & set(components):
+            _reload_pipeline(state, settings, components)
+        for thread in threads:
+            thread.join()
+
+
+def apply_settings(settings: dict) -> List[str]:
+    """
+    Reload only the components whose settings changed, in the background, while
+    everything else keeps running. Returns the components being reloaded.
+    """
+    state = current
+    if state is None:
+        return []
+    components = changed_components(state.settings, settings)
+    if not components:
+        return []
+    logging.info(f"Applying settings; reloading {', '.join(components)}")
+    state.settings = dict(settings)
+    threading.Thread(target=_reload, args=(state, settings, components), daemon=True, name="hot-reload").start()
+    return components
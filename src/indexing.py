@@ -1,9 +1,11 @@
 # src/indexing.py
 import os
+import hashlib
 import logging
 import shutil
+import time
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 import threading
 
 from langchain.docstore.document import Document
@@ -16,7 +18,8 @@ from langchain_community.document_loaders import (
     UnstructuredExcelLoader
 )
 
-from src import models
+from src import models, tracing
+from src.shards import ShardedFAISS, ROOT_SHARD
 
 # A re-entrant lock to prevent deadlocks when a locked function calls another locked function.
 db_lock = threading.RLock()
@@ -78,28 +81,56 @@ def force_reindex(index_path: str):
             logging.info(f"Removing existing index at {index_path}")
             shutil.rmtree(index_path)
         models.db = None # Clear the in-memory index
+        models.bm25.clear()
+        models.metadata_index.clear()
+        models.mark_index_changed()
 
-def save_index(index_path: str):
-    """Saves the current in-memory FAISS index to disk."""
+def save_index(index_path: str) -> Optional[List[str]]:
+    """Saves the current in-memory FAISS index to disk. For a sharded index, returns the shards written."""
     with db_lock:
-        if models.db:
+        if models.db is not None:
             logging.info(f"Saving FAISS index to {index_path}")
-            models.db.save_local(index_path)
-        else:
-            logging.warning("No index in memory to save.")
+            saved = models.db.save_local(index_path)
+            models.bm25.save(index_path)
+            return saved
+        logging.warning("No index in memory to save.")
+        return None
 
-def _load_documents_from_files(file_paths: List[str]) -> List[Document]:
-    """Loads and splits documents from a list of file paths."""
+def _assign_chunk_ids(split_docs: List[Document]):
+    """
+    Gives every chunk a deterministic ID derived from its file and content.
+    Unchanged chunks keep their ID across re-scans and re-indexing, so anything
+    keyed on chunk IDs stays valid exactly as long as the chunk text does.
+    """
+    seen = {}
+    for doc in split_docs:
+        key = (doc.metadata.get("file_path", ""), doc.page_content)
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        digest = hashlib.sha1(f"{key[0]}\0{occurrence}\0{key[1]}".encode("utf-8")).hexdigest()
+        doc.metadata["chunk_id"] = digest
+
+def _load_documents_from_files(file_paths: List[str], knowledge_dir: Optional[str] = None) -> List[Document]:
+    """
+    Loads and splits documents from a list of file paths. Chunk rel_paths are relative to
+    knowledge_dir (default: the active collection's folder).
+    """
     docs = []
+    ingested_at = time.time()
     for file_path in file_paths:
         ext = Path(file_path).suffix.lower()
         if ext in LOADER_MAPPING:
             try:
                 loader = LOADER_MAPPING[ext](file_path)
                 loaded_docs = loader.load()
+                mtime = os.path.getmtime(file_path)
                 # Add source metadata to each document
                 for doc in loaded_docs:
                     doc.metadata["source"] = os.path.basename(file_path)
+                    doc.metadata["file_path"] = os.path.abspath(file_path)
+                    doc.metadata = models.filter_metadata(doc.metadata, knowledge_dir)
+                    doc.metadata["mtime"] = mtime
+                    doc.metadata["ingested_at"] = ingested_at
                 docs.extend(loaded_docs)
             except Exception as e:
                 logging.error(f"Failed to load {file_path}: {e}")
@@ -109,52 +140,212 @@ def _load_documents_from_files(file_paths: List[str]) -> List[Document]:
     if not docs:
         return []
 
-    return models.text_splitter.split_documents(docs)
+    split_docs = models.text_splitter.split_documents(docs)
+    _assign_chunk_ids(split_docs)
+    return split_docs
 
-def update_vector_store(file_paths: List[str], index_path: str):
+def update_vector_store(file_paths: List[str], index_path: str, split_docs: Optional[List[Document]] = None,
+                        knowledge_dir: Optional[str] = None):
     """
     Updates the FAISS index with new documents from file_paths.
-    Creates a new index if one doesn't exist.
+    Creates a new index if one doesn't exist. Pass split_docs to skip re-loading the files.
+    knowledge_dir is the folder the files belong to, as for _load_documents_from_files.
     """
     if not models.embedder:
         logging.error("Embedder not initialized. Cannot update vector store.")
         return
 
-    split_docs = _load_documents_from_files(file_paths)
+    if split_docs is None:
+        with tracing.span("index.load", files=len(file_paths)):
+            split_docs = _load_documents_from_files(file_paths, knowledge_dir)
     if not split_docs:
         logging.info("No new documents to add to the index.")
         return
 
-    logging.info(f"Embedding and indexing {len(split_docs)} new document chunks...")
-    with db_lock:
-        if models.db is None:
-            # Create a new index from scratch
-            models.db = models.FAISS.from_documents(split_docs, models.embedder)
-            logging.info("Created a new FAISS index.")
-        else:
-            # Add new documents to the existing index
-            models.db.add_documents(split_docs)
-            logging.info("Updated existing FAISS index.")
+    with tracing.locked(db_lock, "db_lock"):
+        if models.db is not None:
+            # Chunks that are already indexed (e.g. on a re-scan at startup) are skipped.
+            existing_ids = set(models.db.index_to_docstore_id.values())
+            split_docs = [d for d in split_docs if d.metadata["chunk_id"] not in existing_ids]
+            if not split_docs:
+                logging.info("All document chunks are already indexed.")
+                return
+
+        logging.info(f"Embedding and indexing {len(split_docs)} new document chunks...")
+        chunk_ids = [d.metadata["chunk_id"] for d in split_docs]
+        with tracing.span("index.embed", chunks=len(split_docs)):
+            if models.db is None and models.shard_by_folder:
+                models.db = models.new_sharded_index()
+                models.db.add_documents(split_docs, ids=chunk_ids)
+                logging.info("Created a new sharded FAISS index.")
+            elif models.db is None:
+                # Create a new index from scratch
+                models.db = models.FAISS.from_documents(split_docs, models.embedder, ids=chunk_ids)
+                logging.info("Created a new FAISS index.")
+            else:
+                # Add new documents to the existing index
+                models.db.add_documents(split_docs, ids=chunk_ids)
+                logging.info("Updated existing FAISS index.")
+        for doc in split_docs:
+            models.bm25.add(doc.metadata["chunk_id"], doc.page_content)
+            models.metadata_index.add(doc.metadata["chunk_id"], doc.metadata)
         
         # Save the potentially updated index to disk
-        save_index(index_path)
+        with tracing.span("index.save"):
+            saved_shards = save_index(index_path)
+
+        if isinstance(models.db, ShardedFAISS):
+            # Only the shards that changed are re-read; the others stay as they are.
+            try:
+                with tracing.span("index.reload", shards=len(saved_shards or [])):
+                    models.db.reload_shards(index_path, saved_shards)
+            except Exception as e:
+                logging.error(f"FATAL: Failed to reload index shards {saved_shards} after update: {e}")
+                models.db = None
+            models.mark_index_changed()
+            return
 
         # Crucial step: Reload the index from disk to ensure consistency
         try:
             logging.info("Reloading FAISS index from disk to ensure consistency.")
-            models.db = models.FAISS.load_local(
-                index_path, 
-                models.embedder, 
-                allow_dangerous_deserialization=True
-            )
+            with tracing.span("index.reload"):
+                models.db = models.FAISS.load_local(
+                    index_path, 
+                    models.embedder, 
+                    allow_dangerous_deserialization=True
+                )
         except Exception as e:
             logging.error(f"FATAL: Failed to reload index from disk after update: {e}")
             # If reloading fails, the in-memory index might be out of sync.
             # Clearing it to prevent incorrect answers.
             models.db = None
+        models.mark_index_changed()
+
+def _chunk_ids_for_paths(paths: List[str]) -> List[str]:
+    """IDs of indexed chunks that came from the given files or from files under the given directories."""
+    targets = [os.path.abspath(p) for p in paths]
+    ids = []
+    for chunk_id, doc in models.iter_indexed_chunks():
+        file_path = doc.metadata.get("file_path") or ""
+        if any(file_path == t or file_path.startswith(t + os.sep) for t in targets):
+            ids.append(chunk_id)
+    return ids
+
+def _delete_chunks(chunk_ids: List[str]):
+    """Remove chunks from the FAISS and BM25 indexes. Caller must hold db_lock."""
+    if not chunk_ids or models.db is None:
+        return
+    from src.retrieval import answer_cache  # retrieval imports this module
+    models.db.delete(chunk_ids)
+    for chunk_id in chunk_ids:
+        models.bm25.remove(chunk_id)
+        models.metadata_index.remove(chunk_id)
+    answer_cache.invalidate_chunks(chunk_ids)
+    models.mark_index_changed()
+    logging.info(f"Removed {len(chunk_ids)} chunks from the index.")
+
+def remove_files_from_index(paths: List[str], index_path: str):
+    """Removes every chunk of the given files (or directories) from the index and persists it."""
+    with tracing.locked(db_lock, "db_lock"):
+        chunk_ids = _chunk_ids_for_paths(paths)
+        if not chunk_ids:
+            logging.info(f"No indexed chunks found for {paths}.")
+            return
+        _delete_chunks(chunk_ids)
+        save_index(index_path)
+
+def refresh_files_in_index(file_paths: List[str], index_path: str, knowledge_dir: Optional[str] = None):
+    """
+    Re-indexes modified files chunk by chunk: chunks whose text is unchanged are kept,
+    chunks that no longer exist are removed and only new chunks are embedded.
+    knowledge_dir is as for update_vector_store.
+    """
+    if not models.embedder:
+        logging.error("Embedder not initialized. Cannot update vector store.")
+        return
+
+    with tracing.span("index.load", files=len(file_paths)):
+        split_docs = _load_documents_from_files(file_paths, knowledge_dir)
+    current = {d.metadata["chunk_id"]: d for d in split_docs}
+    with tracing.locked(db_lock, "db_lock"):
+        indexed_ids = _chunk_ids_for_paths(file_paths)
+        stale_ids = [cid for cid in indexed_ids if cid not in current]
+        _delete_chunks(stale_ids)
+        # Unchanged chunks stay in the index but take on the file's new modification time.
+        retimed_ids = []
+        for chunk_id in indexed_ids:
+            if chunk_id in current:
+                doc = models.db.docstore.search(chunk_id)
+                if isinstance(doc, Document) and doc.metadata.get("mtime") != current[chunk_id].metadata["mtime"]:
+                    doc.metadata["mtime"] = current[chunk_id].metadata["mtime"]
+                    retimed_ids.append(chunk_id)
+                models.metadata_index.add(chunk_id, current[chunk_id].metadata)
+        if retimed_ids and isinstance(models.db, ShardedFAISS):
+            models.db.mark_changed(retimed_ids)
+        known = set(indexed_ids)
+        new_docs = [d for d in split_docs if d.metadata["chunk_id"] not in known]
+        # Adding new chunks saves the index anyway; otherwise removals and new mtimes are saved here.
+        if (stale_ids or retimed_ids) and not new_docs:
+            save_index(index_path)
+    if new_docs:
+        update_vector_store(file_paths, index_path, split_docs=new_docs, knowledge_dir=knowledge_dir)
+
+def add_files_to_detached_index(db, bm25, metadata_index, file_paths: List[str], index_path: str,
+                                knowledge_dir: str):
+    """
+    Add the new chunks of file_paths to an index that is not installed in the models
+    globals (a collection being loaded) and save it. Neither db_lock nor the globals are
+    touched, so queries go on while the files are embedded. Returns the index, which is
+    created if db is None.
+    """
+    split_docs = _load_documents_from_files(file_paths, knowledge_dir)
+    existing_ids = set(db.index_to_docstore_id.values()) if db is not None else set()
+    split_docs = [d for d in split_docs if d.metadata["chunk_id"] not in existing_ids]
+    if not split_docs:
+        return db
+
+    logging.info(f"Embedding and indexing {len(split_docs)} new document chunks...")
+    chunk_ids = [d.metadata["chunk_id"] for d in split_docs]
+    with tracing.span("index.embed", chunks=len(split_docs)):
+        if db is None and models.shard_by_folder:
+            db = models.new_sharded_index()
+            db.add_documents(split_docs, ids=chunk_ids)
+        elif db is None:
+            db = models.FAISS.from_documents(split_docs, models.embedder, ids=chunk_ids)
+        else:
+            db.add_documents(split_docs, ids=chunk_ids)
+    for doc in split_docs:
+        bm25.add(doc.metadata["chunk_id"], doc.page_content)
+        metadata_index.add(doc.metadata["chunk_id"], doc.metadata)
+    with tracing.span("index.save"):
+        db.save_local(index_path)
+        bm25.save(index_path)
+    return db
+
+def rebuild_shard(name: str, knowledge_dir: str, index_path: str):
+    """
+    Re-chunks and re-embeds one top-level knowledge folder (or the root files for
+    shards.ROOT_SHARD) from scratch, leaving every other shard untouched.
+    """
+    if not isinstance(models.db, ShardedFAISS):
+        logging.error("The index is not sharded; use force_reindex instead.")
+        return
+    root = Path(knowledge_dir)
+    if name == ROOT_SHARD:
+        files = [str(p) for p in root.iterdir() if p.is_file()]
+    else:
+        files = [str(p) for p in (root / name).rglob("*") if p.is_file()]
+    with db_lock:
+        _delete_chunks([chunk_id for chunk_id, _ in models.db.iter_chunks([name])])
+        save_index(index_path)
+    logging.info(f"Rebuilding index shard '{name}' from {len(files)} files...")
+    if files:
+        update_vector_store(files, index_path, knowledge_dir=knowledge_dir)
 
 def initial_scan_and_index(knowledge_dir: str, index_path: str):
     """Scans the knowledge directory and indexes all supported files."""
+    if models.knowledge_dir is None:
+        models.knowledge_dir = os.path.abspath(knowledge_dir)
     if not os.path.exists(knowledge_dir):
         logging.info(f"Knowledge directory '{knowledge_dir}' not found. Creating it.")
         os.makedirs(knowledge_dir)
@@ -166,5 +357,5 @@ def initial_scan_and_index(knowledge_dir: str, index_path: str):
         return
 
     logging.info(f"Starting initial scan of {len(all_files)} files in '{knowledge_dir}'...")
-    update_vector_store(all_files, index_path)
+    update_vector_store(all_files, index_path, knowledge_dir=knowledge_dir)
     logging.info("Initial scan and indexing complete.")
@@ -0,0 +1,140 @@
+# src/knowledge_catalog.py
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Characters shown in a file preview.
+PREVIEW_CHARS = 1000
+
+
+class KnowledgeCatalog:
+    """
+    Cached listing of the files in a knowledge folder: relative path, size and
+    modification time. The folder is walked once; afterwards the file watcher keeps
+    the listing current file by file, so listing never touches the disk.
+    """
+
+    def __init__(self, knowledge_dir: str):
+        self.root = os.path.abspath(knowledge_dir)
+        self._files: Optional[Dict[str, dict]] = None
+        self._sorted: Optional[List[dict]] = None
+        self._lock = threading.Lock()
+
+    def _rel_path(self, path: str) -> Optional[str]:
+        path = os.path.abspath(path)
+        if not path.startswith(self.root + os.sep):
+            return None
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def _scan(self) -> Dict[str, dict]:
+        files = {}
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        rel_path = self._rel_path(entry.path)
+                        files[rel_path] = {"rel_path": rel_path, "size": stat.st_size, "mtime": stat.st_mtime}
+                except OSError:
+                    continue  # vanished while walking
+        return files
+
+    def invalidate(self):
+        """Forget the listing; the next read walks the folder again."""
+        with self._lock:
+            self._files = None
+            self._sorted = None
+
+    def file_changed(self, path: str):
+        """A file was created or modified (a directory: its files are re-read on the next listing)."""
+        rel_path = self._rel_path(path)
+        if rel_path is None:
+            return
+        if os.path.isdir(path):
+            self.invalidate()
+            return
+        with self._lock:
+            if self._files is None:
+                return
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._files.pop(rel_path, None)
+            else:
+                self._files[rel_path] = {"rel_path": rel_path, "size": stat.st_size, "mtime": stat.st_mtime}
+            self._sorted = None
+
+    def file_removed(self, path: str):
+        """A file or directory was deleted or moved away."""
+        rel_path = self._rel_path(path)
+        if rel_path is None:
+            return
+        with self._lock:
+            if self._files is None:
+                return
+            prefix = rel_path + "/"
+            for key in [k for k in self._files if k == rel_path or k.startswith(prefix)]:
+                del self._files[key]
+            self._sorted = None
+
+    def files(self) -> List[dict]:
+        """Every file, most recently modified first."""
+        with self._lock:
+            if self._files is None:
+                self._files = self._scan()
+            if self._sorted is None:
+                self._sorted = sorted(self._files.values(), key=lambda f: f["mtime"], reverse=True)
+            return self._sorted
+
+    def page(self, offset: int = 0, limit: int = 25, search: Optional[str] = None,
+             extensions: Optional[List[str]] = None) -> Tuple[List[dict], int]:
+        """
+        One page of files, most recently modified first, and the number of matching files.
+        Search matches case-insensitively anywhere in the relative path.
+        """
+        files = self.files()
+        if search:
+            needle = search.lower()
+            files = [f for f in files if needle in f["rel_path"].lower()]
+        if extensions:
+            wanted = {e.lower() for e in extensions}
+            files = [f for f in files if Path(f["rel_path"]).suffix.lower() in wanted]
+        return files[offset:offset + limit], len(files)
+
+    def extensions(self) -> List[str]:
+        return sorted({Path(f["rel_path"]).suffix.lower() for f in self.files()} - {""})
+
+    def path_of(self, rel_path: str) -> str:
+        return os.path.join(self.root, *rel_path.split("/"))
+
+
+_catalogs: Dict[str, KnowledgeCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def catalog_for(knowledge_dir: str) -> KnowledgeCatalog:
+    """The shared catalog of a knowledge folder."""
+    root = os.path.abspath(knowledge_dir)
+    with _catalogs_lock:
+        catalog = _catalogs.get(root)
+        if catalog is None:
+            catalog = _catalogs[root] = KnowledgeCatalog(root)
+        return catalog
+
+
+def read_preview(path: str, chars: int = PREVIEW_CHARS) -> Optional[str]:
+    """The start of a text file, with "..." if there is more; None for files that are not UTF-8 text."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read(chars + 1)
+    except (UnicodeDecodeError, OSError):
+        return None
+    return text[:chars] + ("..." if len(text) > chars else "")
@@ -0,0 +1,320 @@
+# src/knowledge_collections.py
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src import models, tracing
+from src.indexing import db_lock, add_files_to_detached_index
+from src.file_watcher import start_file_watcher_background
+from src.metadata_index import MetadataIndex
+from src.shards import ShardedFAISS
+
+# Named collections besides the default one: {name: {"knowledge_dir": ..., "index_path": ...}}.
+COLLECTIONS_PATH = "collections.json"
+
+# The collection configured as KNOWLEDGE_DIR / INDEX_PATH. It is always resident.
+DEFAULT_COLLECTION = "default"
+
+# Module globals in src.models that make up one collection's in-memory index.
+_STATE_ATTRS = ("collection", "db", "bm25", "metadata_index", "knowledge_dir", "index_generation")
+
+
+def load_collections() -> Dict[str, dict]:
+    path = Path(COLLECTIONS_PATH)
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable collections file {COLLECTIONS_PATH}: {e}")
+        return {}
+
+
+def save_collections(collections: Dict[str, dict]):
+    Path(COLLECTIONS_PATH).write_text(json.dumps(collections, indent=4), encoding="utf-8")
+
+
+def _capture() -> dict:
+    return {attr: getattr(models, attr) for attr in _STATE_ATTRS}
+
+
+def _apply(state: dict):
+    for attr, value in state.items():
+        setattr(models, attr, value)
+
+
+def _estimate_bytes() -> int:
+    """Rough resident size of the active collection: vectors plus chunk text held by the docstore and BM25."""
+    db = models.db
+    if db is None:
+        return 0
+    if isinstance(db, ShardedFAISS):
+        vector_bytes = sum(s.index.ntotal * s.index.d * 4 for s in db.shards.values())
+    else:
+        vector_bytes = db.index.ntotal * db.index.d * 4
+    text_bytes = sum(len(doc.page_content) for _, doc in models.iter_indexed_chunks())
+    return vector_bytes + 3 * text_bytes
+
+
+class _Collection:
+    def __init__(self, name: str, knowledge_dir: str, index_path: str):
+        self.name = name
+        self.knowledge_dir = knowledge_dir
+        self.index_path = index_path
+        self.state: Optional[dict] = None  # captured models globals while swapped out
+        self.observer = None
+        self.last_used = 0.0
+        self.memory_bytes = 0
+        self.measured_generation = -1
+        # Held while the collection is being loaded, so concurrent first queries load it once.
+        self.load_lock = threading.Lock()
+
+
+class CollectionManager:
+    """
+    Keeps several named knowledge collections, each with its own index, next to one
+    shared embedder and LLM. A collection is loaded (and its folder scanned and
+    watched) the first time it is activated; when the loaded collections exceed
+    the memory budget, the least recently used ones are dropped from memory.
+    """
+
+    def __init__(self, memory_budget_mb: float = 2048):
+        self.memory_budget_mb = memory_budget_mb
+        self._collections: Dict[str, _Collection] = {}
+        self._active = DEFAULT_COLLECTION
+        # The default collection's globals while another collection is swapped in.
+        self._default_state: Optional[dict] = None
+        # Held only while the models globals are swapped, so state() can read them without db_lock.
+        self._swap_lock = threading.Lock()
+
+    def configure(self, memory_budget_mb: float):
+        self.memory_budget_mb = max(0.0, float(memory_budget_mb))
+
+    def set_default(self, knowledge_dir: str, index_path: str):
+        """Register the configured knowledge folder, whose index lives in the models globals."""
+        self._collections[DEFAULT_COLLECTION] = _Collection(DEFAULT_COLLECTION, knowledge_dir, index_path)
+        for name, config in load_collections().items():
+            if name != DEFAULT_COLLECTION and name not in self._collections:
+                self._collections[name] = _Collection(name, config["knowledge_dir"], config["index_path"])
+
+    def names(self) -> List[str]:
+        names = set(self._collections) | set(load_collections())
+        return [DEFAULT_COLLECTION] + sorted(names - {DEFAULT_COLLECTION})
+
+    def add(self, name: str, knowledge_dir: str, index_path: str):
+        if name == DEFAULT_COLLECTION:
+            raise ValueError(f"'{DEFAULT_COLLECTION}' is the configured knowledge folder and cannot be redefined.")
+        collections = load_collections()
+        collections[name] = {"knowledge_dir": knowledge_dir, "index_path": index_path}
+        save_collections(collections)
+        with db_lock:
+            self._collections.setdefault(name, _Collection(name, knowledge_dir, index_path))
+
+    def remove(self, name: str):
+        """Forget a collection. Its folder and index on disk are left alone."""
+        collections = load_collections()
+        collections.pop(name, None)
+        save_collections(collections)
+        with db_lock:
+            collection = self._collections.pop(name, None)
+            if collection is not None:
+                self._evict(collection)
+
+    def _get(self, name: str) -> _Collection:
+        collection = self._collections.get(name)
+        if collection is None:
+            config = load_collections().get(name)
+            if config is None:
+                raise KeyError(f"Unknown knowledge collection '{name}'")
+            collection = _Collection(name, config["knowledge_dir"], config["index_path"])
+            self._collections[name] = collection
+        return collection
+
+    def _load(self, collection: _Collection) -> dict:
+        """
+        Read a collection's index and index the files added since it was saved. Works on
+        its own objects rather than the models globals, so it needs no db_lock and queries
+        on other collections go on meanwhile. Returns the state to swap in.
+        """
+        started = time.perf_counter()
+        knowledge_dir = os.path.abspath(collection.knowledge_dir)
+        Path(knowledge_dir).mkdir(parents=True, exist_ok=True)
+        db, bm25, metadata_index = models.read_index(collection.index_path, knowledge_dir)
+        files = [str(p) for p in Path(knowledge_dir).rglob("*") if p.is_file()]
+        db = add_files_to_detached_index(db, bm25, metadata_index, files, collection.index_path, knowledge_dir)
+        logging.info(f"Loaded collection '{collection.name}' in {time.perf_counter() - started:.1f}s")
+        return {
+            "collection": collection.name,
+            "db": db,
+            "bm25": bm25,
+            "metadata_index": metadata_index,
+            "knowledge_dir": knowledge_dir,
+            "index_generation": models.new_generation(),
+        }
+
+    def _watch(self, collection: _Collection):
+        if collection.observer is None:
+            collection.observer = start_file_watcher_background(
+                collection.knowledge_dir, collection.index_path, context=lambda: self.activate(collection.name)
+            )
+
+    def _ensure_loaded(self, name: str):
+        """Load a collection that is not in memory, without holding db_lock while it is read and embedded."""
+        with db_lock:
+            collection = self._get(name)
+        with collection.load_lock:
+            if collection.state is not None or name == self._active:
+                return
+            state = self._load(collection)
+            with db_lock:
+                collection.state = state
+                collection.last_used = time.time()
+            self._watch(collection)
+
+    def discard_indexes(self):
+        """
+        Drop every collection except the default from memory and delete its index on disk,
+        e.g. because the embedding model changed and the old vectors cannot be searched.
+        Each collection is re-embedded from its folder the next time it is used.
+        """
+        with db_lock:
+            for name in load_collections():
+                if name != DEFAULT_COLLECTION:
+                    self._get(name)
+            collections = [c for c in self._collections.values() if c.name != DEFAULT_COLLECTION]
+        for collection in collections:
+            # A load in progress finishes first, so it cannot swap in vectors from the old model afterwards.
+            with collection.load_lock, db_lock:
+                self._evict(collection)
+                collection.memory_bytes = 0
+                shutil.rmtree(collection.index_path, ignore_errors=True)
+                logging.info(f"Discarded the index of collection '{collection.name}'; it is rebuilt when next used.")
+
+    @staticmethod
+    def _measure(collection: _Collection):
+        """Re-estimate the active collection's size if its index changed since the last estimate."""
+        if collection.measured_generation != models.index_generation:
+            collection.memory_bytes = _estimate_bytes()
+            collection.measured_generation = models.index_generation
+
+    def _evict(self, collection: _Collection):
+        if collection.observer is not None:
+            collection.observer.stop()
+            collection.observer = None
+        if collection.state is not None:
+            logging.info(f"Evicting collection '{collection.name}' ({collection.memory_bytes / 1e6:.0f} MB) from memory.")
+        collection.state = None
+
+    def _enforce_budget(self):
+        """Drop least recently used collections until the loaded ones fit the budget. Caller holds db_lock."""
+        budget = self.memory_budget_mb * 1e6
+        loaded = [c for c in self._collections.values() if c.name == DEFAULT_COLLECTION or c.state is not None]
+        total = sum(c.memory_bytes for c in loaded)
+        for collection in sorted(loaded, key=lambda c: c.last_used):
+            if total <= budget:
+                break
+            if collection.name in (DEFAULT_COLLECTION, self._active):
+                continue
+            self._evict(collection)
+            total -= collection.memory_bytes
+
+    @contextmanager
+    def activate(self, name: Optional[str] = None):
+        """
+        Make a collection's index the one in the models globals for the duration of the
+        block, loading it first (without db_lock) if needed. Holds db_lock throughout the
+        block, so only code that also takes db_lock is guaranteed to see the default
+        collection in the globals; code that reads without the lock uses state() instead.
+        """
+        name = name or DEFAULT_COLLECTION
+        if name == DEFAULT_COLLECTION and len(self._collections) <= 1:
+            # Nothing can be swapped in, so the default collection needs no locking.
+            yield
+            return
+
+        if name != DEFAULT_COLLECTION:
+            self._ensure_loaded(name)
+
+        with tracing.locked(db_lock, "db_lock"):
+            if name == self._active:
+                collection = self._collections.get(name)
+                if collection is not None:
+                    collection.last_used = time.time()
+                    self._measure(collection)
+                yield
+                return
+
+            previous_name = self._active
+            collection = self._get(name)
+            if name == DEFAULT_COLLECTION:
+                state = self._default_state
+            else:
+                if collection.state is None:
+                    # Evicted again before this thread got the lock; reloaded under it as a last resort.
+                    collection.state = self._load(collection)
+                    self._watch(collection)
+                state = collection.state
+            with self._swap_lock:
+                previous_state = _capture()
+                if previous_name == DEFAULT_COLLECTION:
+                    self._default_state = previous_state
+                _apply(state)
+                self._active = name
+            try:
+                collection.last_used = time.time()
+                yield
+            finally:
+                self._measure(collection)
+                with self._swap_lock:
+                    if name == DEFAULT_COLLECTION:
+                        self._default_state = _capture()
+                    else:
+                        collection.state = _capture()
+                    _apply(previous_state)
+                    self._active = previous_name
+                    if previous_name == DEFAULT_COLLECTION:
+                        self._default_state = None
+                self._enforce_budget()
+
+    def state(self, name: Optional[str] = None) -> Optional[dict]:
+        """
+        A collection's in-memory index ({"db": ..., "bm25": ..., "metadata_index": ...}) without
+        taking db_lock, for readers such as the UI and the metrics sampler that must not wait
+        behind queries. None while the collection is not loaded.
+        """
+        name = name or DEFAULT_COLLECTION
+        with self._swap_lock:
+            if name == self._active:
+                return _capture()
+            if name == DEFAULT_COLLECTION:
+                return self._default_state
+            collection = self._collections.get(name)
+            return None if collection is None else collection.state
+
+    def metadata_index(self, name: Optional[str] = None) -> MetadataIndex:
+        """Metadata index of a collection for building filter choices; empty while it is not loaded."""
+        state = self.state(name)
+        return MetadataIndex() if state is None else state["metadata_index"]
+
+    def stats(self) -> List[dict]:
+        collections = list(self._collections.values())
+        return [
+            {
+                "name": c.name,
+                "loaded": c.name == DEFAULT_COLLECTION or c.state is not None,
+                "memory_mb": c.memory_bytes / 1e6,
+                "last_used": c.last_used,
+                "knowledge_dir": c.knowledge_dir,
+            }
+            for c in collections
+        ]
+
+
+# Shared instance used by the UI and the answer path.
+manager = CollectionManager()
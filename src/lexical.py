@@ -0,0 +1,146 @@
+# src/lexical.py
+import json
+import math
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+# File name used inside the FAISS index directory.
+BM25_FILENAME = "bm25.json"
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+")
+_CAMEL_RE = re.compile(r"[A-Z0-9]+(?=[A-Z][a-z])|[A-Z]?[a-z0-9]+|[A-Z0-9]+")
+# snake_case, camelCase, letters mixed with digits (E1234, utf8) or all caps (ENOENT).
+_IDENTIFIER_RE = re.compile(r"_|[a-z][A-Z]|[A-Za-z]\d|\d[A-Za-z]|^[A-Z]{2,}$")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Identifiers are kept whole and also split into their
+    snake_case / camelCase parts, so `getUserName`, `get_user_name` and `user name`
+    all match each other while exact identifiers and error codes still score highest.
+    """
+    tokens = []
+    for word in _TOKEN_RE.findall(text):
+        lowered = word.lower()
+        tokens.append(lowered)
+        parts = [p.lower() for piece in word.split("_") for p in _CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def identifier_terms(text: str) -> List[str]:
+    """Lowercased words of text that look like identifiers or codes rather than natural language."""
+    return [word.lower() for word in _TOKEN_RE.findall(text) if _IDENTIFIER_RE.search(word)]
+
+
+class BM25Index:
+    """An incrementally maintained Okapi BM25 inverted index over chunk IDs."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._doc_len
+
+    def document_frequency(self, term: str, allowed: Optional[Collection[str]] = None) -> int:
+        """Number of chunks containing the (tokenized) term; with allowed, only those chunks are counted."""
+        posting = self._postings.get(term, ())
+        if allowed is None:
+            return len(posting)
+        return sum(1 for chunk_id in posting if chunk_id in allowed)
+
+    def add(self, chunk_id: str, text: str):
+        if chunk_id in self._doc_len:
+            self.remove(chunk_id)
+        self._add_terms(chunk_id, dict(Counter(tokenize(text))))
+
+    def _add_terms(self, chunk_id: str, terms: Dict[str, int]):
+        self._doc_terms[chunk_id] = terms
+        length = sum(terms.values())
+        self._doc_len[chunk_id] = length
+        self._total_len += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[chunk_id] = tf
+
+    def remove(self, chunk_id: str):
+        terms = self._doc_terms.pop(chunk_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(chunk_id)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def clear(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_len.clear()
+        self._total_len = 0
+
+    def search(self, query: str, k: int = 10, allowed: Optional[Collection[str]] = None) -> List[Tuple[str, float]]:
+        """Return up to k (chunk_id, score) pairs, best first. With allowed, only those chunks are scored."""
+        n_docs = len(self._doc_len)
+        if not n_docs:
+            return []
+        avg_len = self._total_len / n_docs
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in posting.items():
+                if allowed is not None and chunk_id not in allowed:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, index_path: str):
+        path = Path(index_path) / BM25_FILENAME
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"k1": self.k1, "b": self.b, "docs": self._doc_terms}), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, index_path: str) -> "BM25Index":
+        """Load a persisted index; raises FileNotFoundError if there is none."""
+        data = json.loads((Path(index_path) / BM25_FILENAME).read_text(encoding="utf-8"))
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        for chunk_id, terms in data["docs"].items():
+            index._add_terms(chunk_id, terms)
+        logging.info(f"Loaded BM25 index with {len(index)} chunks.")
+        return index
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Tuple[str, str]]) -> "BM25Index":
+        index = cls()
+        for chunk_id, text in chunks:
+            index.add(chunk_id, text)
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several ranked ID lists; IDs ranked high by any list float to the top."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,135 @@
+# src/metadata_index.py
+import bisect
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Filter keys understood by MetadataIndex.resolve:
+#   folder         - relative folder under the knowledge directory (includes subfolders)
+#   extensions     - list of file extensions such as [".py", ".md"]
+#   modified_from  - earliest file modification time (epoch seconds)
+#   modified_to    - latest file modification time (epoch seconds)
+#   ingested_from  - earliest ingest time (epoch seconds)
+#   ingested_to    - latest ingest time (epoch seconds)
+FILTER_KEYS = ("folder", "extensions", "modified_from", "modified_to", "ingested_from", "ingested_to")
+
+
+class MetadataIndex:
+    """Per-attribute chunk ID sets used to pre-filter searches."""
+
+    def __init__(self):
+        self._by_folder: Dict[str, Set[str]] = {}
+        self._by_extension: Dict[str, Set[str]] = {}
+        self._by_mtime: List[Tuple[float, str]] = []
+        self._by_ingest: List[Tuple[float, str]] = []
+        self._by_file: Dict[str, Set[str]] = {}
+        self._meta: Dict[str, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    @staticmethod
+    def _folders(rel_path: str) -> List[str]:
+        """Every ancestor folder of a relative path, '' being the knowledge root."""
+        parts = rel_path.replace(os.sep, "/").split("/")[:-1]
+        return [""] + ["/".join(parts[: i + 1]) for i in range(len(parts))]
+
+    def add(self, chunk_id: str, metadata: dict):
+        if "rel_path" not in metadata:
+            return
+        if chunk_id in self._meta:
+            self.remove(chunk_id)
+        meta = {
+            "rel_path": metadata["rel_path"],
+            "extension": metadata.get("extension", ""),
+            "mtime": float(metadata.get("mtime", 0.0)),
+            "ingested_at": float(metadata.get("ingested_at", 0.0)),
+        }
+        self._meta[chunk_id] = meta
+        for folder in self._folders(meta["rel_path"]):
+            self._by_folder.setdefault(folder, set()).add(chunk_id)
+        self._by_extension.setdefault(meta["extension"], set()).add(chunk_id)
+        self._by_file.setdefault(meta["rel_path"], set()).add(chunk_id)
+        bisect.insort(self._by_mtime, (meta["mtime"], chunk_id))
+        bisect.insort(self._by_ingest, (meta["ingested_at"], chunk_id))
+
+    def remove(self, chunk_id: str):
+        meta = self._meta.pop(chunk_id, None)
+        if meta is None:
+            return
+        for folder in self._folders(meta["rel_path"]):
+            ids = self._by_folder.get(folder)
+            if ids is not None:
+                ids.discard(chunk_id)
+                if not ids:
+                    del self._by_folder[folder]
+        ids = self._by_extension.get(meta["extension"])
+        if ids is not None:
+            ids.discard(chunk_id)
+            if not ids:
+                del self._by_extension[meta["extension"]]
+        ids = self._by_file.get(meta["rel_path"])
+        if ids is not None:
+            ids.discard(chunk_id)
+            if not ids:
+                del self._by_file[meta["rel_path"]]
+        for sorted_list, key in ((self._by_mtime, meta["mtime"]), (self._by_ingest, meta["ingested_at"])):
+            i = bisect.bisect_left(sorted_list, (key, chunk_id))
+            if i < len(sorted_list) and sorted_list[i] == (key, chunk_id):
+                del sorted_list[i]
+
+    def clear(self):
+        self._by_folder.clear()
+        self._by_extension.clear()
+        self._by_mtime.clear()
+        self._by_ingest.clear()
+        self._by_file.clear()
+        self._meta.clear()
+
+    @staticmethod
+    def _range(sorted_list: List[Tuple[float, str]], low: Optional[float], high: Optional[float]) -> Set[str]:
+        start = bisect.bisect_left(sorted_list, (low, "")) if low is not None else 0
+        end = bisect.bisect_right(sorted_list, (high, "\uffff")) if high is not None else len(sorted_list)
+        return {chunk_id for _, chunk_id in sorted_list[start:end]}
+
+    def resolve(self, filters: Optional[dict]) -> Optional[Set[str]]:
+        """Chunk IDs matching every given filter, or None when no filter is active."""
+        if not filters or not any(filters.get(key) not in (None, "", []) for key in FILTER_KEYS):
+            return None
+        candidates: List[Set[str]] = []
+        folder = (filters.get("folder") or "").strip("/")
+        if folder:
+            candidates.append(self._by_folder.get(folder, set()))
+        if filters.get("extensions"):
+            candidates.append(set().union(*(self._by_extension.get(ext.lower(), set()) for ext in filters["extensions"])))
+        if filters.get("modified_from") is not None or filters.get("modified_to") is not None:
+            candidates.append(self._range(self._by_mtime, filters.get("modified_from"), filters.get("modified_to")))
+        if filters.get("ingested_from") is not None or filters.get("ingested_to") is not None:
+            candidates.append(self._range(self._by_ingest, filters.get("ingested_from"), filters.get("ingested_to")))
+        # Intersect starting from the smallest set.
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for ids in candidates[1:]:
+            result &= ids
+        return result
+
+    def folders(self) -> List[str]:
+        return sorted(f for f in self._by_folder if f)
+
+    def extensions(self) -> List[str]:
+        return sorted(e for e in self._by_extension if e)
+
+    def file_status(self, rel_path: str) -> Tuple[int, Optional[float]]:
+        """Number of indexed chunks of a file and when it was last indexed (None if it is not)."""
+        # Copied first: the page reads this without db_lock while the watcher may be indexing.
+        metas = [self._meta.get(chunk_id) for chunk_id in tuple(self._by_file.get(rel_path, ()))]
+        ingested = [meta["ingested_at"] for meta in metas if meta is not None]
+        if not ingested:
+            return 0, None
+        return len(ingested), max(ingested)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Tuple[str, dict]]) -> "MetadataIndex":
+        index = cls()
+        for chunk_id, metadata in chunks:
+            index.add(chunk_id, metadata)
+        return index
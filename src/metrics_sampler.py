@@ -0,0 +1,109 @@
+# src/metrics_sampler.py
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import List, Optional
+
+import psutil
+
+from src.knowledge_collections import manager as collection_manager, DEFAULT_COLLECTION
+from src.shards import ShardedFAISS
+
+# Seconds between samples, and samples kept (15 minutes at the default interval).
+SAMPLE_INTERVAL_S = 2.0
+HISTORY_SAMPLES = 450
+
+
+def _index_size() -> tuple:
+    """Vectors in the default collection's index and their size in MB."""
+    db = (collection_manager.state(DEFAULT_COLLECTION) or {}).get("db")
+    if db is None:
+        return 0, 0.0
+    indexes = [s.index for s in db.shards.values()] if isinstance(db, ShardedFAISS) else [db.index]
+    return sum(i.ntotal for i in indexes), sum(i.ntotal * i.d * 4 for i in indexes) / 1e6
+
+
+class MetricsSampler:
+    """
+    One background thread that samples process and system metrics at a fixed interval
+    into a ring buffer. Every viewer of the System Performance page reads the same
+    history, so open tabs cost nothing beyond drawing it.
+    """
+
+    def __init__(self, interval_s: float = SAMPLE_INTERVAL_S, history: int = HISTORY_SAMPLES):
+        self.interval_s = interval_s
+        self._samples: deque = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._process = psutil.Process(os.getpid())
+        self._last_disk = None
+
+    def start(self):
+        """Start sampling; later calls do nothing."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            # cpu_percent() reports usage since the previous call; this primes both counters.
+            self._process.cpu_percent(None)
+            psutil.cpu_percent(None, percpu=True)
+            self._thread = threading.Thread(target=self._run, daemon=True, name="metrics-sampler")
+            self._thread.start()
+
+    def _disk_rates(self, now: float) -> tuple:
+        counters = psutil.disk_io_counters()
+        if counters is None:
+            return None, None
+        last, self._last_disk = self._last_disk, (now, counters.read_bytes, counters.write_bytes)
+        if last is None:
+            return 0.0, 0.0
+        elapsed = max(now - last[0], 1e-6)
+        return (counters.read_bytes - last[1]) / elapsed / 1e6, (counters.write_bytes - last[2]) / elapsed / 1e6
+
+    def sample(self) -> dict:
+        now = time.time()
+        with self._process.oneshot():
+            rss = self._process.memory_info().rss
+            threads = self._process.num_threads()
+            process_cpu = self._process.cpu_percent(None)
+        read_mb_s, write_mb_s = self._disk_rates(now)
+        vectors, index_mb = _index_size()
+        return {
+            "time": now,
+            "rss_mb": rss / 1e6,
+            "threads": threads,
+            "process_cpu_percent": process_cpu,
+            "cpu_per_core": psutil.cpu_percent(None, percpu=True),
+            "ram_percent": psutil.virtual_memory().percent,
+            "disk_read_mb_s": read_mb_s,
+            "disk_write_mb_s": write_mb_s,
+            "index_vectors": vectors,
+            "index_mb": index_mb,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                sample = self.sample()
+                with self._lock:
+                    self._samples.append(sample)
+            except Exception as e:
+                logging.warning(f"Metrics sampling failed: {e}")
+            time.sleep(self.interval_s)
+
+    def samples(self, since: Optional[float] = None) -> List[dict]:
+        """Recorded samples, oldest first; with since, only those taken after it."""
+        with self._lock:
+            samples = list(self._samples)
+        if since is not None:
+            samples = [s for s in samples if s["time"] > since]
+        return samples
+
+    def latest(self) -> Optional[dict]:
+        with self._lock:
+            return self._samples[-1] if self._samples else None
+
+
+# Shared instance, started with the app.
+sampler = MetricsSampler()
@@ -1,5 +1,7 @@
 # src/models.py
 import os
+import shutil
+import itertools
 import logging
 from pathlib import Path
 from typing import Optional
@@ -9,21 +11,82 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.llms import LlamaCpp
 
+from src.lexical import BM25Index
+from src.metadata_index import MetadataIndex
+from src.shards import ShardedFAISS, shard_name
+
 # Globals to hold the initialized models and objects
-db: Optional[FAISS] = None
+db: Optional[FAISS] = None  # a ShardedFAISS when shard_by_folder is set
 llm: Optional[LlamaCpp] = None
 embedder: Optional[HuggingFaceEmbeddings] = None
 text_splitter: Optional[RecursiveCharacterTextSplitter] = None
+# Lexical index over the same chunks as db, keyed by docstore ID.
+bm25: BM25Index = BM25Index()
+# Folder / extension / date lookups over the same chunks, used to pre-filter searches.
+metadata_index: MetadataIndex = MetadataIndex()
+# Absolute path of the knowledge folder; chunk rel_paths are relative to it.
+knowledge_dir: Optional[str] = None
+# Keep one index shard per top-level knowledge subfolder instead of one monolithic index.
+shard_by_folder: bool = False
 
+# Name of the knowledge collection whose index is currently in db (see knowledge_collections).
+collection: str = "default"
 
-def initialize_models_and_index(llm_model_path: str, embedding_model_name: str, index_path: str, chunk_size: int, chunk_overlap: int) -> bool:
-    """
-    Initialize embeddings, FAISS index, LLM, and text splitter.
-    Returns True on success, False on failure.
-    """
-    global db, llm, embedder, text_splitter
+# Changes on every change to the in-memory index; caches keyed on it become stale.
+# Values are unique across collections, so a swapped-in collection never matches another's.
+index_generation: int = 0
+_generations = itertools.count(1)
+
+# KV cache element types accepted by llama.cpp (GGML type ids).
+# Quantized V caches require flash attention, which is enabled automatically.
+KV_CACHE_TYPES = {
+    "f16": 1,
+    "q8_0": 8,
+    "q4_0": 2,
+}
+
+# Runtime parameters used when no value is configured. These mirror the values
+# that used to be hardcoded; n_threads=0 lets llama.cpp pick the thread count.
+DEFAULT_LLM_PARAMS = {
+    "n_ctx": 2048,
+    "n_batch": 512,
+    "n_threads": 0,
+    "n_gpu_layers": -1,
+    "use_mmap": True,
+    "use_mlock": False,
+    "kv_cache_type": "f16",
+}
+
+
+def build_llama_kwargs(llm_params: Optional[dict] = None) -> dict:
+    """Translate the app-level LLM runtime params into LlamaCpp keyword arguments."""
+    params = {**DEFAULT_LLM_PARAMS, **(llm_params or {})}
+    kv_type = KV_CACHE_TYPES.get(params["kv_cache_type"], KV_CACHE_TYPES["f16"])
+
+    model_kwargs = {}
+    if params["kv_cache_type"] != "f16":
+        model_kwargs.update({"type_k": kv_type, "type_v": kv_type, "flash_attn": True})
+    n_threads = int(params["n_threads"]) or None
+    if n_threads:
+        # Prompt evaluation runs on the batch thread pool.
+        model_kwargs["n_threads_batch"] = n_threads
+
+    return {
+        "n_ctx": int(params["n_ctx"]),
+        "n_batch": int(params["n_batch"]),
+        "n_threads": n_threads,
+        "n_gpu_layers": int(params["n_gpu_layers"]),
+        "use_mmap": bool(params["use_mmap"]),
+        "use_mlock": bool(params["use_mlock"]),
+        "f16_kv": params["kv_cache_type"] == "f16",
+        "model_kwargs": model_kwargs,
+    }
+
+
+def load_embedder(embedding_model_name: str, chunk_size: int, chunk_overlap: int) -> bool:
+    """Initialize the embedding model and the text splitter. Returns True on success."""
+    global embedder
 
-    # 1. Initialize Embedder
     logging.info(f"Initializing embedding model: {embedding_model_name}")
     try:
         embedder = HuggingFaceEmbeddings(model_name=embedding_model_name)
@@ -31,13 +94,98 @@ def initialize_models_and_index(llm_model_path: str, embedding_model_name: str,
         logging.error(f"Failed to load embedding model: {e}")
         return False
 
-    # 2. Initialize Text Splitter
+    load_text_splitter(chunk_size, chunk_overlap)
+    return True
+
+
+def load_text_splitter(chunk_size: int, chunk_overlap: int):
+    global text_splitter
+
     logging.info(f"Initializing text splitter with chunk_size={chunk_size} and chunk_overlap={chunk_overlap}")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    # start_index lets the context packer merge overlapping chunks of the same file.
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+
+
+def new_generation() -> int:
+    """A fresh index generation, e.g. for an index built outside the globals."""
+    return next(_generations)
+
+
+def mark_index_changed():
+    """Record that the in-memory index was replaced or mutated."""
+    global index_generation
+    index_generation = new_generation()
+
+
+def iter_indexed_chunks(store=None):
+    """Yield (docstore_id, Document) for every chunk in the in-memory index (or in store)."""
+    store = db if store is None else store
+    if store is None:
+        return
+    for docstore_id in list(store.index_to_docstore_id.values()):
+        doc = store.docstore.search(docstore_id)
+        if not isinstance(doc, str):
+            yield docstore_id, doc
+
+
+def filter_metadata(metadata: dict, folder: Optional[str] = None) -> dict:
+    """
+    Metadata used by the metadata index. Chunks indexed before rel_path was recorded
+    get it derived from their file_path, relative to folder (default: the active knowledge folder).
+    """
+    if "rel_path" in metadata or not metadata.get("file_path"):
+        return metadata
+    file_path = metadata["file_path"]
+    root = os.path.abspath(folder) if folder else knowledge_dir
+    if root and file_path.startswith(root + os.sep):
+        rel_path = os.path.relpath(file_path, root)
+    else:
+        rel_path = os.path.basename(file_path)
+    return {**metadata, "rel_path": rel_path.replace(os.sep, "/"), "extension": Path(file_path).suffix.lower()}
+
+
+def shard_of(metadata: dict) -> str:
+    """Name of the index shard a chunk with this metadata belongs to."""
+    return shard_name(filter_metadata(metadata).get("rel_path", ""))
+
+
+def new_sharded_index() -> ShardedFAISS:
+    return ShardedFAISS(embedder, shard_of)
+
+
+def load_index(index_path: str) -> bool:
+    """Load the persisted FAISS and BM25 indexes if they exist. Returns True if an index is now in memory."""
+    global db, bm25, metadata_index
 
-    # 3. Load FAISS Index from disk if it exists
+    db, bm25, metadata_index = read_index(index_path)
+    mark_index_changed()
+    return db is not None
+
+
+def _has_legacy_chunks(store) -> bool:
+    """True if the index has chunks stored under random IDs or without their file path."""
+    return any(
+        doc.metadata.get("chunk_id") != chunk_id or not doc.metadata.get("file_path")
+        for chunk_id, doc in iter_indexed_chunks(store)
+    )
+
+
+def read_index(index_path: str, folder: Optional[str] = None) -> tuple:
+    """
+    Read the persisted indexes without installing them in the globals.
+    Returns (FAISS index or None, BM25 index, metadata index); folder is as for filter_metadata.
+    """
     logging.info(f"Looking for FAISS index at: {index_path}")
-    if os.path.exists(index_path):
+    if shard_by_folder:
+        try:
+            db = ShardedFAISS.load_local(index_path, embedder, shard_of)
+        except FileNotFoundError:
+            db = None
+            logging.info("No index shards found. They will be created upon scanning knowledge files.")
+        except Exception as e:
+            logging.warning(f"Failed to load index shards: {e}. New shards will be created.")
+            db = None
+    elif os.path.exists(index_path):
         try:
             db = FAISS.load_local(
                 index_path, 
@@ -52,26 +200,67 @@ def initialize_models_and_index(llm_model_path: str, embedding_model_name: str,
         db = None
         logging.info("No FAISS index found. A new one will be created upon scanning knowledge files.")
 
-    # 4. Load GGUF LLM
+    if db is not None and _has_legacy_chunks(db):
+        # Random chunk IDs are never matched by a re-scan, so every file would be indexed twice,
+        # and without file_path the chunks of a deleted file could not be found and removed.
+        logging.warning(f"The index at {index_path} predates content-hash chunk IDs; rebuilding it from the knowledge files.")
+        shutil.rmtree(index_path, ignore_errors=True)
+        db = None
+
+    bm25 = BM25Index()
+    if db is not None:
+        try:
+            bm25 = BM25Index.load(index_path)
+        except Exception as e:
+            logging.info(f"Could not load BM25 index: {e}")
+        if len(bm25) != len(db.index_to_docstore_id):
+            logging.info("BM25 index missing or out of sync; rebuilding it from the FAISS docstore.")
+            bm25 = BM25Index.from_chunks((chunk_id, doc.page_content) for chunk_id, doc in iter_indexed_chunks(db))
+            bm25.save(index_path)
+        metadata_index = MetadataIndex.from_chunks(
+            (chunk_id, filter_metadata(doc.metadata, folder)) for chunk_id, doc in iter_indexed_chunks(db)
+        )
+    else:
+        metadata_index = MetadataIndex()
+    return db, bm25, metadata_index
+
+
+def load_llm(llm_model_path: str, llm_params: Optional[dict] = None) -> bool:
+    """Load the GGUF model. Returns True on success."""
+    global llm
+
     gguf_model_file = Path(llm_model_path)
     if not gguf_model_file.exists():
         logging.error(f"LLM model file not found at {gguf_model_file}")
         llm = None
         return False
-    else:
-        try:
-            logging.info(f"Loading GGUF model from: {gguf_model_file}")
-            llm = LlamaCpp(
-                model_path=str(gguf_model_file),
-                n_gpu_layers=-1,
-                n_batch=512,
-                n_ctx=2048,
-                f16_kv=True,
-                verbose=False,
-            )
-            logging.info("LLM loaded successfully.")
-            return True
-        except Exception as e:
-            logging.error(f"Failed to load LLM: {e}", exc_info=True)
-            llm = None
-            return False
\ No newline at end of file
+    try:
+        llama_kwargs = build_llama_kwargs(llm_params)
+        logging.info(f"Loading GGUF model from: {gguf_model_file} with {llama_kwargs}")
+        llm = LlamaCpp(
+            model_path=str(gguf_model_file),
+            verbose=False,
+            **llama_kwargs,
+        )
+        logging.info("LLM loaded successfully.")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to load LLM: {e}", exc_info=True)
+        llm = None
+        return False
+
+
+def initialize_models_and_index(llm_model_path: str, embedding_model_name: str, index_path: str, chunk_size: int, chunk_overlap: int, llm_params: Optional[dict] = None, with_llm: bool = True) -> bool:
+    """
+    Initialize embeddings, FAISS index, LLM, and text splitter.
+    llm_params overrides DEFAULT_LLM_PARAMS (see build_llama_kwargs).
+    With with_llm=False no GGUF model is loaded; only retrieval and extractive answers work.
+    Returns True on success, False on failure.
+    """
+    if not load_embedder(embedding_model_name, chunk_size, chunk_overlap):
+        return False
+    load_index(index_path)
+    if not with_llm:
+        logging.info("Skipping LLM loading; only retrieval and extractive answers are available.")
+        return True
+    return load_llm(llm_model_path, llm_params)
@@ -3,8 +3,9 @@ import time
 from pathlib import Path
 from typing import List, Optional
 
-from src import models
-from src.indexing import db_lock, update_vector_store, _ensure_dirs
+from src import models, tracing
+from src.indexing import update_vector_store, _ensure_dirs
+from src.retrieval import retrieve
 
 def _build_prompt(query: str, context: str) -> str:
     base = (
@@ -22,14 +23,16 @@ def answer_query(query: str, k: int = 4) -> (str, List[str]):
         logging.warning("Index empty. Cannot perform similarity search.")
         return "I cannot answer this question based on the provided information.", []
 
-    with db_lock:
-        docs = models.db.similarity_search(query, k=k)
-    context = "\n\n".join(d.page_content for d in docs) if docs else ""
-    sources = [getattr(d, "metadata", {}).get("source", "") or d.page_content[:200] for d in docs]
-    prompt = _build_prompt(query, context)
+    with tracing.span("answer_query", k=k):
+        docs = retrieve(query, k=k)
+        with tracing.span("prompt_build", chunks=len(docs)):
+            context = "\n\n".join(d.page_content for d in docs) if docs else ""
+            sources = [getattr(d, "metadata", {}).get("source", "") or d.page_content[:200] for d in docs]
+            prompt = _build_prompt(query, context)
 
-    logging.info("Calling LLM...")
-    resp = models.llm(prompt)
+        logging.info("Calling LLM...")
+        with tracing.span("llm.generate"):
+            resp = models.llm(prompt)
     # pipeline returns list of dicts with 'generated_text'
     gen = resp[0].get("generated_text", "").strip() if resp else ""
     if not gen:
@@ -5,7 +5,16 @@ from pathlib import Path
 from typing import List, Tuple, Optional
 
 from src import models
-from src.indexing import db_lock, update_vector_store, _ensure_dirs
+from src.indexing import update_vector_store, _ensure_dirs
+from src.retrieval import (
+    retrieve, embed_query, answer_cache, answer_scope, chunks_are_live, chunk_ids_of, normalize_filters,
+)
+from src.context import merge_chunks, pack_context
+from src.compression import compress_passages, split_sentences, score_sentences
+from src.rerank import rerank, DEFAULT_RERANK_MODEL
+from src.knowledge_collections import manager as collection_manager
+from src import gate
+from src import tracing
 
 def _build_prompt(query: str, context: str, system_prompt: str) -> str:
     """Builds a structured prompt for the Llama 3 Instruct model."""
@@ -24,38 +33,211 @@ Question: {query}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
     return prompt
 
 
-def answer_query(query: str, system_prompt: str, k: int = 4) -> Tuple[str, List[str]]:
-    """Retrieve top-k docs, generate answer, and return (answer, sources)."""
-    if not models.db:
-        logging.warning("FAISS index not loaded or empty.")
-        return "The knowledge base is not available. I cannot answer questions right now.", []
+def _extractive_answer(query_vector, docs, max_passages: int = 3, highlights: int = 2,
+                       window: int = 2) -> Tuple[str, List[str]]:
+    """
+    Render the top passages as an answer without the LLM: the best-matching sentences
+    of each passage are shown in bold with `window` sentences of context around the best,
+    followed by a numbered citation of the source file. Returns the answer and the cited
+    sources; citation [n] refers to the n-th source. Sentences are scored against the
+    query's embedding, which the caller has already computed.
+    """
+    passages = merge_chunks(docs)[:max_passages]
+    split = [split_sentences(p.page_content) for p in passages]
+    flat = [(pi, si) for pi, sentences in enumerate(split) for si in range(len(sentences))]
+    if not flat:
+        return "", []
+    scores = score_sentences([split[pi][si] for pi, si in flat], query_vector)
 
-    with db_lock:
+    by_passage = {}
+    for (pi, si), score in zip(flat, scores):
+        by_passage.setdefault(pi, []).append((float(score), si))
+
+    blocks, sources = [], []
+    for pi, passage in enumerate(passages):
+        ranked = sorted(by_passage.get(pi, []), reverse=True)
+        if not ranked:
+            continue
+        top = ranked[0][1]
+        first = max(top - window, 0)
+        last = min(top + window, len(split[pi]) - 1)
+        best = {si for _, si in ranked[:highlights] if first <= si <= last}
+        sentences = [f"**{split[pi][si]}**" if si in best else split[pi][si] for si in range(first, last + 1)]
+        text = ("... " if first > 0 else "") + " ".join(sentences) + (" ..." if last < len(split[pi]) - 1 else "")
+        source = passage.metadata.get("source", "Unknown")
+        if source not in sources:
+            sources.append(source)
+        blocks.append(f"> {text}\n\n— [{sources.index(source) + 1}] *{source}*")
+    return "\n\n".join(blocks), sources
+
+
+def _elapsed_ms(since: float) -> float:
+    return (time.perf_counter() - since) * 1000
+
+
+def answer_query(query: str, system_prompt: str, k: int = 4, use_cache: bool = True,
+                 cache_threshold: Optional[float] = None, hybrid: bool = True,
+                 max_new_tokens: int = 512, compress: bool = False,
+                 compression_ratio: float = 0.5, use_rerank: bool = False,
+                 rerank_candidates: int = 50, rerank_model: str = DEFAULT_RERANK_MODEL,
+                 rerank_budget_ms: float = 300.0, use_gate: bool = False,
+                 gate_threshold: Optional[float] = None, extractive: bool = False,
+                 filters: Optional[dict] = None, collection: Optional[str] = None,
+                 stats: Optional[dict] = None) -> Tuple[str, List[str]]:
+    """
+    Retrieve top-k docs, generate answer, and return (answer, sources).
+    With extractive (or when no LLM is loaded), the answer is the top passages with
+    their best-matching sentences highlighted, and the LLM is not called at all.
+    With hybrid, chunks are ranked by fusing vector and BM25 results. With use_rerank,
+    rerank_candidates chunks are fetched and a cross-encoder picks the best k of them,
+    unless that would exceed rerank_budget_ms. With use_gate, the canned refusal is
+    returned without generation when the nearest chunk is farther than gate_threshold
+    (default: the calibrated threshold for the current embedder).
+    Retrieved chunks are merged, de-duplicated and packed into the model's context
+    window, keeping max_new_tokens free for the answer. With compress, only the
+    sentences most relevant to the query (about compression_ratio of them) are kept.
+    With use_cache, answers to semantically equivalent earlier questions are returned
+    without calling the LLM, as long as the chunks they were built from are unchanged.
+    Filters limit retrieval to chunks from matching folders, file types and dates.
+    Collection names the knowledge collection to search (default: the configured folder).
+    If a stats dict is given, it is filled with the interaction's metrics (see INTERACTION_METRICS
+    in src.database): per-stage timings in ms, token counts, k, index generation and cache hits.
+    """
+    stats = {} if stats is None else stats
+    stats.update(k=k, answer_cache_hit=False, retrieval_cache_hit=False)
+    started = time.perf_counter()
+    with tracing.span("answer_query", k=k, collection=collection) as span:
+        try:
+            return _answer_query(query, system_prompt, k, use_cache, cache_threshold, hybrid, max_new_tokens, compress,
+                                 compression_ratio, use_rerank, rerank_candidates, rerank_model, rerank_budget_ms,
+                                 use_gate, gate_threshold, extractive, filters, collection, stats)
+        finally:
+            stats["total_ms"] = _elapsed_ms(started)
+            span.set(outcome=stats.get("outcome"), index_generation=stats.get("index_generation"))
+
+
+def _answer_query(query, system_prompt, k, use_cache, cache_threshold, hybrid, max_new_tokens, compress,
+                  compression_ratio, use_rerank, rerank_candidates, rerank_model, rerank_budget_ms,
+                  use_gate, gate_threshold, extractive, filters, collection, stats: dict) -> Tuple[str, List[str]]:
+    # Embedded before the collection is activated, so concurrent queries still share embedding batches.
+    stage = time.perf_counter()
+    with tracing.span("embed_query"):
+        query_vector = embed_query(query)
+    stats["embed_ms"] = _elapsed_ms(stage)
+    with collection_manager.activate(collection):
+        stats["index_generation"] = models.index_generation
+        if not models.db:
+            logging.warning("FAISS index not loaded or empty.")
+            stats["outcome"] = "unavailable"
+            return "The knowledge base is not available. I cannot answer questions right now.", []
+
+        scope = answer_scope(system_prompt, k, hybrid, max_new_tokens, compress and compression_ratio,
+                             use_rerank and rerank_model, normalize_filters(filters))
+        if use_cache and not extractive:
+            with tracing.span("answer_cache.lookup") as span:
+                cached = answer_cache.lookup(query_vector, scope, chunks_are_live, cache_threshold)
+                span.set(hit=bool(cached))
+            if cached:
+                logging.info(f"Answer cache hit (similarity {cached['similarity']:.3f}); skipping the LLM.")
+                stats.update(answer_cache_hit=True, outcome="cache")
+                return cached["answer"], cached["sources"]
+
+        stage = time.perf_counter()
         try:
-            docs = models.db.similarity_search(query, k=k)
+            if use_gate:
+                threshold = gate_threshold if gate_threshold is not None else gate.get_threshold()
+                with tracing.span("gate") as span:
+                    refuse = threshold is not None and gate.should_refuse(
+                        query, query_vector, threshold, lexical=hybrid, filters=filters
+                    )
+                    span.set(refused=refuse)
+                if refuse:
+                    stats["outcome"] = "refused"
+                    return gate.REFUSAL, []
+
+            if use_rerank:
+                candidates = retrieve(query, k=max(rerank_candidates, k), hybrid=hybrid, filters=filters, stats=stats)
+                with tracing.span("rerank", candidates=len(candidates), model=rerank_model):
+                    docs = rerank(query, candidates, top_n=k, model_name=rerank_model, budget_ms=rerank_budget_ms)
+            else:
+                docs = retrieve(query, k=k, hybrid=hybrid, filters=filters, stats=stats)
         except Exception as e:
             logging.error(f"Error during similarity search: {e}")
+            stats["outcome"] = "error"
             return "An error occurred while searching the knowledge base.", []
+        finally:
+            stats["search_ms"] = _elapsed_ms(stage)
 
-    context = "\n\n".join(d.page_content for d in docs)
-    # Use a set to get unique sources, then convert back to a list
-    sources = list(set(d.metadata.get("source", "Unknown") for d in docs))
-    prompt = _build_prompt(query, context, system_prompt)
+    if extractive or not models.llm:
+        stats["outcome"] = "extractive"
+        answer, sources = _extractive_answer(query_vector, docs) if docs else ("", [])
+        if not answer:
+            return gate.REFUSAL, sources
+        if not extractive:
+            logging.warning("LLM not loaded. Returning search results only.")
+            answer = "The language model is not available. Here are the most relevant passages:\n\n" + answer
+        return answer, sources
 
-    if not models.llm:
-        logging.warning("LLM not loaded. Cannot generate answer.")
-        return "The language model is not available, so I cannot generate an answer.", sources
+    stage = time.perf_counter()
+    with tracing.span("prompt_build", chunks=len(docs)) as span:
+        passages = merge_chunks(docs)
+        if compress and passages:
+            try:
+                with tracing.span("compress") as compress_span:
+                    passages, savings = compress_passages(passages, query_vector, ratio=compression_ratio)
+                    compress_span.set(tokens_before=savings["tokens_before"], saved=savings["saved"])
+                stats["compression_tokens_before"] = savings["tokens_before"]
+                stats["compression_tokens_saved"] = savings["saved"]
+            except Exception as e:
+                logging.error(f"Context compression failed, using full passages: {e}")
 
+        context, passages, pack_stats = pack_context(
+            passages,
+            lambda ctx: _build_prompt(query, ctx, system_prompt),
+            n_ctx=models.llm.n_ctx,
+            max_new_tokens=max_new_tokens,
+        )
+        # Unique sources of the passages that made it into the prompt, in relevance order
+        sources = list(dict.fromkeys(d.metadata.get("source", "Unknown") for d in passages))
+        prompt = _build_prompt(query, context, system_prompt)
+        span.set(passages=len(passages), prompt_tokens=pack_stats["prompt_tokens"])
+    stats["prompt_build_ms"] = _elapsed_ms(stage)
+    stats["prompt_tokens"] = pack_stats["prompt_tokens"]
 
     logging.info("Calling LLM to generate answer...")
     try:
-        # Using stop tokens specific to Llama 3 to ensure clean output.
-        response_text = models.llm(prompt, max_tokens=1024, stop=["<|eot_id|>", "<|end_of_text|>"])
+        # Streamed so prompt evaluation (until the first token) and generation can be timed apart.
+        # llama.cpp streams one token per piece. Stop tokens are specific to Llama 3.
+        started = time.perf_counter()
+        first_token_at = None
+        pieces = []
+        for piece in models.llm.stream(prompt, max_tokens=max_new_tokens, stop=["<|eot_id|>", "<|end_of_text|>"]):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            pieces.append(piece)
+        finished = time.perf_counter()
+        response_text = "".join(pieces).strip()
+        gate.record_llm_latency(finished - started)
+
+        first_token_at = first_token_at or finished
+        tracing.record("llm.prompt_eval", started, first_token_at, prompt_tokens=pack_stats["prompt_tokens"])
+        tracing.record("llm.generate", first_token_at, finished, tokens=len(pieces))
+        stats["prompt_eval_ms"] = (first_token_at - started) * 1000
+        stats["generation_ms"] = (finished - first_token_at) * 1000
+        stats["completion_tokens"] = len(pieces)
+        if finished > first_token_at:
+            stats["tokens_per_s"] = len(pieces) / (finished - first_token_at)
+        stats["outcome"] = "llm"
 
-        return response_text.strip(), sources
+        chunk_ids = chunk_ids_of(passages)
+        # Only answers whose every chunk can be re-validated later are cached.
+        if use_cache and response_text and chunk_ids:
+            answer_cache.store(query_vector, scope, response_text, sources, chunk_ids)
+        return response_text, sources
 
     except Exception as e:
         logging.error(f"LLM call failed: {e}")
+        stats["outcome"] = "error"
         return "The language model failed to generate an answer. Please check the logs.", sources
 
 
@@ -74,7 +256,7 @@ def add_user_knowledge(text: str, knowledge_dir: str, index_path: str, filename:
     logging.info(f"Saved new knowledge to {path}")
 
     try:
-        update_vector_store([str(path)], index_path)
+        update_vector_store([str(path)], index_path, knowledge_dir=knowledge_dir)
     except Exception as e:
         logging.error(f"Failed to update vector store after adding user knowledge: {e}")
 
@@ -0,0 +1,84 @@
+# src/rerank.py
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from langchain.docstore.document import Document
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+reranker = None
+reranker_name: Optional[str] = None
+_load_lock = threading.Lock()
+
+# Load tracking used to decide when reranking must be skipped.
+_state_lock = threading.Lock()
+_in_flight = 0
+_ms_per_pair: Optional[float] = None  # exponential moving average
+stats = {"reranked": 0, "skipped_busy": 0, "skipped_budget": 0, "failed": 0}
+
+
+def load_reranker(model_name: str = DEFAULT_RERANK_MODEL):
+    """Load (or return the already loaded) CPU cross-encoder."""
+    global reranker, reranker_name
+    with _load_lock:
+        if reranker is None or reranker_name != model_name:
+            from sentence_transformers import CrossEncoder
+
+            logging.info(f"Loading cross-encoder reranker: {model_name}")
+            reranker = CrossEncoder(model_name, device="cpu")
+            reranker_name = model_name
+    return reranker
+
+
+def _record_skip(reason: str):
+    with _state_lock:
+        stats[reason] += 1
+
+
+def rerank(query: str, docs: List[Document], top_n: int, model_name: str = DEFAULT_RERANK_MODEL,
+           budget_ms: float = 300.0, max_concurrent: int = 1) -> List[Document]:
+    """
+    Score all (query, chunk) pairs with the cross-encoder in one batched forward pass and
+    return the top_n chunks. Falls back to the incoming order (docs[:top_n]) when
+    max_concurrent reranks are already running or the expected latency exceeds budget_ms.
+    """
+    global _in_flight, _ms_per_pair
+    if len(docs) <= 1:
+        return docs[:top_n]
+
+    with _state_lock:
+        if _in_flight >= max_concurrent:
+            stats["skipped_busy"] += 1
+            logging.info("Reranker busy; using retrieval order.")
+            return docs[:top_n]
+        if _ms_per_pair is not None and _ms_per_pair * len(docs) > budget_ms:
+            stats["skipped_budget"] += 1
+            # Decay the estimate so a transient slowdown does not disable reranking for good.
+            _ms_per_pair *= 0.9
+            logging.info(f"Reranking {len(docs)} candidates would exceed {budget_ms:.0f} ms; using retrieval order.")
+            return docs[:top_n]
+        _in_flight += 1
+
+    try:
+        model = load_reranker(model_name)
+        start = time.perf_counter()
+        scores = model.predict([(query, d.page_content) for d in docs], batch_size=len(docs), show_progress_bar=False)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        logging.error(f"Reranking failed, using retrieval order: {e}")
+        _record_skip("failed")
+        return docs[:top_n]
+    finally:
+        with _state_lock:
+            _in_flight -= 1
+
+    with _state_lock:
+        per_pair = elapsed_ms / len(docs)
+        _ms_per_pair = per_pair if _ms_per_pair is None else 0.8 * _ms_per_pair + 0.2 * per_pair
+        stats["reranked"] += 1
+    logging.info(f"Reranked {len(docs)} candidates in {elapsed_ms:.0f} ms")
+
+    order = sorted(range(len(docs)), key=lambda i: float(scores[i]), reverse=True)
+    return [docs[i] for i in order[:top_n]]
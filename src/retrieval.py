@@ -0,0 +1,178 @@
+# src/retrieval.py
+import logging
+from typing import Dict, FrozenSet, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src import models, tracing
+from src.cache import LRUCache, SemanticAnswerCache
+from src.indexing import db_lock
+from src.lexical import reciprocal_rank_fusion
+from src.embedding_service import batcher
+from src.shards import ShardedFAISS, faiss_search
+
+# Query text -> embedding vector. Independent of the index, tied to the embedder.
+query_embedding_cache = LRUCache(maxsize=1024)
+# (collection, query text, k, hybrid, filters) -> (index generation, documents). Stale generations count as misses.
+retrieval_cache = LRUCache(maxsize=256)
+stale_retrievals = 0
+# Generated answers keyed on query embedding similarity; see answer_scope/chunks_are_live.
+answer_cache = SemanticAnswerCache(maxsize=512, threshold=0.92)
+
+# docstore ID -> FAISS position, rebuilt once per index generation.
+_positions: Tuple[int, Dict[str, int]] = (-1, {})
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace so trivially different spellings of a query share cache entries."""
+    return " ".join(query.split())
+
+
+def embed_query(query: str) -> List[float]:
+    """
+    Embed a query string, reusing the cached vector when the same embedder saw it before.
+    Cache misses go through the shared micro-batcher so concurrent queries share one forward pass.
+    """
+    text = normalize_query(query)
+    key = (getattr(models.embedder, "model_name", None), text)
+    vector = query_embedding_cache.get(key)
+    if vector is None:
+        vector = batcher.embed(text)
+        query_embedding_cache.put(key, vector)
+    return vector
+
+
+def normalize_filters(filters: Optional[dict]) -> Optional[tuple]:
+    """Hashable form of the active search filters, None when nothing is filtered."""
+    if not filters:
+        return None
+    active = []
+    for key, value in sorted(filters.items()):
+        if value in (None, "", []):
+            continue
+        active.append((key, tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else value))
+    return tuple(active) or None
+
+
+def _faiss_positions() -> Dict[str, int]:
+    """docstore ID -> position in the FAISS index. Caller must hold db_lock."""
+    global _positions
+    generation, positions = _positions
+    if generation != models.index_generation:
+        positions = {chunk_id: position for position, chunk_id in models.db.index_to_docstore_id.items()}
+        _positions = (models.index_generation, positions)
+    return positions
+
+
+def dense_search(vector: List[float], k: int, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+    """
+    Nearest chunks by vector distance as (docstore_id, L2 distance). With allowed, only
+    those chunk IDs are searched. A sharded index is searched shard-parallel. Caller must hold db_lock.
+    """
+    db = models.db
+    if db is None:
+        return []
+    if isinstance(db, ShardedFAISS):
+        return db.search(vector, k, allowed)
+    positions = _faiss_positions() if allowed is not None else None
+    return faiss_search(db, np.asarray([vector], dtype=np.float32), k, allowed, positions)
+
+
+def _lookup_docs(chunk_ids: List[str]) -> List[Document]:
+    """Fetch documents from the docstore, skipping IDs that have disappeared. Caller must hold db_lock."""
+    docs = [models.db.docstore.search(chunk_id) for chunk_id in chunk_ids]
+    return [d for d in docs if isinstance(d, Document)]
+
+
+def retrieve(query: str, k: int = 4, hybrid: bool = True, fetch_k: int = 0,
+             filters: Optional[dict] = None, stats: Optional[dict] = None) -> List[Document]:
+    """
+    Return the top-k chunks for a query, served from cache while the index is unchanged.
+    With hybrid, the top fetch_k dense and BM25 candidates are fused with reciprocal
+    rank fusion, so exact identifiers and error codes are found even when the
+    embedder ranks them low. Filters (see metadata_index.FILTER_KEYS) restrict the
+    search to matching chunks before ranking, so k results come back whenever k match.
+    A given stats dict gets retrieval_cache_hit set.
+    """
+    global stale_retrievals
+
+    text = normalize_query(query)
+    filter_key = normalize_filters(filters)
+    cache_key = (models.collection, text, k, hybrid, filter_key)
+    with tracing.span("retrieve", k=k, hybrid=hybrid) as span:
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            generation, docs = cached
+            if generation == models.index_generation:
+                if stats is not None:
+                    stats["retrieval_cache_hit"] = True
+                span.set(cache_hit=True)
+                return list(docs)
+            stale_retrievals += 1
+            retrieval_cache.pop(cache_key)
+
+        vector = embed_query(text)
+        fetch_k = fetch_k or max(4 * k, 20)
+        with tracing.locked(db_lock, "db_lock"):
+            if models.db is None:
+                return []
+            generation = models.index_generation
+            allowed = models.metadata_index.resolve(filters) if filter_key else None
+            if hybrid:
+                with tracing.span("search.dense", fetch_k=fetch_k):
+                    dense_ids = [chunk_id for chunk_id, _ in dense_search(vector, fetch_k, allowed)]
+                with tracing.span("search.bm25", fetch_k=fetch_k):
+                    lexical_ids = [chunk_id for chunk_id, _ in models.bm25.search(text, fetch_k, allowed)]
+                ranked_ids = [chunk_id for chunk_id, _ in reciprocal_rank_fusion([dense_ids, lexical_ids])]
+            else:
+                with tracing.span("search.dense", fetch_k=k):
+                    ranked_ids = [chunk_id for chunk_id, _ in dense_search(vector, k, allowed)]
+            with tracing.span("search.lookup"):
+                docs = _lookup_docs(ranked_ids[:k])
+        span.set(cache_hit=False, results=len(docs))
+    retrieval_cache.put(cache_key, (generation, docs))
+    logging.debug(f"Retrieved {len(docs)} chunks for query at index generation {generation}")
+    return list(docs)
+
+
+def answer_scope(*parts: Hashable) -> tuple:
+    """Answers are only reused between queries embedded by the same model, against the same collection, under the same settings."""
+    return (getattr(models.embedder, "model_name", None), models.collection, *parts)
+
+
+def chunks_are_live(chunk_ids: FrozenSet[str]) -> bool:
+    """True if every chunk is still present, unchanged, in the current index."""
+    db = models.db
+    if db is None:
+        return False
+    return all(isinstance(db.docstore.search(chunk_id), Document) for chunk_id in chunk_ids)
+
+
+def chunk_ids_of(docs: List[Document]) -> Optional[List[str]]:
+    """Chunk IDs behind the given chunks or merged passages; None if any of them has no ID."""
+    chunk_ids = []
+    for doc in docs:
+        if doc.metadata.get("merged_chunk_ids"):
+            chunk_ids.extend(doc.metadata["merged_chunk_ids"])
+        elif "chunk_id" in doc.metadata:
+            chunk_ids.append(doc.metadata["chunk_id"])
+        else:
+            return None
+    return chunk_ids
+
+
+def cache_stats() -> dict:
+    """Hit-rate metrics for the query embedding and retrieval caches."""
+    retrievals = retrieval_cache.stats()
+    # Stale entries were found by the LRU but could not be served, so they count as misses.
+    retrievals["hits"] -= stale_retrievals
+    retrievals["misses"] += stale_retrievals
+    lookups = retrievals["hits"] + retrievals["misses"]
+    retrievals["hit_rate"] = retrievals["hits"] / lookups if lookups else 0.0
+    retrievals["stale"] = stale_retrievals
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "retrievals": retrievals,
+        "answers": answer_cache.stats(),
+    }
@@ -0,0 +1,212 @@
+# src/session_catalog.py
+import re
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# One catalog per sessions folder, kept up to date by src.chat_sessions on every write,
+# so listing and searching sessions never touches the session files themselves.
+CATALOG_FILENAME = "catalog.db"
+
+# Characters of the first question kept as a session's title.
+TITLE_CHARS = 80
+
+# Words of context on each side of a match in search snippets.
+SNIPPET_WORDS = 12
+
+_initialized: Set[Path] = set()
+# Whether a catalog's message text is an FTS5 index; without FTS5 it is a plain table searched with LIKE.
+_fts: Dict[Path, bool] = {}
+_init_lock = threading.Lock()
+
+
+def _connect(root: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(root / CATALOG_FILENAME), timeout=30)
+    if root not in _initialized:
+        with _init_lock:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    name TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    title TEXT NOT NULL DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at);
+                """
+            )
+            _fts[root] = _create_message_text(conn)
+            conn.commit()
+            _initialized.add(root)
+    return conn
+
+
+def _create_message_text(conn: sqlite3.Connection) -> bool:
+    """Create the message text index, as FTS5 where SQLite has it. Returns whether it is FTS5."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'message_text'").fetchone()
+    if row is not None:
+        return "fts5" in row[0].lower()
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE message_text USING fts5("
+            "content, session UNINDEXED, seq UNINDEXED, role UNINDEXED, tokenize = 'unicode61')"
+        )
+        return True
+    except sqlite3.OperationalError:
+        logging.info("SQLite has no FTS5; chat search falls back to substring matching.")
+        conn.executescript(
+            """
+            CREATE TABLE message_text (session TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT, content TEXT);
+            CREATE INDEX idx_message_text_session ON message_text (session);
+            """
+        )
+        return False
+
+
+def title_of(message: dict) -> str:
+    """A session's title: the start of its first question."""
+    if message.get("role") != "user":
+        return ""
+    return " ".join(str(message.get("content", "")).split())[:TITLE_CHARS]
+
+
+def upsert(root: Path, name: str, created_at: float, updated_at: float, message_count: int, title: str):
+    with closing(_connect(root)) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (name, created_at, updated_at, message_count, title) VALUES (?, ?, ?, ?, ?)",
+            (name, created_at, updated_at, message_count, title),
+        )
+        conn.commit()
+
+
+def record_message(root: Path, name: str, seq: int, message: dict, updated_at: float):
+    """Count and index message number seq appended to a session; the first question becomes the title."""
+    with closing(_connect(root)) as conn:
+        cursor = conn.execute(
+            "UPDATE sessions SET message_count = message_count + 1, updated_at = ?, "
+            "title = CASE WHEN title = '' THEN ? ELSE title END WHERE name = ?",
+            (updated_at, title_of(message), name),
+        )
+        if cursor.rowcount == 0:
+            conn.execute(
+                "INSERT INTO sessions (name, created_at, updated_at, message_count, title) VALUES (?, ?, ?, 1, ?)",
+                (name, updated_at, updated_at, title_of(message)),
+            )
+        _insert_text(conn, name, [(seq, message)])
+        conn.commit()
+
+
+def _insert_text(conn: sqlite3.Connection, name: str, messages: Iterable[Tuple[int, dict]]):
+    conn.executemany(
+        "INSERT INTO message_text (content, session, seq, role) VALUES (?, ?, ?, ?)",
+        [(str(message.get("content", "")), name, seq, message.get("role", "")) for seq, message in messages],
+    )
+
+
+def index_messages(root: Path, name: str, messages: List[dict]):
+    """(Re)index the text of every message of a session."""
+    with closing(_connect(root)) as conn:
+        conn.execute("DELETE FROM message_text WHERE session = ?", (name,))
+        _insert_text(conn, name, enumerate(messages))
+        conn.commit()
+
+
+def text_indexed_names(root: Path) -> Set[str]:
+    """Sessions with at least one message in the text index."""
+    with closing(_connect(root)) as conn:
+        return {name for (name,) in conn.execute("SELECT DISTINCT session FROM message_text")}
+
+
+def rename(root: Path, old_name: str, new_name: str):
+    with closing(_connect(root)) as conn:
+        conn.execute("UPDATE sessions SET name = ? WHERE name = ?", (new_name, old_name))
+        conn.execute("UPDATE message_text SET session = ? WHERE session = ?", (new_name, old_name))
+        conn.commit()
+
+
+def delete(root: Path, names: List[str]):
+    with closing(_connect(root)) as conn:
+        conn.executemany("DELETE FROM sessions WHERE name = ?", [(name,) for name in names])
+        conn.executemany("DELETE FROM message_text WHERE session = ?", [(name,) for name in names])
+        conn.commit()
+
+
+def names(root: Path) -> Set[str]:
+    with closing(_connect(root)) as conn:
+        return {name for (name,) in conn.execute("SELECT name FROM sessions")}
+
+
+def _like_pattern(text: str) -> str:
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def page(root: Path, offset: int = 0, limit: int = 20, search: Optional[str] = None) -> Tuple[List[dict], int]:
+    """
+    One page of sessions, most recently updated first, and the number of sessions in total.
+    Search matches case-insensitively anywhere in the session name or title.
+    """
+    where, params = "", ()
+    if search:
+        pattern = _like_pattern(search)
+        where, params = "WHERE name LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\'", (pattern, pattern)
+    with closing(_connect(root)) as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM sessions {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT name, created_at, updated_at, message_count, title FROM sessions {where} "
+            "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            params + (limit, offset),
+        ).fetchall()
+    columns = ("name", "created_at", "updated_at", "message_count", "title")
+    return [dict(zip(columns, row)) for row in rows], total
+
+
+def latest(root: Path) -> Optional[str]:
+    """Name of the most recently updated session."""
+    with closing(_connect(root)) as conn:
+        row = conn.execute("SELECT name FROM sessions ORDER BY updated_at DESC LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def _snippet(content: str, words: List[str]) -> str:
+    """A window of SNIPPET_WORDS words on each side of the first matching word, matches in bold."""
+    tokens = content.split()
+    lowered = [w.lower() for w in words]
+    hit = next((i for i, token in enumerate(tokens) if any(w in token.lower() for w in lowered)), 0)
+    start, end = max(hit - SNIPPET_WORDS, 0), hit + SNIPPET_WORDS + 1
+    window = [f"**{t}**" if any(w in t.lower() for w in lowered) else t for t in tokens[start:end]]
+    return ("… " if start else "") + " ".join(window) + (" …" if end < len(tokens) else "")
+
+
+def search(root: Path, query: str, limit: int = 20) -> List[dict]:
+    """
+    Messages of every session containing all words of query (the last one as a prefix,
+    for search-as-you-type), best matches first. Each hit has the session name, the
+    message's position in the session (seq), its role and a snippet around the match.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return []
+    with closing(_connect(root)) as conn:
+        if _fts.get(root):
+            match = " ".join(f'"{w}"' for w in words[:-1]) + f' "{words[-1]}"*'
+            rows = conn.execute(
+                "SELECT session, seq, role, snippet(message_text, 0, '**', '**', '…', ?) FROM message_text "
+                "WHERE message_text MATCH ? ORDER BY rank LIMIT ?",
+                (2 * SNIPPET_WORDS, match.strip(), limit),
+            ).fetchall()
+        else:
+            where = " AND ".join(["content LIKE ? ESCAPE '\\'"] * len(words))
+            rows = [
+                (session, seq, role, _snippet(content, words))
+                for session, seq, role, content in conn.execute(
+                    f"SELECT session, seq, role, content FROM message_text WHERE {where} "
+                    "ORDER BY rowid DESC LIMIT ?",
+                    [_like_pattern(w) for w in words] + [limit],
+                )
+            ]
+    return [{"session": session, "seq": int(seq), "role": role, "snippet": snippet} for session, seq, role, snippet in rows]
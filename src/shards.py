@@ -0,0 +1,224 @@
+# src/shards.py
+import os
+import heapq
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+
+# Shard directories live under <index_path>/shards/<name>.
+SHARDS_DIRNAME = "shards"
+# Shard holding files directly in the knowledge folder.
+ROOT_SHARD = "__root__"
+
+# Filtered searches over at most this share of an index scan the allowed vectors directly;
+# larger subsets are searched with a FAISS ID selector.
+SUBSET_SCAN_RATIO = 0.2
+
+# FAISS releases the GIL while searching, so shards are searched truly in parallel.
+_search_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="shard-search")
+
+
+def shard_name(rel_path: str) -> str:
+    """Top-level knowledge subfolder a file belongs to."""
+    parts = rel_path.replace(os.sep, "/").split("/")
+    return parts[0] if len(parts) > 1 else ROOT_SHARD
+
+
+def faiss_search(store: FAISS, query: np.ndarray, k: int, allowed: Optional[Set[str]] = None,
+                 positions: Optional[Dict[str, int]] = None) -> List[Tuple[str, float]]:
+    """
+    Nearest chunks of one FAISS store as (docstore_id, L2 distance). With allowed, only
+    those chunk IDs are searched; positions maps docstore IDs to FAISS positions.
+    """
+    index = store.index
+    if index.ntotal == 0:
+        return []
+    if allowed is None:
+        distances, indices = index.search(query, min(k, index.ntotal))
+    else:
+        if positions is None:
+            positions = {chunk_id: position for position, chunk_id in store.index_to_docstore_id.items()}
+        ids = np.fromiter((positions[c] for c in allowed if c in positions), dtype=np.int64)
+        if not len(ids):
+            return []
+        if len(ids) <= SUBSET_SCAN_RATIO * index.ntotal:
+            # Small subsets: exact squared-L2 scan of just those vectors, as IndexFlatL2 reports it.
+            vectors = index.reconstruct_batch(ids)
+            scanned = ((vectors - query) ** 2).sum(axis=1)
+            order = np.argsort(scanned)[:k]
+            distances, indices = scanned[order][None, :], ids[order][None, :]
+        else:
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+            distances, indices = index.search(query, min(k, len(ids)), params=params)
+    return [
+        (store.index_to_docstore_id[int(i)], float(d))
+        for d, i in zip(distances[0], indices[0])
+        if i != -1
+    ]
+
+
+class _ShardedDocstore:
+    """Docstore view that looks a chunk up in the shard that owns it."""
+
+    def __init__(self, sharded: "ShardedFAISS"):
+        self._sharded = sharded
+
+    def search(self, chunk_id: str):
+        shard = self._sharded.shards.get(self._sharded.owner.get(chunk_id))
+        if shard is None:
+            return f"ID {chunk_id} not found."
+        return shard.docstore.search(chunk_id)
+
+
+class ShardedFAISS:
+    """
+    One FAISS store per top-level knowledge subfolder. Offers the parts of the FAISS
+    vector store API the app uses, so it can stand in for models.db. Changes only
+    touch, save and reload the shards they affect.
+    """
+
+    def __init__(self, embedder, shard_of: Callable[[dict], str]):
+        self.embedder = embedder
+        self.shard_of = shard_of
+        self.shards: Dict[str, FAISS] = {}
+        self.owner: Dict[str, str] = {}
+        self.docstore = _ShardedDocstore(self)
+        self._positions: Dict[str, Dict[str, int]] = {}
+        self._dirty: Set[str] = set()
+        self._dropped: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.owner)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.index.ntotal for shard in self.shards.values())
+
+    @property
+    def index_to_docstore_id(self) -> Dict[int, str]:
+        """Sequential view over all chunk IDs; positions are not FAISS positions."""
+        return dict(enumerate(self.owner))
+
+    def _register(self, name: str, store: FAISS):
+        self.shards[name] = store
+        self._positions.pop(name, None)
+        for chunk_id in store.index_to_docstore_id.values():
+            self.owner[chunk_id] = name
+
+    def add_documents(self, documents: List[Document], ids: List[str]):
+        grouped: Dict[str, Tuple[List[Document], List[str]]] = {}
+        for doc, chunk_id in zip(documents, ids):
+            docs, chunk_ids = grouped.setdefault(self.shard_of(doc.metadata), ([], []))
+            docs.append(doc)
+            chunk_ids.append(chunk_id)
+        for name, (docs, chunk_ids) in grouped.items():
+            if name in self.shards:
+                self.shards[name].add_documents(docs, ids=chunk_ids)
+                self._register(name, self.shards[name])
+            else:
+                self._register(name, FAISS.from_documents(docs, self.embedder, ids=chunk_ids))
+                logging.info(f"Created index shard '{name}'.")
+            self._dirty.add(name)
+            self._dropped.discard(name)
+
+    def mark_changed(self, ids: Iterable[str]):
+        """Chunks whose stored metadata was edited in place; their shards are written on the next save."""
+        self._dirty.update(self.owner[chunk_id] for chunk_id in ids if chunk_id in self.owner)
+
+    def delete(self, ids: Iterable[str]):
+        grouped: Dict[str, List[str]] = {}
+        for chunk_id in ids:
+            name = self.owner.pop(chunk_id, None)
+            if name is not None:
+                grouped.setdefault(name, []).append(chunk_id)
+        for name, chunk_ids in grouped.items():
+            shard = self.shards[name]
+            shard.delete(chunk_ids)
+            self._positions.pop(name, None)
+            self._dirty.add(name)
+            if shard.index.ntotal == 0:
+                del self.shards[name]
+                self._dirty.discard(name)
+                self._dropped.add(name)
+
+    def iter_chunks(self, names: Optional[Iterable[str]] = None):
+        """Yield (docstore_id, Document) for every chunk, optionally of the given shards only."""
+        for name in list(names if names is not None else self.shards):
+            shard = self.shards.get(name)
+            if shard is None:
+                continue
+            for chunk_id in list(shard.index_to_docstore_id.values()):
+                doc = shard.docstore.search(chunk_id)
+                if isinstance(doc, Document):
+                    yield chunk_id, doc
+
+    def _shard_positions(self, name: str) -> Dict[str, int]:
+        positions = self._positions.get(name)
+        if positions is None:
+            positions = {c: p for p, c in self.shards[name].index_to_docstore_id.items()}
+            self._positions[name] = positions
+        return positions
+
+    def search(self, vector: List[float], k: int, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Search every shard that can hold a match in parallel and merge the top-k by distance."""
+        query = np.asarray([vector], dtype=np.float32)
+        if allowed is None:
+            names = list(self.shards)
+        else:
+            names = list({self.owner[c] for c in allowed if c in self.owner})
+        if not names:
+            return []
+        if len(names) == 1:
+            results = [self._search_shard(names[0], query, k, allowed)]
+        else:
+            results = list(_search_pool.map(lambda name: self._search_shard(name, query, k, allowed), names))
+        return heapq.nsmallest(k, (hit for hits in results for hit in hits), key=lambda hit: hit[1])
+
+    def _search_shard(self, name: str, query: np.ndarray, k: int, allowed: Optional[Set[str]]):
+        positions = self._shard_positions(name) if allowed is not None else None
+        return faiss_search(self.shards[name], query, k, allowed, positions)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        hits = self.search(embedding, k)
+        return [(self.docstore.search(chunk_id), distance) for chunk_id, distance in hits]
+
+    def save_local(self, index_path: str) -> List[str]:
+        """Write changed shards and remove emptied ones. Returns the names of the shards written."""
+        root = Path(index_path) / SHARDS_DIRNAME
+        saved = sorted(self._dirty)
+        for name in saved:
+            self.shards[name].save_local(str(root / name))
+        for name in self._dropped:
+            shutil.rmtree(root / name, ignore_errors=True)
+        self._dirty.clear()
+        self._dropped.clear()
+        return saved
+
+    def reload_shards(self, index_path: str, names: Iterable[str]):
+        """Re-read the given shards from disk, leaving every other shard untouched."""
+        root = Path(index_path) / SHARDS_DIRNAME
+        for name in names:
+            for chunk_id in [c for c, owner in self.owner.items() if owner == name]:
+                del self.owner[chunk_id]
+            self.shards.pop(name, None)
+            if (root / name).exists():
+                self._register(name, FAISS.load_local(str(root / name), self.embedder, allow_dangerous_deserialization=True))
+                logging.info(f"Reloaded index shard '{name}'.")
+
+    @classmethod
+    def load_local(cls, index_path: str, embedder, shard_of: Callable[[dict], str]) -> "ShardedFAISS":
+        """Load every shard under index_path; raises FileNotFoundError if there are none."""
+        root = Path(index_path) / SHARDS_DIRNAME
+        if not root.is_dir():
+            raise FileNotFoundError(f"No index shards in {root}")
+        sharded = cls(embedder, shard_of)
+        sharded.reload_shards(index_path, sorted(p.name for p in root.iterdir() if p.is_dir()))
+        logging.info(f"Loaded {len(sharded.shards)} index shards with {len(sharded)} chunks.")
+        return sharded
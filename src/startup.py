@@ -0,0 +1,172 @@
+# src/startup.py
+import os
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from src import models
+from src.database import init_storage, DEFAULT_SQLITE_PATH
+from src.indexing import initial_scan_and_index
+from src.file_watcher import start_file_watcher_background
+from src.knowledge_collections import manager as collection_manager, DEFAULT_COLLECTION
+
+# Readiness stages in the order the UI reports them.
+#   database  - interaction logging is connected
+#   index     - the persisted FAISS index is in memory
+#   retrieval - embedder and index are loaded, search-only answers work
+#   llm       - the GGUF model is loaded, generated answers work
+#   scan      - the knowledge folder has been scanned and the watcher is running
+STAGES = ("database", "index", "retrieval", "llm", "scan")
+
+
+class StartupState:
+    """Thread-safe readiness tracker shared between the loader threads and the UI."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready: Dict[str, bool] = {stage: False for stage in STAGES}
+        self._errors: Dict[str, str] = {}
+        self._disabled: Dict[str, str] = {}
+        self._timings: Dict[str, float] = {}
+        self._started_at = time.perf_counter()
+        self._stage_started: Dict[str, float] = {}
+        # Settings the resources were loaded with and the running knowledge folder watcher (see hot_reload).
+        self.settings: dict = {}
+        self.observer = None
+
+    def mark_ready(self, stage: str):
+        with self._lock:
+            self._ready[stage] = True
+            self._timings[stage] = time.perf_counter() - self._stage_started.get(stage, self._started_at)
+        logging.info(f"Startup stage '{stage}' ready after {self._timings[stage]:.1f}s")
+
+    def mark_loading(self, stage: str):
+        """Put a stage back into the loading state, e.g. while it is being reloaded."""
+        with self._lock:
+            self._ready[stage] = False
+            self._errors.pop(stage, None)
+            self._disabled.pop(stage, None)
+            self._timings.pop(stage, None)
+            self._stage_started[stage] = time.perf_counter()
+
+    def mark_failed(self, stage: str, error: str):
+        with self._lock:
+            self._errors[stage] = error
+        logging.error(f"Startup stage '{stage}' failed: {error}")
+
+    def mark_disabled(self, stage: str, reason: str):
+        with self._lock:
+            self._disabled[stage] = reason
+        logging.info(f"Startup stage '{stage}' disabled: {reason}")
+
+    def is_ready(self, stage: str) -> bool:
+        with self._lock:
+            return self._ready[stage]
+
+    def is_settled(self, stage: str) -> bool:
+        """True once a stage has finished, failed or been disabled."""
+        with self._lock:
+            return self._ready[stage] or stage in self._errors or stage in self._disabled
+
+    def all_settled(self) -> bool:
+        return all(self.is_settled(stage) for stage in STAGES)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "ready": dict(self._ready),
+                "errors": dict(self._errors),
+                "disabled": dict(self._disabled),
+                "timings": dict(self._timings),
+            }
+
+
+def _init_database(state: StartupState, mysql_config: dict, storage_backend: str = "mysql",
+                   sqlite_path: str = DEFAULT_SQLITE_PATH):
+    try:
+        init_storage(storage_backend, mysql_config=mysql_config, sqlite_path=sqlite_path)
+        state.mark_ready("database")
+    except Exception as e:
+        state.mark_failed("database", f"{e}. Continuing without database logging.")
+
+
+def _init_llm(state: StartupState, llm_model_path: str, llm_params: Optional[dict], with_llm: bool = True):
+    if not with_llm:
+        state.mark_disabled("llm", "LLM loading is turned off; answers are extractive.")
+        return
+    if models.load_llm(llm_model_path, llm_params):
+        state.mark_ready("llm")
+    else:
+        state.mark_failed("llm", f"Could not load the LLM from {llm_model_path}. Only search results are available.")
+
+
+def _init_pipeline(state: StartupState, knowledge_dir: str, index_path: str, llm_model_path: str,
+                   embedding_model_name: str, chunk_size: int, chunk_overlap: int, llm_params: Optional[dict],
+                   with_llm: bool, shard_by_folder: bool):
+    if not models.load_embedder(embedding_model_name, chunk_size, chunk_overlap):
+        for stage in ("index", "retrieval", "scan"):
+            state.mark_failed(stage, f"Could not load the embedding model {embedding_model_name}.")
+        _init_llm(state, llm_model_path, llm_params, with_llm)
+        return
+
+    models.knowledge_dir = os.path.abspath(knowledge_dir)
+    models.shard_by_folder = shard_by_folder
+    if models.load_index(index_path):
+        state.mark_ready("index")
+        state.mark_ready("retrieval")
+    # Otherwise search becomes available once the scan below has built the index.
+
+    # The LLM loads alongside the folder scan; search keeps working from the persisted index meanwhile.
+    threading.Thread(target=_init_llm, args=(state, llm_model_path, llm_params, with_llm), daemon=True, name="startup-llm").start()
+
+    try:
+        initial_scan_and_index(knowledge_dir, index_path)
+        state.observer = start_file_watcher_background(
+            knowledge_dir, index_path, context=lambda: collection_manager.activate(DEFAULT_COLLECTION)
+        )
+        state.mark_ready("scan")
+    except Exception as e:
+        state.mark_failed("scan", str(e))
+    _settle_index(state)
+
+
+def _settle_index(state: StartupState):
+    """After the folder scan, mark the index stages ready if there is an index now and failed if not."""
+    if state.is_ready("index"):
+        return
+    for stage in ("index", "retrieval"):
+        if models.db is not None:
+            state.mark_ready(stage)
+        else:
+            state.mark_failed(stage, "No index could be loaded and the knowledge folder has no documents to build one from.")
+
+
+def start_background_initialization(knowledge_dir: str, index_path: str, llm_model_path: str, embedding_model_name: str,
+                                    chunk_size: int, chunk_overlap: int, mysql_config: dict,
+                                    llm_params: Optional[dict] = None, with_llm: bool = True,
+                                    shard_by_folder: bool = False, storage_backend: str = "mysql",
+                                    sqlite_path: str = DEFAULT_SQLITE_PATH) -> StartupState:
+    """
+    Start loading all resources in background threads and return immediately.
+    Poll the returned StartupState to find out what is usable. With with_llm=False the
+    GGUF model is never loaded. With shard_by_folder the index is kept as one shard per
+    top-level knowledge folder. storage_backend selects where interactions are logged:
+    "mysql" (mysql_config) or "sqlite" (the embedded database at sqlite_path).
+    """
+    logging.info(f"--- Starting background initialization for KNOWLEDGE_DIR: {knowledge_dir} ---")
+    Path(knowledge_dir).mkdir(parents=True, exist_ok=True)
+    state = StartupState()
+    collection_manager.set_default(knowledge_dir, index_path)
+
+    threading.Thread(target=_init_database, args=(state, mysql_config, storage_backend, sqlite_path), daemon=True,
+                     name="startup-db").start()
+    threading.Thread(
+        target=_init_pipeline,
+        args=(state, knowledge_dir, index_path, llm_model_path, embedding_model_name, chunk_size, chunk_overlap,
+              llm_params, with_llm, shard_by_folder),
+        daemon=True,
+        name="startup-pipeline",
+    ).start()
+    return state
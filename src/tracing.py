@@ -0,0 +1,282 @@
+# src/tracing.py
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Spans are written one JSON object per line; the file rotates at TRACE_MAX_BYTES, keeping TRACE_BACKUPS old files.
+DEFAULT_TRACE_PATH = "traces/spans.jsonl"
+# Set to 1 to trace from startup on.
+ENV_VAR = "SYNTHCEREBRUM_TRACING"
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+# Upper bounds (seconds) of the span duration histogram buckets in the Prometheus output.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Checked first by every span; while False, span() returns a shared no-op span
+# and locked() returns the lock itself, so disabled tracing costs one attribute lookup.
+enabled = False
+
+_trace_logger = logging.getLogger("synthcerebrum.trace")
+_trace_logger.propagate = False
+_listener: Optional[QueueListener] = None
+_config_lock = threading.Lock()
+# Configured trace file, and the file the running listener writes to (None while stopped).
+_trace_path = DEFAULT_TRACE_PATH
+_listener_path: Optional[str] = None
+_ids = iter(range(1, 1 << 62))
+_current: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+_stats_lock = threading.Lock()
+# span name -> [count, sum of seconds, per-bucket counts (non-cumulative, last one is +Inf)]
+_stats: Dict[str, list] = {}
+
+
+def settings() -> dict:
+    """The process-wide tracing configuration, as set by configure() and serve_metrics()."""
+    return {
+        "enabled": enabled,
+        "trace_path": _trace_path,
+        "metrics_port": _metrics_server.server_address[1] if _metrics_server is not None else 0,
+    }
+
+
+def configure_from_env():
+    """Turn tracing on at startup if SYNTHCEREBRUM_TRACING=1."""
+    if os.environ.get(ENV_VAR) == "1":
+        configure(True)
+
+
+def configure(enable: bool, trace_path: str = DEFAULT_TRACE_PATH):
+    """
+    Turn tracing on or off for the whole process. Spans are written to trace_path by a
+    background thread.
+    """
+    global enabled, _listener, _trace_path, _listener_path
+    with _config_lock:
+        _trace_path = trace_path
+        if enable and (_listener is None or trace_path != _listener_path):
+            _stop_listener()
+            Path(trace_path).parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(trace_path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS,
+                                          encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            # Callers only enqueue; the file is written off the request path.
+            span_queue: "queue.Queue" = queue.Queue(maxsize=100000)
+            _trace_logger.handlers = [QueueHandler(span_queue)]
+            _trace_logger.setLevel(logging.INFO)
+            _listener = QueueListener(span_queue, handler)
+            _listener.start()
+            _listener_path = trace_path
+            logging.info(f"Tracing enabled; writing spans to {trace_path}")
+        elif not enable and _listener is not None:
+            _stop_listener()
+            logging.info("Tracing disabled.")
+        enabled = enable
+
+
+def _stop_listener():
+    global _listener, _listener_path
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _trace_logger.handlers = []
+        _listener = None
+        _listener_path = None
+
+
+atexit.register(_stop_listener)
+
+
+def _observe(name: str, seconds: float):
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2][bisect_left(BUCKETS, seconds)] += 1
+
+
+def _emit(name: str, span_id: int, parent: Optional[tuple], started: float, seconds: float, attrs: dict):
+    _observe(name, seconds)
+    record = {
+        "trace": parent[0] if parent else span_id,
+        "span": span_id,
+        "parent": parent[1] if parent else None,
+        "name": name,
+        # Wall-clock start, from the monotonic duration.
+        "start": time.time() - (time.perf_counter() - started),
+        "duration_ms": round(seconds * 1000, 3),
+        "thread": threading.current_thread().name,
+    }
+    if attrs:
+        record["attrs"] = attrs
+    try:
+        _trace_logger.info(json.dumps(record, default=str))
+    except Exception:
+        pass  # a full queue or unserializable attribute never breaks the traced code
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "span_id", "parent", "started", "_token")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Attach attributes known only inside the span, e.g. result counts."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.span_id = next(_ids)
+        self.parent = _current.get()
+        self._token = _current.set((self.parent[0] if self.parent else self.span_id, self.span_id))
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _emit(self.name, self.span_id, self.parent, self.started, seconds, self.attrs)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """
+    Context manager timing a stage as a span, nested under the enclosing span of the
+    same thread. The span object's set() adds attributes.
+    """
+    if not enabled:
+        return _NOOP_SPAN
+    return _Span(name, attrs)
+
+
+def record(name: str, started: float, finished: float, **attrs):
+    """Emit a span for an interval measured with time.perf_counter(), e.g. time to first token."""
+    if not enabled:
+        return
+    parent = _current.get()
+    _emit(name, next(_ids), parent, started, finished - started, attrs)
+
+
+class _TimedLock:
+    __slots__ = ("lock", "name")
+
+    def __init__(self, lock, name: str):
+        self.lock = lock
+        self.name = name
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        record(f"{self.name}.wait", started, time.perf_counter())
+        return self.lock
+
+    def __exit__(self, exc_type, exc, tb):
+        self.lock.release()
+        return False
+
+
+def locked(lock, name: str):
+    """Use in place of `with lock:`; the time spent waiting for the lock is recorded as a "<name>.wait" span."""
+    if not enabled:
+        return lock
+    return _TimedLock(lock, name)
+
+
+def prometheus_text() -> str:
+    """Span duration histograms in the Prometheus text exposition format."""
+    with _stats_lock:
+        snapshot = {name: (count, total, list(buckets)) for name, (count, total, buckets) in _stats.items()}
+    lines = [
+        "# HELP synthcerebrum_span_duration_seconds Duration of traced pipeline stages.",
+        "# TYPE synthcerebrum_span_duration_seconds histogram",
+    ]
+    for name in sorted(snapshot):
+        count, total, buckets = snapshot[name]
+        label = name.replace("\\", "\\\\").replace('"', '\\"')
+        cumulative = 0
+        for bound, n in zip(list(BUCKETS) + ["+Inf"], buckets):
+            cumulative += n
+            le = bound if bound == "+Inf" else repr(float(bound))
+            lines.append(f'synthcerebrum_span_duration_seconds_bucket{{span="{label}",le="{le}"}} {cumulative}')
+        lines.append(f'synthcerebrum_span_duration_seconds_sum{{span="{label}"}} {total:.6f}')
+        lines.append(f'synthcerebrum_span_duration_seconds_count{{span="{label}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def span_summary() -> List[dict]:
+    """Count, total and mean duration per span name, slowest total first."""
+    with _stats_lock:
+        rows = [{"span": name, "count": c, "total_s": t, "mean_ms": t / c * 1000 if c else 0.0}
+                for name, (c, t, _) in _stats.items()]
+    return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not worth a log line each
+
+
+_metrics_server: Optional[ThreadingHTTPServer] = None
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Serve prometheus_text() at http://host:port/metrics from a daemon thread; port 0 stops serving."""
+    global _metrics_server
+    with _config_lock:
+        if _metrics_server is not None and _metrics_server.server_address[1] == port:
+            return
+        if _metrics_server is not None:
+            _metrics_server.shutdown()
+            _metrics_server.server_close()
+            _metrics_server = None
+        if not port:
+            return
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            logging.error(f"Cannot serve metrics on port {port}: {e}")
+            return
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True, name="metrics-http").start()
+        logging.info(f"Serving Prometheus metrics at http://{host}:{port}/metrics")
@@ -0,0 +1,132 @@
+# src/tuning.py
+import os
+import json
+import time
+import logging
+import platform
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import psutil
+
+from src.models import build_llama_kwargs
+
+# Where the best calibration result for this host is stored.
+PROFILE_PATH = "llm_profile.json"
+
+# Synthetic prompt used for benchmarking; repeated until it reaches the requested token count.
+_BENCH_TEXT = (
+    "The knowledge base contains policies, resumes, reports and source code. "
+    "Summarize the relevant parts of the context and answer the question precisely. "
+)
+
+
+def _default_thread_options() -> List[int]:
+    """Candidate thread counts around the number of physical cores."""
+    physical = psutil.cpu_count(logical=False) or 1
+    logical = psutil.cpu_count(logical=True) or physical
+    options = {max(1, physical // 2), physical, logical}
+    return sorted(options)
+
+
+def _benchmark(llm, prompt_tokens: List[int], gen_tokens: int) -> dict:
+    """Measure prompt-eval and generation throughput for one loaded model."""
+    llm.reset()
+    start = time.perf_counter()
+    first_token_at = None
+    generated = 0
+    for _ in llm.generate(prompt_tokens, temp=0.0, reset=True):
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        generated += 1
+        if generated >= gen_tokens:
+            break
+    end = time.perf_counter()
+
+    prompt_seconds = (first_token_at or end) - start
+    gen_seconds = end - (first_token_at or end)
+    return {
+        "prompt_tps": len(prompt_tokens) / prompt_seconds if prompt_seconds > 0 else 0.0,
+        "gen_tps": (generated - 1) / gen_seconds if generated > 1 and gen_seconds > 0 else 0.0,
+    }
+
+
+def calibrate_llm_params(
+    llm_model_path: str,
+    llm_params: Optional[dict] = None,
+    thread_options: Optional[List[int]] = None,
+    batch_options: Optional[List[int]] = None,
+    prompt_tokens: int = 512,
+    gen_tokens: int = 32,
+) -> dict:
+    """
+    Benchmark thread/batch combinations for the GGUF model on this host.
+    Every other runtime parameter is taken from llm_params. Returns a profile dict
+    whose n_threads/n_batch minimize the estimated latency of a typical request.
+    """
+    from llama_cpp import Llama
+
+    thread_options = thread_options or _default_thread_options()
+    batch_options = batch_options or [128, 256, 512]
+    base_kwargs = build_llama_kwargs(llm_params)
+    model_kwargs = base_kwargs.pop("model_kwargs")
+    base_kwargs.pop("f16_kv")
+
+    results = []
+    for n_batch in batch_options:
+        for n_threads in thread_options:
+            kwargs = {**base_kwargs, **model_kwargs, "n_batch": n_batch, "n_threads": n_threads, "n_threads_batch": n_threads}
+            logging.info(f"Calibrating llama.cpp with n_threads={n_threads}, n_batch={n_batch}")
+            try:
+                llm = Llama(model_path=llm_model_path, verbose=False, **kwargs)
+                tokens = llm.tokenize(_BENCH_TEXT.encode("utf-8"))
+                tokens = (tokens * (prompt_tokens // max(len(tokens), 1) + 1))[:prompt_tokens]
+                tokens = tokens[: max(1, min(len(tokens), llm.n_ctx() - gen_tokens - 1))]
+                scores = _benchmark(llm, tokens, gen_tokens)
+                del llm
+            except Exception as e:
+                logging.error(f"Calibration run failed for n_threads={n_threads}, n_batch={n_batch}: {e}")
+                continue
+            est_latency = (
+                (prompt_tokens / scores["prompt_tps"] if scores["prompt_tps"] else float("inf"))
+                + (gen_tokens / scores["gen_tps"] if scores["gen_tps"] else float("inf"))
+            )
+            results.append({"n_threads": n_threads, "n_batch": n_batch, "est_latency_s": est_latency, **scores})
+
+    if not results:
+        raise RuntimeError("All calibration runs failed; see the logs for details.")
+
+    best = min(results, key=lambda r: r["est_latency_s"])
+    return {
+        "host": platform.node(),
+        "model": os.path.basename(llm_model_path),
+        "calibrated_at": datetime.now().isoformat(timespec="seconds"),
+        "n_threads": best["n_threads"],
+        "n_batch": best["n_batch"],
+        "prompt_tps": best["prompt_tps"],
+        "gen_tps": best["gen_tps"],
+        "results": results,
+    }
+
+
+def save_llm_profile(profile: dict, profile_path: str = PROFILE_PATH):
+    """Persist a calibration profile as JSON."""
+    Path(profile_path).write_text(json.dumps(profile, indent=4), encoding="utf-8")
+    logging.info(f"Saved LLM runtime profile to {profile_path}")
+
+
+def load_llm_profile(profile_path: str = PROFILE_PATH) -> Optional[dict]:
+    """Load the stored calibration profile if it was produced on this host."""
+    path = Path(profile_path)
+    if not path.exists():
+        return None
+    try:
+        profile = json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable LLM profile {profile_path}: {e}")
+        return None
+    if profile.get("host") != platform.node():
+        logging.info("Stored LLM profile was calibrated on another host; ignoring it.")
+        return None
+    return profile
@@ -0,0 +1,190 @@
+# src/upload_jobs.py
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from src import models
+from src.indexing import refresh_files_in_index
+from src.knowledge_catalog import catalog_for
+
+# Uploads are copied to disk this many bytes at a time.
+WRITE_CHUNK_BYTES = 1 << 20
+# Suffix of files still being written; the file watcher ignores them.
+PARTIAL_SUFFIX = ".part"
+# Files embedded per index update; the index is saved once per update.
+INDEX_BATCH_FILES = 8
+# Finished files kept for the progress view.
+HISTORY = 200
+
+# File states, in order.
+QUEUED, WRITING, WAITING, INDEXING, DONE, FAILED = "queued", "writing", "waiting", "indexing", "done", "failed"
+
+
+def safe_relative_path(name: str, subfolder: str = "") -> str:
+    """
+    Relative destination of an uploaded file inside the knowledge folder. Directory
+    parts of the uploaded name are kept; anything that would leave the folder is refused.
+    """
+    parts = [p for p in PurePosixPath(subfolder.replace("\\", "/")).parts + PurePosixPath(name.replace("\\", "/")).parts
+             if p not in ("", ".", "/")]
+    if not parts or any(p == ".." or ":" in p for p in parts):
+        raise ValueError(f"Invalid upload path: {os.path.join(subfolder, name)}")
+    return "/".join(parts)
+
+
+class FileJob:
+    def __init__(self, job_id: int, rel_path: str, path: str, size: int):
+        self.id = job_id
+        self.rel_path = rel_path
+        self.path = path
+        self.size = size
+        self.written = 0
+        self.state = QUEUED
+        self.error: Optional[str] = None
+        self.chunks = 0
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {key: getattr(self, key) for key in
+                ("id", "rel_path", "size", "written", "state", "error", "chunks", "submitted_at", "finished_at")}
+
+
+class UploadQueue:
+    """
+    Single background worker that writes uploaded files into the knowledge folder in
+    chunks and then indexes them a few files at a time, so neither the upload size nor
+    the embedding time blocks the page. Per-file progress is available from snapshot().
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._files: "OrderedDict[int, FileJob]" = OrderedDict()
+        self._claims: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._worker = None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True, name="upload-indexer")
+                self._worker.start()
+
+    def submit(self, uploads: List[Tuple[BinaryIO, str, int]], knowledge_dir: str, index_path: str,
+               context: Optional[Callable] = None) -> List[FileJob]:
+        """
+        Queue (file object, relative destination, size) uploads. The file objects are read
+        by the worker, so they must stay readable after the call. Context returns a context
+        manager entered around each index update, as for the file watcher.
+        """
+        jobs = []
+        with self._lock:
+            for source, rel_path, size in uploads:
+                self._next_id += 1
+                path = os.path.join(os.path.abspath(knowledge_dir), *rel_path.split("/"))
+                job = FileJob(self._next_id, rel_path, path, size)
+                self._files[job.id] = job
+                jobs.append((job, source))
+            self._prune()
+        self._ensure_worker()
+        self._queue.put((jobs, knowledge_dir, index_path, context or nullcontext))
+        return [job for job, _ in jobs]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._files.items() if job.state in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(self._files) - HISTORY)]:
+            del self._files[job_id]
+
+    def owns(self, path: str) -> bool:
+        """
+        True if the file at path is one this queue wrote and indexes itself, unchanged
+        since; the file watcher leaves such files alone.
+        """
+        path = os.path.abspath(path)
+        claimed = self._claims.get(path)
+        if claimed is None:
+            return False
+        try:
+            return os.path.getmtime(path) == claimed
+        except OSError:
+            return False
+
+    def _write(self, job: FileJob, source: BinaryIO):
+        job.state = WRITING
+        os.makedirs(os.path.dirname(job.path), exist_ok=True)
+        partial = job.path + PARTIAL_SUFFIX
+        source.seek(0)
+        with open(partial, "wb") as f:
+            while True:
+                block = source.read(WRITE_CHUNK_BYTES)
+                if not block:
+                    break
+                f.write(block)
+                job.written += len(block)
+        # Claimed before it appears under its real name, so the watcher never indexes it as well.
+        self._claims[job.path] = os.path.getmtime(partial)
+        os.replace(partial, job.path)
+        job.state = WAITING
+
+    def _index(self, jobs: List[FileJob], knowledge_dir: str, index_path: str, context: Callable):
+        for job in jobs:
+            job.state = INDEXING
+        try:
+            with context():
+                refresh_files_in_index([job.path for job in jobs], index_path, knowledge_dir=knowledge_dir)
+                # Taken while the collection is active; the globals may hold another one once the block exits.
+                metadata_index = models.metadata_index
+        except Exception as e:
+            logging.error(f"Indexing uploads failed: {e}")
+            for job in jobs:
+                job.state, job.error, job.finished_at = FAILED, str(e), time.time()
+            return
+        for job in jobs:
+            job.chunks, indexed_at = metadata_index.file_status(job.rel_path)
+            job.state, job.finished_at = DONE, time.time()
+            if indexed_at is None:
+                job.error = "No text could be extracted (unsupported or empty file)."
+
+    def _run(self):
+        while True:
+            jobs, knowledge_dir, index_path, context = self._queue.get()
+            catalog = catalog_for(knowledge_dir)
+            written = []
+            for job, source in jobs:
+                try:
+                    self._write(job, source)
+                    catalog.file_changed(job.path)
+                    written.append(job)
+                except Exception as e:
+                    logging.error(f"Failed to save upload {job.rel_path}: {e}")
+                    job.state, job.error, job.finished_at = FAILED, str(e), time.time()
+                finally:
+                    source.close()
+            for start in range(0, len(written), INDEX_BATCH_FILES):
+                self._index(written[start:start + INDEX_BATCH_FILES], knowledge_dir, index_path, context)
+            logging.info(f"Finished {len(jobs)} uploaded files.")
+
+    def snapshot(self) -> List[dict]:
+        """Every tracked file, newest first."""
+        with self._lock:
+            return [job.as_dict() for job in reversed(self._files.values())]
+
+    def active(self) -> bool:
+        with self._lock:
+            return any(job.state not in (DONE, FAILED) for job in self._files.values())
+
+    def clear_finished(self):
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._files.items() if job.state in (DONE, FAILED)]:
+                del self._files[job_id]
+
+
+# Shared instance used by the Knowledge Base page.
+uploads = UploadQueue()